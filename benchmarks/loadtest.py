@@ -0,0 +1,91 @@
+from typing import Callable
+import asyncio
+import random
+import statistics
+import time
+import httpx
+from stroke_api import filters
+
+# Request mix of the load test : (weight, function building the URL)
+SCENARIO = {
+    "patient_by_id": (50, lambda ids: f"/patients/{random.choice(ids)}"),
+    "patients_filtered": (20, lambda ids: f"/patients/?gender={random.choice(['Male', 'Female'])}"
+                                          f"&stroke={random.randint(0, 1)}&max_age={random.randint(1, 100)}"),
+    "patients_page": (10, lambda ids: f"/patients/?limit=100&after_id={random.choice(ids)}"),
+    "stats": (15, lambda ids: f"/stats/?max_age={random.randint(1, 100)}"),
+    "aggregate": (5, lambda ids: "/aggregate?group_by=stroke&metric=count&metric=mean:bmi"),
+}
+
+
+# function that computes latency percentiles
+def percentiles(latencies: list) -> dict:
+    """
+    Summarize latencies (in milliseconds) with p50 / p95 / p99 and max.
+
+    Args:
+        latencies (list): Latencies in milliseconds.
+
+    Returns:
+        dict: Percentiles.
+    """
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    cuts = statistics.quantiles(ordered, n=100, method='inclusive') if len(ordered) > 1 else ordered * 99
+    return {
+        "count": len(ordered),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+# function that runs the load test against the ASGI app, in-process
+async def run_load(app, n_requests: int = 2000, concurrency: int = 16, seed: int = 0) -> dict:
+    """
+    Send a mix of requests to the FastAPI app through an in-process ASGI transport.
+
+    Args:
+        app: FastAPI application.
+        n_requests (int, optional): Total number of requests.
+        concurrency (int, optional): Number of concurrent clients.
+        seed (int, optional): Random seed of the request mix.
+
+    Returns:
+        dict: Throughput, error count and latency percentiles (overall and per endpoint).
+    """
+    random.seed(seed)
+    ids = filters.current_dataset().df['id'].tolist()
+    names = list(SCENARIO)
+    weights = [SCENARIO[name][0] for name in names]
+    plan = random.choices(names, weights=weights, k=n_requests)
+    queue = iter(plan)
+    latencies = {name: [] for name in names}
+    errors = 0
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors
+        for name in queue:
+            url = SCENARIO[name][1](ids)
+            start = time.perf_counter()
+            response = await client.get(url)
+            latencies[name].append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 500:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(n_requests / elapsed, 2),
+        "latency": percentiles(all_latencies),
+        "endpoints": {name: percentiles(values) for name, values in latencies.items()},
+    }
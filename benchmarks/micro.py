@@ -0,0 +1,74 @@
+from pathlib import Path
+from typing import Callable
+import statistics
+import time
+import numpy as np
+from stroke_api import filters
+from stroke_api.stats import StatsAggregator
+from stroke_api.store import DatasetStore
+
+
+# function that times a function call several times
+def time_call(fn: Callable, repeat: int = 5) -> dict:
+    """
+    Call a function `repeat` times and summarize the durations.
+
+    Args:
+        fn (Callable): Function to time (called without arguments).
+        repeat (int, optional): Number of calls.
+
+    Returns:
+        dict: min / median / mean duration in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(durations), 4),
+        "median_ms": round(statistics.median(durations), 4),
+        "mean_ms": round(statistics.fmean(durations), 4),
+    }
+
+
+# function that runs the micro-benchmarks of filters.py and the stats on one dataset
+def run_micro(data_path: Path, repeat: int = 5, seed: int = 0) -> dict:
+    """
+    Micro-benchmark dataset loading, filter_patient, get_info_by_id and the stats.
+
+    The filters module is pointed at the given data file, so the code paths
+    measured are the ones used by the API.
+
+    Args:
+        data_path (Path): Parquet dataset.
+        repeat (int, optional): Number of calls per benchmark.
+        seed (int, optional): Random seed for the ids looked up.
+
+    Returns:
+        dict: benchmark name -> timings.
+    """
+    filters.store = DatasetStore(data_path)
+    start = time.perf_counter()
+    dataset = filters.current_dataset()
+    results = {"load_dataset": {"min_ms": round((time.perf_counter() - start) * 1000, 4)}}
+
+    rng = np.random.default_rng(seed)
+    ids = dataset.df['id'].to_numpy()
+    lookup_ids = rng.choice(ids, size=repeat)
+    lookups = iter(lookup_ids.tolist())
+
+    benchmarks = {
+        "filter_patient_all": lambda: filters.filter_patient(),
+        "filter_patient_gender_stroke_age": lambda: filters.filter_patient(gender="Male", stroke=1, max_age=60),
+        "filter_patient_max_age": lambda: filters.filter_patient(max_age=30),
+        "select_patients_all": lambda: filters.select_patients(),
+        "get_info_by_id": lambda: filters.get_info_by_id(next(lookups)),
+        "get_patients_batch_1000": lambda: filters.get_patients_batch(rng.choice(ids, size=1000)),
+        "stats_compute": lambda: dataset.stats.compute(),
+        "stats_compute_filtered": lambda: dataset.stats.compute(gender="Female", stroke=0, max_age=50),
+        "stats_build": lambda: StatsAggregator(dataset.df),
+    }
+    for name, fn in benchmarks.items():
+        results[name] = time_call(fn, repeat)
+    return results
@@ -0,0 +1,138 @@
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+# Default output directories
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DATA_DIR = BENCHMARK_DIR / "data"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+# Default dataset sizes (rows); up to 10M can be requested with --sizes
+DEFAULT_SIZES = [5_000, 50_000, 500_000]
+
+
+# function that reads the peak resident memory of the current process
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# function that benchmarks one dataset size (runs in its own process)
+def run_size(n_rows: int, options: dict) -> dict:
+    """
+    Generate the dataset, run the micro-benchmarks and the load test for one size.
+    Each size runs in a fresh process so the peak RSS is measured per size.
+
+    Args:
+        n_rows (int): Number of patients.
+        options (dict): Command line options.
+
+    Returns:
+        dict: Results of the size.
+    """
+    from benchmarks.loadtest import run_load
+    from benchmarks.micro import run_micro
+    from benchmarks.synthetic import write_dataset
+    from stroke_api import cache
+
+    data_path = write_dataset(n_rows, Path(options["data_dir"]), seed=options["seed"])
+    result = {"rows": n_rows, "micro": run_micro(data_path, repeat=options["repeat"], seed=options["seed"])}
+
+    if options["requests"] > 0:
+        if options["no_cache"]:
+            cache.response_cache.max_bytes = 0
+        from stroke_api.main import app
+        result["load"] = asyncio.run(
+            run_load(app, options["requests"], options["concurrency"], seed=options["seed"])
+        )
+
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+
+# function that compares two result files
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare median timings and load-test percentiles with a baseline run.
+
+    Args:
+        current (dict): Results of this run.
+        baseline (dict): Results of a previous run.
+        threshold (float): Relative slowdown reported as a regression (0.1 = 10%).
+
+    Returns:
+        list: One line per compared metric, regressions marked with "REGRESSION".
+    """
+    lines = []
+    baseline_sizes = {run["rows"]: run for run in baseline.get("runs", [])}
+    for run in current["runs"]:
+        old = baseline_sizes.get(run["rows"])
+        if old is None:
+            continue
+        metrics = {f"micro.{name}": (timing.get("median_ms", timing.get("min_ms")),
+                                     old["micro"].get(name, {}).get("median_ms", old["micro"].get(name, {}).get("min_ms")))
+                   for name, timing in run["micro"].items()}
+        if "load" in run and "load" in old:
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                metrics[f"load.{key}"] = (run["load"]["latency"].get(key), old["load"]["latency"].get(key))
+        for name, (new_value, old_value) in metrics.items():
+            if not new_value or not old_value:
+                continue
+            change = new_value / old_value - 1
+            flag = "  REGRESSION" if change > threshold else ""
+            lines.append(f"{run['rows']:>10} {name:<45} {old_value:>12.3f} -> {new_value:>12.3f} ms ({change:+.1%}){flag}")
+    return lines
+
+
+def main(argv=None):
+    """Command line entry point : python -m benchmarks.run"""
+    parser = argparse.ArgumentParser(description="Benchmark the stroke_api filters, stats and endpoints.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Dataset sizes (rows)")
+    parser.add_argument("--repeat", type=int, default=5, help="Calls per micro-benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests of the load test (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients of the load test")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache during the load test")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="Where synthetic datasets are stored")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="Previous result file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    options = vars(args)
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for n_rows in args.sizes:
+        print(f"Benchmarking {n_rows} rows ...", flush=True)
+        with context.Pool(1) as process:
+            runs.append(process.apply(run_size, (n_rows, options)))
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "options": {key: value for key, value in options.items() if key not in ("output", "baseline")},
+        "runs": runs,
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        for line in compare(results, baseline, args.threshold):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Value distributions observed in clean_health.parquet
+CATEGORICAL_DISTRIBUTIONS = {
+    'gender': {'Female': 0.5859, 'Male': 0.4139, 'Other': 0.0002},
+    'ever_married': {'Yes': 0.6562, 'No': 0.3438},
+    'work_type': {'Private': 0.5724, 'Self-employed': 0.1603, 'children': 0.1344,
+                  'Govt_job': 0.1286, 'Never_worked': 0.0043},
+    'Residence_type': {'Urban': 0.508, 'Rural': 0.492},
+    'smoking_status': {'never smoked': 0.3703, 'Unknown': 0.3022, 'formerly smoked': 0.1732, 'smokes': 0.1544},
+}
+
+# Column order of clean_health.parquet
+COLUMNS = [
+    'id', 'gender', 'age', 'hypertension', 'heart_disease', 'ever_married', 'work_type',
+    'Residence_type', 'avg_glucose_level', 'bmi', 'smoking_status', 'stroke'
+]
+
+
+# function that generates a synthetic stroke dataset
+def make_dataset(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic patient dataset with the schema of clean_health.parquet.
+
+    Categorical columns follow the proportions of the real data; age, glucose and
+    bmi stay in the documented ranges, and stroke / hypertension / heart disease
+    become more frequent with age.
+
+    Args:
+        n_rows (int): Number of patients.
+        seed (int, optional): Random seed.
+
+    Returns:
+        pd.DataFrame: Synthetic patients.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+
+    # Unique ids, in random order like the real file
+    data['id'] = rng.permutation(n_rows * 2)[:n_rows].astype(np.int64) + 1
+
+    # Ages : whole years, with fractions for babies
+    age = rng.uniform(0.08, 82.0, n_rows)
+    data['age'] = np.where(age < 2, np.round(age, 2), np.floor(age))
+
+    for column, distribution in CATEGORICAL_DISTRIBUTIONS.items():
+        values = np.array(list(distribution), dtype=object)
+        probabilities = np.array(list(distribution.values()))
+        data[column] = values[rng.choice(len(values), n_rows, p=probabilities / probabilities.sum())]
+
+    # Binary flags, more frequent with age
+    age_factor = data['age'] / 82.0
+    data['hypertension'] = (rng.random(n_rows) < 0.2 * age_factor).astype(np.int64)
+    data['heart_disease'] = (rng.random(n_rows) < 0.11 * age_factor ** 2).astype(np.int64)
+    data['stroke'] = (rng.random(n_rows) < 0.15 * age_factor ** 3).astype(np.int64)
+
+    data['avg_glucose_level'] = np.round(np.clip(rng.lognormal(4.6, 0.35, n_rows), 55.0, 272.0), 2)
+    data['bmi'] = np.round(np.clip(rng.normal(28.9, 7.7, n_rows), 10.3, 97.6), 1)
+
+    return pd.DataFrame(data)[COLUMNS]
+
+
+# function that writes a synthetic dataset to a parquet file
+def write_dataset(n_rows: int, directory: Path, seed: int = 0) -> Path:
+    """
+    Generate a synthetic dataset and save it as parquet (reused if it already exists).
+
+    Args:
+        n_rows (int): Number of patients.
+        directory (Path): Output directory.
+        seed (int, optional): Random seed.
+
+    Returns:
+        Path: Parquet file.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"synthetic_{n_rows}_{seed}.parquet"
+    if not path.exists():
+        make_dataset(n_rows, seed).to_parquet(path, index=False)
+    return path
@@ -0,0 +1,143 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from urllib3.util.retry import Retry
+
+# ---------- Global Config ----------
+BASE_URL = os.environ.get("STROKE_API_URL", "http://127.0.0.1:8000")
+
+# Seconds a response is reused without asking the API again
+CACHE_TTL = int(os.environ.get("STROKE_API_CLIENT_TTL", "60"))
+
+# Keep-alive connections kept open to the API (also the number of parallel fetches)
+POOL_SIZE = 8
+
+# Seconds to wait for the API (connect, read)
+TIMEOUT = (3, 60)
+
+
+# Error returned by the API (status code other than 200)
+class APIError(Exception):
+    """
+    Error response of the API.
+
+    Args:
+        status_code (int): HTTP status code.
+        text (str): Response body.
+    """
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"{status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+# ---------- Shared Session ----------
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Return the HTTP session shared by every page and user of the app.
+
+    The session keeps up to POOL_SIZE keep-alive connections to the API and
+    retries idempotent requests on connection errors and 502/503/504.
+
+    Returns:
+        requests.Session: Pooled session.
+    """
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def _validators() -> dict:
+    """Last (ETag, data) received for each request, used to revalidate expired entries."""
+    return {}
+
+
+_validators_lock = threading.Lock()
+
+
+def _fetch(path: str, params: tuple):
+    """
+    GET a JSON response, sending the ETag of the previous response:
+    if the dataset version did not change the API answers 304 and the previous data is reused.
+    """
+    key = (path, params)
+    with _validators_lock:
+        etag, data = _validators().get(key, (None, None))
+    headers = {"If-None-Match": etag} if etag else {}
+
+    response = get_session().get(f"{BASE_URL}{path}", params=list(params), headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304 and etag:
+        return data
+    if response.status_code != 200:
+        raise APIError(response.status_code, response.text)
+
+    data = response.json()
+    if response.headers.get("ETag"):
+        with _validators_lock:
+            _validators()[key] = (response.headers["ETag"], data)
+    return data
+
+
+# ---------- Cached Requests ----------
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_json(path: str, params: tuple = ()):
+    """
+    GET an API endpoint and return the decoded JSON.
+
+    Responses are cached for CACHE_TTL seconds per (path, parameters), so Streamlit
+    reruns and widget interactions do not call the API again. When an entry expires
+    it is revalidated with its ETag : the body is only downloaded again if the
+    server's dataset version changed.
+
+    Args:
+        path (str): Endpoint path (e.g. "/stats/").
+        params (tuple, optional): Query parameters as (name, value) pairs (repeat a name for lists).
+
+    Returns:
+        object: Decoded JSON response.
+
+    Raises:
+        APIError: If the API answers with an error status.
+        requests.exceptions.ConnectionError: If the API cannot be reached.
+    """
+    return _fetch(path, tuple(params))
+
+
+# ---------- Parallel Requests ----------
+def get_many(calls: dict) -> dict:
+    """
+    Run several cached GET requests concurrently (the data needed by a page).
+
+    Args:
+        calls (dict): name -> (path, params).
+
+    Returns:
+        dict: name -> decoded JSON, or the exception raised by that request.
+
+    Example:
+        >>> get_many({"stats": ("/stats/", ()), "by_stroke": ("/aggregate", (("group_by", "stroke"),))})
+    """
+    ctx = get_script_run_ctx()
+
+    def call(path, params):
+        # Worker threads need the script context to use the Streamlit cache
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return get_json(path, tuple(params))
+
+    with ThreadPoolExecutor(max_workers=min(POOL_SIZE, max(len(calls), 1))) as executor:
+        futures = {name: executor.submit(call, path, params) for name, (path, params) in calls.items()}
+    results = {}
+    for name, future in futures.items():
+        error = future.exception()
+        results[name] = error if error is not None else future.result()
+    return results
@@ -2,9 +2,7 @@ import streamlit as st
 import requests
 import pandas as pd
 from st_aggrid import AgGrid, GridOptionsBuilder
-
-# ---------- Global Config ----------
-BASE_URL = "http://127.0.0.1:8000"
+import api_client
 
 # ---------- Function 1: Search Patient by ID ----------
 def get_patient_id():
@@ -13,7 +11,7 @@ def get_patient_id():
 
     This function performs the following steps:
     1. Displays a form to enter a Patient ID.
-    2. Sends a GET request to the API endpoint `/patients/{patient_id}`.
+    2. Sends a GET request to the API endpoint `/patients/{patient_id}` (cached by the shared API client).
     3. Converts the JSON response into a pandas DataFrame.
     4. Displays the DataFrame interactively in Streamlit.
     5. Handles errors such as empty input, no matching patient, or API connection issues.
@@ -41,14 +39,8 @@ def get_patient_id():
             st.info("Please enter a Patient ID to search.")
             return
         
-        url = f"{BASE_URL}/patients/{patient_id}"
         try:
-            response = requests.get(url)
-            if response.status_code != 200:
-                st.error(f"Error: {response.status_code} - {response.text}")
-                return
-            
-            data = response.json()
+            data = api_client.get_json(f"/patients/{patient_id}")
             
             # Convert JSON to DataFrame
             if isinstance(data, list):
@@ -61,6 +53,8 @@ def get_patient_id():
             else:
                 st.info("No patient found with this ID.")
         
+        except api_client.APIError as e:
+            st.error(f"Error: {e}")
         except requests.exceptions.ConnectionError:
             st.error("Could not connect to API. Make sure the backend is running.")
 
@@ -71,8 +65,8 @@ def patient_filters():
 
     This function performs the following steps:
     1. Displays a form with options to select Gender, Stroke status, and Maximum Age.
-    2. Sends a GET request to the API endpoint `/patients/` with filter parameters.
-    3. Converts the JSON response into a pandas DataFrame.
+    2. Sends a GET request to the API endpoint `/patients/` with filter parameters (cached by the shared API client).
+    3. Converts the column-oriented JSON response into a pandas DataFrame.
     4. Displays the filtered data interactively using AgGrid.
     5. Handles errors such as no matching data or API connection issues.
 
@@ -97,26 +91,18 @@ def patient_filters():
         submit_filter = st.form_submit_button("Search")
     
     if submit_filter:
-        params = {
-            "gender": gender,
-            "stroke": stroke_val,
-            "max_age": max_age
-        }
+        params = (
+            ("gender", gender),
+            ("stroke", stroke_val),
+            ("max_age", max_age),
+            ("shape", "columns")  # one list per column : loads into pandas without per-row dicts
+        )
         
-        url = f"{BASE_URL}/patients/"
         try:
-            response = requests.get(url, params=params)
-            if response.status_code != 200:
-                st.error(f"Error: {response.status_code} - {response.text}")
-                return
+            data = api_client.get_json("/patients/", params)
             
-            data = response.json()
-            
-            # Convert JSON to DataFrame
-            if isinstance(data, list):
-                df = pd.DataFrame(data)
-            else:
-                df = pd.DataFrame([data])
+            # Convert JSON (dict of columns) to DataFrame
+            df = pd.DataFrame(data)
             
             if not df.empty:
                 gb = GridOptionsBuilder.from_dataframe(df)
@@ -129,6 +115,8 @@ def patient_filters():
             else:
                 st.info("No data found for these filters.")
         
+        except api_client.APIError as e:
+            st.error(f"Error: {e}")
         except requests.exceptions.ConnectionError:
             st.error("Could not connect to API. Make sure the backend is running.")
         except Exception as e:
@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import pandas as pd
+import api_client
 
 # ---------- Function: Show Patients Descriptive Statistics ----------
 def show_statistics():
@@ -8,7 +9,7 @@ def show_statistics():
     Fetch and display patients' descriptive statistics from the API in an interactive table.
 
     This function performs the following steps:
-    1. Sends a GET request to the API endpoint `/stats/`.
+    1. Sends a GET request to the API endpoint `/stats/` (cached by the shared API client).
     2. Converts the returned JSON data into a pandas DataFrame.
     3. Removes the DataFrame index for a cleaner display.
     4. Displays the data interactively in Streamlit.
@@ -27,12 +28,8 @@ def show_statistics():
     """
     st.subheader("Patients Descriptive Statistics")
     
-    BASE_URL = "http://127.0.0.1:8000"
-    url = f"{BASE_URL}/stats/"
-    
     try:
-        response = requests.get(url)
-        data = response.json()
+        data = api_client.get_json("/stats/")
         
         # Convert JSON to DataFrame
         if isinstance(data, list):
@@ -46,9 +43,6 @@ def show_statistics():
         # Display interactive table in Streamlit
         st.dataframe(df_display, use_container_width=True)
         
-        print(response.status_code)
-        print(response.text)
-        
     except requests.exceptions.ConnectionError:
         st.error("Could not connect to API. Make sure the backend is running.")
     except Exception as e:
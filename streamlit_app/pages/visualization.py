@@ -2,56 +2,77 @@ import streamlit as st
 import requests
 import pandas as pd
 import plotly.express as px
+import api_client
 
-# ---------- Function: Load Patient Data from API ----------
-def load_patient_data() -> pd.DataFrame:
+# ---------- Function: Build an /aggregate Request ----------
+def aggregate_request(group_by: list, metrics: list, **filters) -> tuple:
     """
-    Fetch patient data from the API and return it as a pandas DataFrame.
+    Build the path and query parameters of an `/aggregate` request.
+
+    Args:
+        group_by (list): Columns to group patients by (e.g. ['stroke']).
+        metrics (list): Metrics to compute (e.g. ['count', 'mean:bmi']).
+        **filters: Optional filters (gender, stroke, max_age).
 
     Returns:
-        pd.DataFrame: Patient data fetched from API. Returns an empty DataFrame if
-        the request fails or no data is found.
+        tuple: (path, params) as expected by `api_client.get_json` / `api_client.get_many`.
+    """
+    params = [("group_by", column) for column in group_by]
+    params += [("metric", metric) for metric in metrics]
+    params += sorted(filters.items())
+    return "/aggregate", tuple(params)
 
-    Raises:
-        requests.exceptions.ConnectionError: If the API is unreachable.
-        Exception: Any other error during the request.
+# ---------- Function: Load Aggregated Data from API ----------
+def load_aggregates(requests_by_name: dict) -> dict:
     """
-    try:
-        response = requests.get("http://127.0.0.1:8000/patients/")
-        if response.status_code == 200:
-            data = response.json()
-            df = pd.DataFrame(data if isinstance(data, list) else [data])
-            return df
-        else:
+    Fetch several server-side aggregates from the API `/aggregate` endpoint concurrently
+    and return them as pandas DataFrames.
+
+    Only a few rows (one per group) are downloaded instead of the whole patient dataset,
+    and the responses are cached by the shared API client.
+
+    Args:
+        requests_by_name (dict): name -> (path, params) built with `aggregate_request`.
+
+    Returns:
+        dict: name -> pd.DataFrame with one row per group. The DataFrame is empty
+        if the request fails or no data is found.
+    """
+    frames = {}
+    for name, data in api_client.get_many(requests_by_name).items():
+        if isinstance(data, requests.exceptions.ConnectionError):
+            st.error("Could not connect to API")
+            data = []
+        elif isinstance(data, api_client.APIError):
             st.error("Failed to fetch data from API")
-            return pd.DataFrame()
-    except requests.exceptions.ConnectionError:
-        st.error("Could not connect to API")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"Error: {e}")
-        return pd.DataFrame()
+            data = []
+        elif isinstance(data, Exception):
+            st.error(f"Error: {data}")
+            data = []
+        frames[name] = pd.DataFrame(data if isinstance(data, list) else [data])
+    return frames
 
 # ---------- Function: Plot Stroke vs Smoking Pie Chart ----------
-def plot_stroke_smoking(df: pd.DataFrame):
+def plot_stroke_smoking(smoking_df: pd.DataFrame):
     """
     Plot a pie chart of smokers vs non-smokers among stroke patients.
 
     Args:
-        df (pd.DataFrame): Patient dataset containing 'stroke' and 'smoking_status' columns.
+        smoking_df (pd.DataFrame): Patient counts of stroke patients by smoking status
+            ('smoking_status' and 'count' columns).
 
     Behavior:
-        - Filters patients who had a stroke.
-        - Counts smokers vs non-smokers.
+        - Counts smokers vs non-smokers from the aggregated counts.
         - Displays an interactive Plotly pie chart in Streamlit.
         - Shows a warning if no stroke patients exist.
     """
-    if 'stroke' in df.columns and 'smoking_status' in df.columns:
-        stroke_df = df[df['stroke'] == 1]
-        if not stroke_df.empty:
-            stroke_smoking_counts = stroke_df['smoking_status'].apply(
-                lambda x: 'Fumeur' if x != 'never smoked' else 'Non-fumeur'
-            ).value_counts()
+    if 'smoking_status' in smoking_df.columns and 'count' in smoking_df.columns:
+        if smoking_df['count'].sum() > 0:
+            stroke_smoking_counts = smoking_df.groupby(
+                smoking_df['smoking_status'].apply(
+                    lambda x: 'Fumeur' if x != 'never smoked' else 'Non-fumeur'
+                )
+            )['count'].sum()
             fig = px.pie(
                 names=stroke_smoking_counts.index,
                 values=stroke_smoking_counts.values,
@@ -61,20 +82,48 @@ def plot_stroke_smoking(df: pd.DataFrame):
         else:
             st.warning("No stroke patients found for smoking chart.")
 
+# ---------- Function: Plot the Stroke Risk by Smoking Status ----------
+def plot_smoking_risk():
+    """
+    Plot the relative risk of stroke of each smoking status against never smokers.
+
+    Behavior:
+        - Uses the API `/risk-factors` endpoint (relative risks and bootstrap intervals).
+        - Displays the relative risks with their 95% confidence interval as error bars.
+    """
+    try:
+        data = api_client.get_json("/risk-factors", (("factor", "smoking_status"),))
+    except Exception:
+        st.error("Could not load the smoking risk factors")
+        return
+    risk = pd.DataFrame(data["factors"])
+    risk = risk[risk['level'] != risk['reference']]
+    fig = px.bar(
+        risk,
+        x='level',
+        y='relative_risk',
+        error_y=risk['relative_risk_high'] - risk['relative_risk'],
+        error_y_minus=risk['relative_risk'] - risk['relative_risk_low'],
+        title="Relative Risk of Stroke vs Never Smokers (95% CI)",
+        labels={'level': 'Smoking Status', 'relative_risk': 'Relative Risk'}
+    )
+    fig.add_hline(y=1, line_dash="dash")
+    st.plotly_chart(fig)
+
 # ---------- Function: Plot Stroke Distribution Pie Chart ----------
-def plot_stroke_distribution(df: pd.DataFrame):
+def plot_stroke_distribution(stroke_df: pd.DataFrame):
     """
     Plot a pie chart showing stroke distribution in the dataset.
 
     Args:
-        df (pd.DataFrame): Patient dataset containing 'stroke' column.
+        stroke_df (pd.DataFrame): Patient counts by stroke status ('stroke' and 'count' columns).
 
     Behavior:
-        - Counts patients with and without stroke.
+        - Uses the number of patients with and without stroke.
         - Displays an interactive Plotly pie chart in Streamlit.
     """
-    if 'stroke' in df.columns:
-        counts = df['stroke'].value_counts()
+    if 'stroke' in stroke_df.columns and 'count' in stroke_df.columns:
+        counts = stroke_df.set_index('stroke')['count']
         counts.index = counts.index.map({0: 'Without Stroke', 1: 'With Stroke'})
         fig = px.pie(
             names=counts.index,
@@ -84,19 +133,19 @@ def plot_stroke_distribution(df: pd.DataFrame):
         st.plotly_chart(fig)
 
 # ---------- Function: Plot Average BMI per Stroke Status ----------
-def plot_avg_bmi(df: pd.DataFrame):
+def plot_avg_bmi(stroke_df: pd.DataFrame):
     """
     Plot a bar chart of average BMI grouped by stroke status.
 
     Args:
-        df (pd.DataFrame): Patient dataset containing 'stroke' and 'bmi' columns.
+        stroke_df (pd.DataFrame): Average BMI by stroke status ('stroke' and 'mean_bmi' columns).
 
     Behavior:
-        - Groups patients by stroke status and calculates average BMI.
+        - Uses the average BMI computed by the API for each stroke status.
         - Displays an interactive Plotly bar chart in Streamlit.
     """
-    if 'stroke' in df.columns and 'bmi' in df.columns:
-        avg_bmi = df.groupby('stroke')['bmi'].mean().reset_index()
+    if 'stroke' in stroke_df.columns and 'mean_bmi' in stroke_df.columns:
+        avg_bmi = stroke_df[['stroke', 'mean_bmi']].rename(columns={'mean_bmi': 'bmi'})
         avg_bmi['stroke'] = avg_bmi['stroke'].map({0: 'Without Stroke', 1: 'With Stroke'})
         fig = px.bar(
             avg_bmi,
@@ -109,29 +158,77 @@ def plot_avg_bmi(df: pd.DataFrame):
         )
         st.plotly_chart(fig)
 
+# ---------- Function: Plot a Distribution from the Precomputed Histograms ----------
+def plot_distribution(column: str, label: str):
+    """
+    Plot the histogram of a measure for patients with and without stroke.
+
+    Args:
+        column (str): Measure ('age', 'bmi' or 'avg_glucose_level').
+        label (str): Axis label.
+
+    Behavior:
+        - Uses the histogram bins of the API `/distribution` endpoint (no patient rows downloaded).
+        - Displays the share of patients in each bin, one color per stroke status.
+    """
+    responses = api_client.get_many({
+        status: ("/distribution", (("column", column), ("stroke", stroke)))
+        for stroke, status in ((0, 'Without Stroke'), (1, 'With Stroke'))
+    })
+    frames = []
+    for status, data in responses.items():
+        if isinstance(data, Exception):
+            st.error(f"Could not load the {label} distribution")
+            return
+        histogram = data["columns"][column]["histogram"]
+        total = max(sum(histogram["counts"]), 1)
+        frames.append(pd.DataFrame({
+            label: histogram["edges"][:-1],
+            'share': [count / total for count in histogram["counts"]],
+            'stroke': status,
+        }))
+    fig = px.bar(
+        pd.concat(frames),
+        x=label,
+        y='share',
+        color='stroke',
+        barmode='group',
+        title=f"{label} Distribution by Stroke Status",
+        labels={'share': 'Share of patients'}
+    )
+    st.plotly_chart(fig)
+
 # ---------- Main Function: Display Visual Analytics ----------
 def show_visual_analytics():
     """
     Display the Stroke Data Visual Analytics section in Streamlit.
 
     Behavior:
-        - Loads patient data from API.
+        - Loads the aggregates needed by the charts from the API concurrently (a few rows only).
         - Shows warning if dataset is empty.
-        - Plots three visualizations:
+        - Plots the visualizations:
             1. Smokers vs non-smokers among stroke patients.
-            2. Stroke distribution in the dataset.
-            3. Average BMI grouped by stroke status.
+            2. Relative risk of stroke by smoking status.
+            3. Stroke distribution in the dataset.
+            4. Average BMI grouped by stroke status.
+            5. Age distribution by stroke status.
     """
     st.subheader("Stroke Data Visual Analytics")
     
-    df = load_patient_data()
-    if df.empty:
+    frames = load_aggregates({
+        "stroke": aggregate_request(["stroke"], ["count", "mean:bmi"]),
+        "smoking": aggregate_request(["smoking_status"], ["count"], stroke=1),
+    })
+    stroke_df, smoking_df = frames["stroke"], frames["smoking"]
+    if stroke_df.empty:
         st.warning("No valid data available for visualization.")
         return
     
-    plot_stroke_smoking(df)
-    plot_stroke_distribution(df)
-    plot_avg_bmi(df)
+    plot_stroke_smoking(smoking_df)
+    plot_smoking_risk()
+    plot_stroke_distribution(stroke_df)
+    plot_avg_bmi(stroke_df)
+    plot_distribution('age', 'Age')
 
 # ---------- Run the main function ----------
 show_visual_analytics()
@@ -0,0 +1,128 @@
+from typing import List, Optional
+import pandas as pd
+from stroke_api import filters
+from stroke_api import metrics as instrumentation
+from stroke_api.query import Node
+from stroke_api.store import Dataset
+
+# Columns that can be used to group patients (low cardinality)
+GROUP_COLUMNS = [
+    'gender', 'hypertension', 'heart_disease', 'ever_married', 'work_type',
+    'Residence_type', 'smoking_status', 'stroke'
+]
+
+# Numeric columns that metrics can be computed on
+METRIC_COLUMNS = ['age', 'avg_glucose_level', 'bmi', 'hypertension', 'heart_disease', 'stroke']
+
+# Supported metric functions (besides `count` and `quantile`)
+METRIC_FUNCTIONS = ['mean', 'min', 'max', 'sum']
+
+
+# function that parses a metric string ("count", "mean:bmi", "quantile:0.9:age")
+def parse_metric(metric: str) -> tuple:
+    """
+    Parse a metric specification.
+
+    Supported forms:
+    - `count`
+    - `<function>:<column>` with function in mean, min, max, sum
+    - `quantile:<q>:<column>` with 0 <= q <= 1
+
+    Args:
+        metric (str): Metric specification.
+
+    Returns:
+        tuple: (output name, function, column, quantile).
+
+    Raises:
+        ValueError: If the metric is not valid.
+    """
+    parts = metric.split(':')
+    if parts == ['count']:
+        return 'count', 'count', None, None
+
+    if parts[0] == 'quantile' and len(parts) == 3:
+        q = float(parts[1])
+        if not 0 <= q <= 1:
+            raise ValueError(f"Quantile must be between 0 and 1: {metric}")
+        function, column = 'quantile', parts[2]
+        name = f"q{parts[1]}_{column}"
+    elif len(parts) == 2 and parts[0] in METRIC_FUNCTIONS:
+        function, column, q = parts[0], parts[1], None
+        name = f"{function}_{column}"
+    else:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    if column not in METRIC_COLUMNS:
+        raise ValueError(f"Unknown metric column: {column}")
+    return name, function, column, q
+
+
+# function that groups the filtered patients and computes the metrics on the server
+def aggregate_patients(
+    group_by: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None,
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[float] = None,
+    query: Optional[Node] = None,
+    dataset: Optional[Dataset] = None
+) -> list:
+    """
+    Compute grouped metrics on the filtered patients with a vectorized groupby.
+
+    Args:
+        group_by (Optional[List[str]], optional): Columns to group by (none = whole selection).
+        metrics (Optional[List[str]], optional): Metric specifications (default: count).
+        gender (Optional[str], optional): Gender filter.
+        stroke (Optional[int], optional): Stroke status filter.
+        max_age (Optional[float], optional): Maximum age filter.
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query).
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        list[dict]: One record per group with the group keys and the metric values.
+
+    Raises:
+        ValueError: If a group column or a metric is not valid.
+    """
+    group_by = group_by or []
+    parsed = [parse_metric(metric) for metric in (metrics or ['count'])]
+    for column in group_by:
+        if column not in GROUP_COLUMNS:
+            raise ValueError(f"Unknown group column: {column}")
+
+    # Only the needed columns of the matching rows are taken
+    needed = list(dict.fromkeys(group_by + [column for _, _, column, _ in parsed if column]))
+    dataset = dataset or filters.current_dataset()
+    positions = filters.matching_positions(
+        gender=gender, stroke=stroke, max_age=max_age, query=query, dataset=dataset
+    )
+    with instrumentation.stage("aggregate"):
+        df = dataset.take(positions, needed or ['id'])
+        # float32 measures are aggregated in float64
+        df = df.astype({column: 'float64' for column in needed if df[column].dtype == 'float32'})
+
+        if not group_by:
+            # No group : a single row over the whole selection
+            grouped = df.groupby(lambda _: 0)
+            result = pd.DataFrame(index=pd.RangeIndex(1))
+        else:
+            grouped = df.groupby(group_by, sort=True, observed=True)
+            result = pd.DataFrame(index=grouped.size().index)
+
+        for name, function, column, q in parsed:
+            if function == 'count':
+                values = grouped.size()
+            elif function == 'quantile':
+                values = grouped[column].quantile(q)
+            else:
+                values = grouped[column].agg(function)
+            result[name] = values.reindex(result.index).fillna(0).astype(int) if function == 'count' else values
+
+    if group_by:
+        result = result.reset_index()
+    # Empty groups give NaN, which is not valid JSON
+    with instrumentation.stage("serialize"):
+        result = result.astype(object).where(result.notna(), None)
+        return result.to_dict(orient='records')
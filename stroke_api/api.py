@@ -1,84 +1,902 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from functools import partial
+from typing import Literal, Optional, Union
+import asyncio
+import json
+import os
+import time
+import pandas as pd
 # Import the custom filters module from your stroke_api package
 from stroke_api import filters  
+from stroke_api import serialization
+from stroke_api import aggregate
+from stroke_api import cache
+from stroke_api import workers
+from stroke_api import query
+from stroke_api import metrics
+from stroke_api import model
+from stroke_api import cube
+from stroke_api import ingest
+from stroke_api import neighbors
+from stroke_api import exports
+from stroke_api import risk_factors
+from stroke_api import partitions
+from stroke_api.schema import CATEGORIES
+from stroke_api.store import PatientExistsError
 
 # Create an API router instance
 router = APIRouter()
 
+# Maximum number of ids in one batch lookup
+MAX_BATCH_IDS = 100_000
+
+
+# Body of the batch lookup endpoint
+class PatientIds(BaseModel):
+    """List of patient ids to resolve in one request."""
+    ids: list[int]
+
+
+# Features of one patient to score with /predict
+class PatientFeatures(BaseModel):
+    """Patient features used by the risk model (bmi may be missing)."""
+    gender: Literal[tuple(CATEGORIES['gender'])]
+    age: float = Field(ge=0)
+    hypertension: int = Field(ge=0, le=1)
+    heart_disease: int = Field(ge=0, le=1)
+    ever_married: Literal[tuple(CATEGORIES['ever_married'])]
+    work_type: Literal[tuple(CATEGORIES['work_type'])]
+    Residence_type: Literal[tuple(CATEGORIES['Residence_type'])]
+    avg_glucose_level: float = Field(gt=0)
+    bmi: Optional[float] = Field(None, gt=0)
+    smoking_status: Literal[tuple(CATEGORIES['smoking_status'])]
+
+
+# One patient record sent to the ingestion endpoints
+class PatientRecord(PatientFeatures):
+    """Complete patient row (every column of the dataset is required)."""
+    id: int = Field(ge=0)
+    bmi: float = Field(gt=0)
+    stroke: int = Field(ge=0, le=1)
+
+
+# Concurrent /predict requests are scored together on the worker pool
+predict_batcher = model.MicroBatcher(workers.pool.run)
+
+# Ingested patients are compacted to parquet segments in the background
+compactor = ingest.Compactor(filters.store, workers.pool.run)
+
+
+# Dependency building the compiled filter of /patients/ and /aggregate from the query parameters
+def patient_query(
+    gender: list[str] = Query(None),   # Optional gender filter (repeatable : gender=Male&gender=Female)
+    stroke: list[int] = Query(None),   # Optional stroke status filter (0 or 1, repeatable)
+    hypertension: int = None,          # Optional hypertension filter (0 or 1)
+    heart_disease: int = None,         # Optional heart disease filter (0 or 1)
+    ever_married: list[str] = Query(None),    # Optional filters on the other categorical columns (repeatable)
+    work_type: list[str] = Query(None),
+    Residence_type: list[str] = Query(None),
+    smoking_status: list[str] = Query(None),
+    min_age: float = None,   # Optional inclusive ranges
+    max_age: float = None,
+    min_bmi: float = None,
+    max_bmi: float = None,
+    min_glucose: float = None,
+    max_glucose: float = None,
+    where: str = None   # Optional boolean expression, e.g. (age >= 60 and bmi > 30) or smoking_status in [smokes]
+) -> Optional[query.Node]:
+    """
+    Compile the filter parameters into one query tree (None when there is no filter).
+    Each distinct `where` expression is parsed once and reused.
+    """
+    try:
+        return query.from_params(
+            where=where,
+            ranges={
+                'age': (min_age, max_age),
+                'bmi': (min_bmi, max_bmi),
+                'avg_glucose_level': (min_glucose, max_glucose),
+            },
+            gender=gender, stroke=stroke, hypertension=hypertension, heart_disease=heart_disease,
+            ever_married=ever_married, work_type=work_type, Residence_type=Residence_type,
+            smoking_status=smoking_status,
+        )
+    except ValueError as error:
+        # Raise HTTP 400 if a filter is not valid
+        raise HTTPException(status_code=400, detail=str(error))
+
+# Dependency validating the fields= projection of the patient endpoints
+def field_projection(
+    fields: list[str] = Query(None)  # Columns to return (repeatable or comma-separated, e.g. fields=id,age,stroke)
+) -> Optional[list]:
+    """Validate the requested columns (None = every column)."""
+    try:
+        fields = filters.parse_fields(fields)
+    except ValueError as error:
+        # Raise HTTP 400 if a column does not exist
+        raise HTTPException(status_code=400, detail=str(error))
+    if fields is not None and "risk_score" in fields:
+        loaded_model()
+    return fields
+
+
+# Dependency of the endpoints that need the whole table in memory
+def in_memory_dataset():
+    """Reject the request in partitioned mode, where the whole table is never loaded."""
+    if partitions.enabled():
+        # Raise HTTP 501 if the endpoint is not available on the partitions
+        raise HTTPException(
+            status_code=501,
+            detail="Not available in partitioned mode (STROKE_API_PARTITIONS): "
+                   "only /patients/, /patients/{id}, /patients/batch and /stats/ read the partitions"
+        )
+
+
 # Root endpoint: basic welcome message
 @router.get("/")
-def read_root():
+async def read_root():
     """
     Returns a simple welcome message for the API.
     """
     return {"message": "Bienvenue sur l'API Stroke Prediction !"}
 
 
+# Function run on the worker pool for one page of patients (body and next cursor)
+def render_page(response_format: str = "json", shape: str = "records", **kwargs) -> tuple:
+    """
+    Get one page of patients and encode it (JSON records/columns or Parquet).
+
+    Returns:
+        tuple: (encoded body, id to use as after_id for the next page or None).
+    """
+    page, next_after_id = filters.get_patient_page(**kwargs)
+    return serialization.encode_frame(page, response_format, shape), next_after_id
+
+
+# Function that encodes the result of a batch lookup
+def encode_batch(found, missing: list, response_format: str = "json", shape: str = "records") -> bytes:
+    """
+    Encode `{"patients": ..., "missing": [...]}` as JSON, or one patient per line
+    then a last line `{"missing": [...]}` as NDJSON.
+
+    Returns:
+        bytes: Response body.
+    """
+    with metrics.stage("serialize"):
+        if response_format == "ndjson":
+            return b"".join(serialization.ndjson_stream([found])) + json.dumps({"missing": missing}).encode() + b'\n'
+        return (
+            b'{"patients":' + serialization.frame_to_json(found, shape)
+            + b',"missing":' + json.dumps(missing).encode() + b'}'
+        )
+
+
+# Function run on the worker pool for a batch lookup (JSON body)
+def render_batch(patient_ids: list, shape: str = "records", fields: Optional[list] = None, dataset=None) -> bytes:
+    """
+    Resolve many patient ids and encode `{"patients": ..., "missing": [...]}` as JSON.
+
+    Returns:
+        bytes: JSON body.
+    """
+    found, missing = filters.get_patients_batch(patient_ids, fields=fields, dataset=dataset)
+    return encode_batch(found, missing, "json", shape)
+
+
+# Function run on the worker pool for a batch lookup on the partitions
+def render_partition_batch(
+    patient_ids: list, response_format: str = "json", shape: str = "records", fields: Optional[list] = None, catalog=None
+) -> bytes:
+    """
+    Resolve many patient ids on the row groups whose id range can hold them, and encode the body.
+
+    Returns:
+        bytes: JSON or NDJSON body.
+    """
+    found, missing = partitions.get_patients_batch(patient_ids, fields=fields, catalog=catalog)
+    return encode_batch(found, missing, response_format, shape)
+
+
 # Endpoint to get patients, with optional filters
 @router.get("/patients/")
-def get_patients(
-    gender: str = None,   # Optional filter for patient gender
-    stroke: int = None,   # Optional filter for stroke status (0 or 1)
-    max_age: float = None # Optional filter for maximum age
+async def get_patients(
+    request: Request,
+    patient_filter: Optional[query.Node] = Depends(patient_query),  # Filters (see patient_query)
+    limit: int = Query(None, ge=1),  # Optional page size (keyset pagination)
+    after_id: int = None,  # Optional cursor : only patients with a greater id
+    response_format: str = Query(None, alias="format", pattern="^(json|ndjson|arrow|parquet)$"),  # Output mode
+    shape: str = Query("records", pattern="^(records|columns)$"),  # JSON shape : list of rows or dict of columns
+    risk_score: bool = False,  # Add the precomputed stroke risk score of each patient
+    fields: Optional[list] = Depends(field_projection)  # Columns to return (default all)
 ):
     """
     Retrieve patients with optional filters applied.
     Uses the filter_patient function from filters module.
+
+    Filters: repeatable `gender`, `stroke` and categorical values (in-lists), `min_`/`max_`
+    ranges on `age`, `bmi` and `glucose`, and a `where` expression with and / or / not,
+    e.g. `where=(age >= 60 and bmi > 30) or smoking_status in [smokes, 'formerly smoked']`.
+    The filters are compiled into a plan over the column indexes, most selective first.
+
+    With `limit` and/or `after_id` the patients are returned ordered by id, one page at a time.
+    The id to pass as `after_id` for the next page is sent in the `X-Next-After-Id` header.
+    The output format is chosen by `format` or by the `Accept` header:
+    JSON (`shape=records` or `shape=columns`), Parquet, or NDJSON / Arrow IPC streams
+    sent in record batches. JSON is encoded straight from the columns, without per-row dicts.
+    Full JSON and Parquet results are cached per dataset version and support If-None-Match.
+    The filtering and serialization run on the worker pool.
+    With `risk_score=true` each patient gets the score of the risk model, computed once
+    for all the patients of the dataset version.
+    `fields=id,age,stroke` only reads and serializes these columns.
+    In partitioned mode the query is run on the parquet partitions that can match,
+    in parallel worker processes, and the rows are returned ordered by id.
     """
+    paginated = limit is not None or after_id is not None
+    risk_score = risk_score or (fields is not None and "risk_score" in fields)
+    filter_args = {"query": patient_filter}
+    row_args = {"with_risk_score": risk_score, "fields": fields}
+    response_format = response_format or serialization.negotiate_format(request.headers.get("accept"))
+    media_type = serialization.FORMAT_MEDIA_TYPES[response_format]
+    variant = response_format
+    if risk_score:
+        variant = f"{response_format}:{loaded_model().version}"
+    if partitions.enabled():
+        return await partitioned_patients(
+            request, patient_filter, limit, after_id, response_format, shape, row_args, variant
+        )
+    dataset = await workers.current_dataset()
+
+    if response_format in ("json", "parquet"):
+        async with workers.limit("bulk"):
+            try:
+                if not paginated:
+                    # Call the filter function to get filtered patient DataFrame (cached)
+                    return await cache.cached_response(
+                        request, dataset.version,
+                        lambda: workers.pool.run_on_dataset(
+                            dataset,
+                            partial(serialization.render_frame, filters.select_patients, response_format, shape),
+                            **filter_args, **row_args
+                        ),
+                        media_type=media_type, variant=variant
+                    )
+
+                body, next_after_id = await workers.pool.run_on_dataset(
+                    dataset, partial(render_page, response_format, shape),
+                    after_id=after_id, limit=limit, **filter_args, **row_args
+                )
+                headers = {} if next_after_id is None else {"X-Next-After-Id": str(next_after_id)}
+                return Response(content=body, media_type=media_type, headers=headers)
+            except Exception:
+                # Raise HTTP 404 if any error occurs during filtering
+                raise HTTPException(status_code=404, detail="n")
+
+    # The bulk slot is held until the end of the stream, while the batches are encoded
+    release = await workers.limit("bulk").acquire()
     try:
-        # Call the filter function to get filtered patient DataFrame
-        filtered_df = filters.filter_patient(gender=gender, stroke=stroke, max_age=max_age)
-        return filtered_df  # Return the filtered data
+        # Select the rows of the page (ordered by id)
+        positions = await workers.pool.run(
+            filters.filter_patient_page, after_id=after_id, limit=limit, dataset=dataset, **filter_args
+        )
     except Exception:
+        await release()
         # Raise HTTP 404 if any error occurs during filtering
         raise HTTPException(status_code=404, detail="n")
 
+    # Cursor of the next page, only when the page is full
+    headers = {}
+    if limit is not None and len(positions) == limit:
+        headers["X-Next-After-Id"] = str(dataset.engine.id_at(positions[-1]))
+
+    # The batches are encoded on the worker pool while the response is streamed
+    batches = filters.iter_patient_batches(positions, dataset=dataset, **row_args)
+    if response_format == "ndjson":
+        chunks = serialization.ndjson_stream(batches)
+    else:
+        schema = filters.row_schema(dataset, fields, risk_score)
+        chunks = serialization.arrow_stream(batches, schema)
+    return workers.streaming_response(workers.pool.iterate(chunks), release, media_type=media_type, headers=headers)
+
+
+# Helper answering /patients/ from the partitioned dataset
+async def partitioned_patients(
+    request: Request,
+    patient_filter: Optional[query.Node],
+    limit: Optional[int],
+    after_id: Optional[int],
+    response_format: str,
+    shape: str,
+    row_args: dict,
+    variant: str
+) -> Response:
+    """
+    Run the query on the partitions (pruned with their keys and row-group statistics,
+    scanned in parallel worker processes) and encode the merged rows.
+    Full results are cached per version of the partition files.
+    """
+    catalog = await workers.pool.run(partitions.current_catalog)
+    media_type = serialization.FORMAT_MEDIA_TYPES[response_format]
+    async with workers.limit("bulk"):
+        if limit is None and after_id is None:
+            return await cache.cached_response(
+                request, catalog.version,
+                lambda: workers.pool.run(
+                    serialization.render_frame, partitions.select_patients, response_format, shape,
+                    query=patient_filter, catalog=catalog, **row_args
+                ),
+                media_type=media_type, variant=variant
+            )
+        page, next_after_id = await workers.pool.run(
+            partitions.get_patient_page,
+            query=patient_filter, after_id=after_id, limit=limit, catalog=catalog, **row_args
+        )
+        body = await workers.pool.run(serialization.encode_frame, page, response_format, shape)
+    headers = {} if next_after_id is None else {"X-Next-After-Id": str(next_after_id)}
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+# Helper that validates and stores ingested patients
+async def ingest_response(patients: list, replace: bool) -> dict:
+    """
+    Append patients to the dataset and return the new version.
+    Answers 400 for invalid records, 409 for existing ids (POST) and 413 for too many rows.
+    """
+    if len(patients) > ingest.MAX_INGEST_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {ingest.MAX_INGEST_ROWS} patients per request")
+    records = [patient.model_dump() for patient in patients]
+
+    async with workers.limit("ingest"):
+        try:
+            dataset = await workers.pool.run(ingest.ingest, records, replace, filters.store)
+        except PatientExistsError as error:
+            # Raise HTTP 409 if an inserted patient already exists
+            raise HTTPException(status_code=409, detail=str(error))
+        except ValueError as error:
+            # Raise HTTP 400 if a record is outside the valid values
+            raise HTTPException(status_code=400, detail=str(error))
+    compactor.notify()
+    return {"written": len(records), "version": dataset.version, "pending_rows": dataset.pending_rows}
+
+
+# Endpoint to add new patients
+@router.post("/patients/", status_code=201, dependencies=[Depends(in_memory_dataset)])
+async def post_patients(patients: list[PatientRecord]):
+    """
+    Insert new patients (JSON list of complete rows); existing ids are rejected with 409.
+
+    The rows are validated against the valid values of the README, then appended to an
+    in-memory delta segment merged with the data: they are visible to the next requests.
+    A background task compacts them into parquet segments.
+    """
+    return await ingest_response(patients, replace=False)
+
+
+# Endpoint to add or replace patients
+@router.put("/patients/", dependencies=[Depends(in_memory_dataset)])
+async def put_patients(patients: list[PatientRecord]):
+    """
+    Insert or replace patients (JSON list of complete rows): a row replaces the patient
+    with the same id. Same validation and storage as POST /patients/.
+    """
+    return await ingest_response(patients, replace=True)
+
+
+# Helper that answers a batch lookup (JSON document or NDJSON stream)
+async def batch_response(
+    patient_ids: list, response_format: str, shape: str = "records", fields: Optional[list] = None
+):
+    """
+    Resolve many patient ids and build the response.
+
+    JSON mode returns `{"patients": [...], "missing": [...]}`.
+    NDJSON mode streams one patient per line, then a last line `{"missing": [...]}`.
+    """
+    if len(patient_ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_IDS} ids per request")
+
+    if partitions.enabled():
+        # Only the row groups whose id range holds a requested id are read
+        catalog = await workers.pool.run(partitions.current_catalog)
+        async with workers.limit("lookup"):
+            body = await workers.pool.run(
+                render_partition_batch, patient_ids, response_format, shape, fields=fields, catalog=catalog
+            )
+        media_type = serialization.NDJSON_MEDIA_TYPE if response_format == "ndjson" else "application/json"
+        return Response(content=body, media_type=media_type)
+
+    dataset = await workers.current_dataset()
+    if response_format == "json":
+        async with workers.limit("lookup"):
+            body = await workers.pool.run_on_dataset(
+                dataset, render_batch, patient_ids=patient_ids, shape=shape, fields=fields
+            )
+        return Response(content=body, media_type="application/json")
+
+    # The lookup slot is held until the end of the stream
+    release = await workers.limit("lookup").acquire()
+    try:
+        positions, missing = await workers.pool.run(filters.get_info_by_ids, patient_ids, dataset=dataset)
+    except BaseException:
+        await release()
+        raise
+
+    def lines():
+        yield from serialization.ndjson_stream(
+            filters.iter_patient_batches(positions, fields=fields, dataset=dataset)
+        )
+        yield json.dumps({"missing": missing}).encode() + b'\n'
+    return workers.streaming_response(
+        workers.pool.iterate(lines()), release, media_type=serialization.NDJSON_MEDIA_TYPE
+    )
+
+
+# Endpoint to get many patients by ID in one round trip (POST body)
+@router.post("/patients/batch")
+async def post_patients_batch(
+    body: PatientIds,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),  # Output mode
+    shape: str = Query("records", pattern="^(records|columns)$"),  # JSON shape of the patients
+    fields: Optional[list] = Depends(field_projection)  # Columns to return (default all)
+):
+    """
+    Retrieve many patients in one request from a JSON body `{"ids": [...]}`.
+    Ids that do not exist are reported in `missing`.
+    """
+    return await batch_response(body.ids, response_format, shape, fields)
+
+
+# Endpoint to get many patients by ID in one round trip (compact query)
+@router.get("/patients/batch")
+async def get_patients_batch(
+    ids: str,  # Comma-separated patient ids, e.g. ids=9046,51676,31112
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),  # Output mode
+    shape: str = Query("records", pattern="^(records|columns)$"),  # JSON shape of the patients
+    fields: Optional[list] = Depends(field_projection)  # Columns to return (default all)
+):
+    """
+    Retrieve many patients in one request from a comma-separated `ids` query parameter.
+    Ids that do not exist are reported in `missing`.
+    """
+    try:
+        patient_ids = [int(patient_id) for patient_id in ids.split(',') if patient_id.strip()]
+    except ValueError:
+        # Raise HTTP 400 if an id is not an integer
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    return await batch_response(patient_ids, response_format, shape, fields)
+
 
 # Endpoint to get a single patient by ID
 @router.get("/patients/{patient_id}")
-def get_patient_id(patient_id: int):
+async def get_patient_id(
+    patient_id: int,
+    fields: Optional[list] = Depends(field_projection)  # Columns to return (default all)
+):
     """
     Retrieve a patient's information by their ID.
     Handles the case where the ID does not exist.
+    The O(1) lookup runs on the worker pool under the lookup limit, so a reload of the
+    data file never blocks the event loop and the lookups never wait behind bulk queries.
+    In partitioned mode only the row groups whose id range holds the id are read.
     """
-    # Call function to get patient info
-    id_df = filters.get_info_by_id(patient_id)
-    
-    # If no patient found or the DataFrame is empty, return 404
-    if id_df is None or (hasattr(id_df, 'empty') and id_df.empty):
+    if partitions.enabled():
+        catalog = await workers.pool.run(partitions.current_catalog)
+        async with workers.limit("lookup"):
+            id_df = await workers.pool.run(partitions.get_info_by_id, patient_id, fields=fields, catalog=catalog)
+    else:
+        dataset = await workers.current_dataset()
+        async with workers.limit("lookup"):
+            # Call function to get patient info
+            id_df = await workers.pool.run(filters.get_info_by_id, patient_id, fields=fields, dataset=dataset)
+
+    # If no patient found (empty list of records), return 404
+    if not id_df:
         raise HTTPException(status_code=404, detail="Patient ID not found")
 
     return id_df  # Return the patient's info
 
 
+# Endpoint to find the patients most similar to one patient
+@router.get("/patients/{patient_id}/similar", dependencies=[Depends(in_memory_dataset)])
+async def get_similar_patients(
+    patient_id: int,
+    k: int = Query(10, ge=1, le=neighbors.MAX_NEIGHBORS),  # Number of similar patients
+    patient_filter: Optional[query.Node] = Depends(patient_query),  # Optional filters of the candidates (see /patients/)
+    fields: Optional[list] = Depends(field_projection)  # Columns to return (default all)
+):
+    """
+    Return the k patients closest to a patient, closest first, with their `distance`.
+
+    Patients are compared on standardized age, bmi and avg_glucose_level, hypertension,
+    heart_disease and the categorical attributes, with a vectorized nearest-neighbour
+    search over an index built once per dataset version. The filters of /patients/
+    restrict the candidates, e.g. `/patients/9046/similar?k=5&stroke=0`.
+    """
+    dataset = await workers.current_dataset()
+    async with workers.limit("lookup"):
+        try:
+            body = await workers.pool.run_on_dataset(
+                dataset, partial(serialization.render_frame, neighbors.similar_patients, "json", "records"),
+                patient_id=patient_id, k=k, query=patient_filter, fields=fields
+            )
+        except KeyError:
+            # Raise HTTP 404 if the patient does not exist
+            raise HTTPException(status_code=404, detail="Patient ID not found")
+    return Response(content=body, media_type=serialization.JSON_MEDIA_TYPE)
+
+
+# Endpoint to start a background export of the patients matching a filter
+@router.post("/exports", status_code=202, dependencies=[Depends(in_memory_dataset)])
+async def post_export(
+    response: Response,
+    patient_filter: Optional[query.Node] = Depends(patient_query),  # Filters (see /patients/)
+    response_format: str = Query("csv", alias="format", pattern="^(csv|parquet|arrow)$"),  # File format
+    risk_score: bool = False,  # Add the precomputed stroke risk score of each patient
+    fields: Optional[list] = Depends(field_projection)  # Columns to export (default all)
+):
+    """
+    Start writing the patients matching the filters of /patients/ to a CSV, Parquet or
+    Arrow file in the background, and return the job (202, `Location` is its status URL).
+
+    The rows are written in chunks by a dedicated pool, so large extracts neither hold a
+    request nor build the whole result in memory. An identical export of the same dataset
+    version returns the running or finished job instead of starting a new one.
+    """
+    risk_score = risk_score or (fields is not None and "risk_score" in fields)
+    variant = loaded_model().version if risk_score else ""
+    dataset = await workers.current_dataset()
+    job = exports.manager.submit(
+        dataset, response_format, query=patient_filter, fields=fields, with_risk_score=risk_score, variant=variant
+    )
+    response.headers["Location"] = f"/exports/{job.id}"
+    if job.status == exports.DONE:
+        response.status_code = 200
+    return job.to_dict()
+
+
+# Helper that finds an export job
+def export_job(job_id: str) -> exports.ExportJob:
+    """Get an export job, 404 if it does not exist or was dropped."""
+    job = exports.manager.get(job_id)
+    if job is None:
+        # Raise HTTP 404 if the job does not exist
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job
+
+
+# Endpoint to follow an export
+@router.get("/exports/{job_id}")
+async def get_export(job_id: str):
+    """
+    Return the status of an export : queued, running, done, failed or cancelled,
+    rows written out of the matching rows, file size and download URL once done.
+    """
+    return export_job(job_id).to_dict()
+
+
+# Endpoint to download a finished export
+@router.get("/exports/{job_id}/download")
+async def download_export(job_id: str):
+    """
+    Download the file of a finished export (409 while it is still running).
+    Supports `Range` requests, so an interrupted download can be resumed.
+    """
+    job = export_job(job_id)
+    if job.status != exports.DONE or not job.path.exists():
+        # Raise HTTP 409 if the file is not ready
+        raise HTTPException(status_code=409, detail=f"Export is {job.status}")
+    return FileResponse(job.path, media_type=job.media_type, filename=job.filename)
+
+
+# Endpoint to cancel an export or delete its file
+@router.delete("/exports/{job_id}")
+async def delete_export(job_id: str):
+    """
+    Cancel a queued or running export, or delete a finished one and its file.
+    """
+    job = exports.manager.cancel(job_id)
+    if job is None:
+        # Raise HTTP 404 if the job does not exist
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job.to_dict()
+
+
+# Endpoint to compute grouped metrics on the server
+@router.get("/aggregate", dependencies=[Depends(in_memory_dataset)])
+async def get_aggregate(
+    request: Request,
+    group_by: list[str] = Query(None),  # Columns to group by (repeatable)
+    metric: list[str] = Query(["count"]),  # Metrics : count, mean:bmi, max:age, quantile:0.9:bmi (repeatable)
+    patient_filter: Optional[query.Node] = Depends(patient_query)  # Same filters as /patients/
+):
+    """
+    Group the filtered patients and compute metrics on the server,
+    so clients receive a few rows instead of the whole dataset.
+
+    Example: `/aggregate?group_by=stroke&metric=count&metric=mean:bmi`
+    """
+    dataset = await workers.current_dataset()
+    async with workers.limit("aggregate"):
+        try:
+            return await cache.cached_response(
+                request, dataset.version,
+                lambda: workers.pool.run_on_dataset(
+                    dataset, partial(serialization.render_json, aggregate.aggregate_patients),
+                    group_by=group_by, metrics=metric, query=patient_filter
+                )
+            )
+        except ValueError as error:
+            # Raise HTTP 400 if a group column or a metric is not valid
+            raise HTTPException(status_code=400, detail=str(error))
+
+
+# Endpoint answering cross-tabs from the precomputed data cube
+@router.get("/crosstab", dependencies=[Depends(in_memory_dataset)])
+async def get_crosstab(
+    request: Request,
+    group_by: list[str] = Query(None),  # Dimensions of the result (repeatable)
+    metric: list[str] = Query(["count"]),  # Metrics : count, share, mean:bmi, sum:age, rate:stroke (repeatable)
+    gender: list[str] = Query(None),   # Optional slices on the dimensions (repeatable values)
+    stroke: list[int] = Query(None),
+    hypertension: list[int] = Query(None),
+    heart_disease: list[int] = Query(None),
+    ever_married: list[str] = Query(None),
+    work_type: list[str] = Query(None),
+    Residence_type: list[str] = Query(None),
+    smoking_status: list[str] = Query(None),
+    age_group: list[int] = Query(None)  # First age of the 10-year groups (0, 10, ..., 100)
+):
+    """
+    Cohort comparison / cross-tab over the low-cardinality dimensions
+    (gender, stroke, hypertension, heart_disease, ever_married, work_type,
+    Residence_type, smoking_status, age_group).
+
+    The answer is computed from a data cube of pre-aggregated counts and sums,
+    built once per dataset version, so it never scans the patient rows.
+
+    Example: `/crosstab?group_by=smoking_status&metric=count&metric=rate:stroke&metric=mean:bmi`
+    """
+    slices = {
+        "gender": gender, "stroke": stroke, "hypertension": hypertension, "heart_disease": heart_disease,
+        "ever_married": ever_married, "work_type": work_type, "Residence_type": Residence_type,
+        "smoking_status": smoking_status, "age_group": age_group,
+    }
+    slices = {dimension: values for dimension, values in slices.items() if values}
+    dataset = await workers.current_dataset()
+
+    async def build():
+        # The cube is built once per version on the worker pool; slices then take microseconds
+        data_cube = await workers.pool.run(cube.dataset_cube, dataset)
+        return serialization.render_json(data_cube.query, group_by=group_by, metrics=metric, filters=slices)
+
+    async with workers.limit("lookup"):
+        try:
+            return await cache.cached_response(request, dataset.version, build)
+        except ValueError as error:
+            # Raise HTTP 400 if a dimension, value or metric is not valid
+            raise HTTPException(status_code=400, detail=str(error))
+
+
+# Endpoint comparing the stroke risk across the levels of the factor columns
+@router.get("/risk-factors", dependencies=[Depends(in_memory_dataset)])
+async def get_risk_factors(
+    request: Request,
+    factor: list[str] = Query(None),  # Factor columns (repeatable, default all)
+    resamples: int = Query(risk_factors.DEFAULT_RESAMPLES, ge=0, le=risk_factors.MAX_RESAMPLES),  # Bootstrap replicates
+    confidence: float = Query(0.95, gt=0, lt=1),  # Level of the confidence intervals
+    patient_filter: Optional[query.Node] = Depends(patient_query)  # Same filters as /patients/
+):
+    """
+    Relative risk and odds ratio of stroke for every level of hypertension, heart_disease,
+    gender, ever_married, work_type, Residence_type and smoking_status against a reference
+    level (e.g. smokers against `never smoked`), with bootstrap percentile intervals.
+
+    The counts are taken once; the bootstrap replicates are drawn in vectorized batches
+    spread over the worker pool. Results are cached per dataset version and parameters.
+
+    Example: `/risk-factors?factor=smoking_status&min_age=40`
+    """
+    try:
+        factors = risk_factors.parse_factors(factor)
+    except ValueError as error:
+        # Raise HTTP 400 if a column is not a factor
+        raise HTTPException(status_code=400, detail=str(error))
+    dataset = await workers.current_dataset()
+
+    async def build():
+        tables = await workers.pool.run_on_dataset(
+            dataset, risk_factors.contingency_tables, factors=factors, query=patient_filter
+        )
+        replicates = await asyncio.gather(*(
+            workers.pool.run_compute(risk_factors.bootstrap_ratios, tables, size, seed)
+            for size, seed in risk_factors.bootstrap_tasks(resamples)
+        ))
+        return await workers.pool.run(
+            serialization.render_json, risk_factors.summarize,
+            tables=tables, replicates=list(replicates), confidence=confidence
+        )
+
+    async with workers.limit("aggregate"):
+        return await cache.cached_response(request, dataset.version, build)
+
+
 # Endpoint to get basic statistics on the patient dataset
 @router.get("/stats/")
-def get_stats():
+async def get_stats(
+    request: Request,
+    gender: str = None,   # Optional filter for patient gender
+    stroke: int = None,   # Optional filter for stroke status (0 or 1)
+    max_age: float = None # Optional filter for maximum age
+):
     """
-    Calculate and return key statistics about the patient dataset:
+    Return key statistics about the patient dataset:
     - Total number of patients
     - Average age
     - Average stroke rate
     - Average hypertension and heart disease prevalence
     - Average, minimum, maximum glucose levels
     - Average BMI
+
+    The statistics are precomputed when the dataset is loaded and accept
+    the same filters as /patients/. Responses are cached per dataset version
+    and support If-None-Match. In partitioned mode they are merged from the
+    partial aggregates of the partitions.
+    """
+    if partitions.enabled():
+        # Partial aggregates of the partitions, merged (computed once per partition file)
+        catalog = await workers.pool.run(partitions.current_catalog)
+        version = catalog.version
+        build = lambda: workers.pool.run(
+            serialization.render_json, partitions.patient_statistics,
+            gender=gender, stroke=stroke, max_age=max_age, catalog=catalog
+        )
+    else:
+        dataset = await workers.current_dataset()
+        version = dataset.version
+        build = lambda: workers.pool.run_on_dataset(
+            dataset, partial(serialization.render_json, filters.patient_statistics),
+            gender=gender, stroke=stroke, max_age=max_age
+        )
+    async with workers.limit("aggregate"):
+        try:
+            stats = await cache.cached_response(request, version, build)
+        except Exception:
+            # Raise HTTP 404 if no patient matches or the stats cannot be computed
+            raise HTTPException(status_code=404, detail="")
+
+    return stats  # Return the statistics dictionary
+
+
+# Endpoint returning percentiles and histograms without scanning the rows
+@router.get("/distribution", dependencies=[Depends(in_memory_dataset)])
+async def get_distribution(
+    request: Request,
+    column: list[str] = Query(None),  # Columns : age, bmi, avg_glucose_level (repeatable, default all)
+    gender: list[str] = Query(None),  # Optional gender filter (repeatable)
+    stroke: list[int] = Query(None),  # Optional stroke status filter (repeatable)
+    percentile: list[float] = Query(None)  # Percentiles between 0 and 100 (repeatable, default 1 ... 99)
+):
+    """
+    Return the distribution of age, bmi and avg_glucose_level: count, min, max, mean,
+    percentiles and a fixed-bin histogram over the documented range of each column.
+
+    The answer merges t-digests and histograms kept per (gender, stroke) group,
+    built when the dataset is loaded and updated on reload, so no row is scanned.
+
+    Example: `/distribution?column=bmi&stroke=1&percentile=50&percentile=90`
     """
-    # Make a copy of the dataset to avoid modifying the original
-    df = filters.stroke_data_df.copy()
+    dataset = await workers.current_dataset()
+    async with workers.limit("lookup"):
+        try:
+            return await cache.cached_response(
+                request, dataset.version,
+                lambda: workers.pool.run(
+                    serialization.render_json, dataset.distributions.compute,
+                    columns=column, gender=gender, stroke=stroke, percentiles=percentile
+                )
+            )
+        except ValueError as error:
+            # Raise HTTP 400 if a column, filter value or percentile is not valid
+            raise HTTPException(status_code=400, detail=str(error))
+
+
+# Helper returning the risk model (503 if it has not been trained)
+def loaded_model() -> model.RiskModel:
+    """Get the risk model artifact, or answer 503 when it does not exist."""
     try:
-        stats = {
-            "Total_patients": int(df['id'].count()),  # Count of patients
-            "Average_age": float(df['age'].mean().round(2)),  # Mean age
-            "Average_stroke": float(df['stroke'].mean().round(2)),  # Mean stroke rate
-            "Average_hypertension": float(df['hypertension'].mean().round(2)),  # Mean hypertension
-            "Average_heart_disease": float(df['heart_disease'].mean().round(2)),  # Mean heart disease
-            "Average_glucose_level": int(df['avg_glucose_level'].mean().round(3)),  # Mean glucose
-            "Minimum_glucose_level": int(df['avg_glucose_level'].min().round(3)),  # Minimum glucose
-            "Maximum_glucose_level": int(df['avg_glucose_level'].max().round(3)),  # Maximum glucose
-            "Average_bmi": int(df['bmi'].mean())  # Mean BMI
+        return model.load_model()
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Risk model not trained (python -m stroke_api.model)")
+
+
+# Endpoint to score the stroke risk of one or many patients
+@router.post("/predict")
+async def predict(patients: Union[PatientFeatures, list[PatientFeatures]]):
+    """
+    Score the stroke risk (probability between 0 and 1) of patient features.
+
+    The body is one patient (`{"gender": "Male", "age": 67, ...}`, answered with
+    `{"risk_score": ...}`) or a list of patients (answered with `{"risk_scores": [...]}`).
+    Concurrent requests are grouped in micro-batches and scored with one vectorized
+    model call.
+    """
+    single = isinstance(patients, PatientFeatures)
+    patients = [patients] if single else patients
+    if len(patients) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_IDS} patients per request")
+    version = loaded_model().version
+
+    rows = pd.DataFrame([patient.model_dump() for patient in patients], columns=model.INPUT_COLUMNS)
+    async with workers.limit("lookup"):
+        scores = await predict_batcher.score(rows.astype({"bmi": "float64"}))
+
+    if single:
+        return {"risk_score": float(scores[0]), "model_version": version}
+    return {"risk_scores": scores.tolist(), "model_version": version}
+
+
+# Endpoint for liveness probes (never loads the data)
+@router.get("/health", include_in_schema=False)
+async def get_health(request: Request):
+    """
+    Report that the process answers, with its uptime, memory and the dataset version
+    it holds (null until the data is loaded).
+    """
+    dataset = partitions.loaded() if partitions.enabled() else filters.store.loaded
+    started_at = getattr(request.app.state, "started_at", None)
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "uptime_seconds": None if started_at is None else round(time.time() - started_at, 3),
+        "dataset_version": None if dataset is None else dataset.version,
+        "memory": metrics.process_memory(),
+    }
+
+
+# Endpoint for readiness probes (503 until the data is loaded)
+@router.get("/ready", include_in_schema=False)
+async def get_ready():
+    """
+    Report whether the process can serve requests: the dataset (or the partition
+    catalog in partitioned mode) is loaded, and the risk model when its artifact
+    exists. Answers 503 otherwise.
+    """
+    model_ready = model.is_loaded() or not model.MODEL_PATH.exists()
+    if partitions.enabled():
+        catalog = partitions.loaded()
+        if catalog is None or not model_ready:
+            raise HTTPException(status_code=503, detail="Partitions or model not loaded yet")
+        return {
+            "status": "ready",
+            "pid": os.getpid(),
+            "dataset_version": catalog.version,
+            "rows": catalog.rows,
+            "partitions": len(catalog.partitions),
+            "load_seconds": round(catalog.load_seconds, 4),
+            "loaded_at": catalog.loaded_at,
+            "model_version": model.load_model().version if model.is_loaded() else None,
         }
-    except Exception:
-        # Raise HTTP 404 if any error occurs while calculating stats
-        raise HTTPException(status_code=404, detail="")
+    dataset = filters.store.loaded
+    if dataset is None or not model_ready:
+        raise HTTPException(status_code=503, detail="Dataset or model not loaded yet")
+    return {
+        "status": "ready",
+        "pid": os.getpid(),
+        "dataset_version": dataset.version,
+        "rows": dataset.n_rows,
+        "pending_rows": dataset.pending_rows,
+        "load_seconds": round(dataset.load_seconds, 4),
+        "loaded_at": dataset.loaded_at,
+        "model_version": model.load_model().version if model.is_loaded() else None,
+    }
 
-    return stats  # Return the statistics dictionary
+
+# Endpoint exposing the request and stage metrics
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Return the latency histograms (per route and per stage), response sizes and
+    selected row counts in the Prometheus text format.
+    """
+    return Response(content=metrics.render_metrics(), media_type=metrics.METRICS_MEDIA_TYPE)
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+import hashlib
+import os
+import threading
+from fastapi import Request, Response
+from stroke_api import compression
+
+# Maximum total size (bytes) of the cached response bodies
+CACHE_MAX_BYTES = int(os.environ.get("STROKE_API_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Cache-Control max-age (seconds) sent to clients; they revalidate with If-None-Match after it
+CACHE_MAX_AGE = int(os.environ.get("STROKE_API_CACHE_MAX_AGE", "30"))
+
+
+# One serialized response kept in the cache
+class CachedResponse:
+    """
+    Serialized response body with its ETag, and its compressed copies
+    (made once per content coding, when a client first asks for it).
+
+    Args:
+        body (bytes): Response body.
+        media_type (str): Content type of the body.
+    """
+
+    def __init__(self, body: bytes, media_type: str):
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self._encoded = {}
+
+    async def encoded(self, encoding: str) -> bytes:
+        """
+        Get the body compressed with a content coding (see stroke_api.compression).
+
+        Args:
+            encoding (str): Content coding.
+
+        Returns:
+            bytes: Compressed body.
+        """
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = self._encoded[encoding] = await compression.compress_body(self.body, encoding)
+        return body
+
+
+# Bounded LRU cache with size-based eviction
+class ResponseCache:
+    """
+    LRU cache of serialized responses, bounded by the total size of the bodies.
+
+    Keys contain the dataset version, so a reload makes old entries unreachable
+    and they are evicted as new ones come in.
+
+    Args:
+        max_bytes (int, optional): Maximum total size of the cached bodies.
+    """
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        """
+        Get a cached response and mark it as recently used.
+
+        Args:
+            key (tuple): Cache key.
+
+        Returns:
+            Optional[CachedResponse]: Cached response, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, entry: CachedResponse):
+        """
+        Add a response, evicting the least recently used ones to stay under max_bytes.
+        Responses bigger than a quarter of the cache are not kept.
+
+        Args:
+            key (tuple): Cache key.
+            entry (CachedResponse): Response to cache.
+        """
+        entry_size = len(entry.body)
+        if entry_size > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.body)
+            self._entries[key] = entry
+            self.size += entry_size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+# Shared cache of the API responses
+response_cache = ResponseCache()
+
+
+# function that builds the cache key of a request
+def request_key(request: Request, version: str, variant: str = "") -> tuple:
+    """
+    Cache key of a request : path, normalized (sorted) query parameters, dataset version
+    and response variant (e.g. the format negotiated from the Accept header).
+
+    Args:
+        request (Request): Incoming request.
+        version (str): Dataset version the response is computed from.
+        variant (str, optional): Response variant.
+
+    Returns:
+        tuple: Cache key.
+    """
+    query = tuple(sorted(request.query_params.multi_items()))
+    return (request.url.path, query, version, variant)
+
+
+# function that answers a request from the cache, with ETag / If-None-Match support
+async def cached_response(
+    request: Request,
+    version: str,
+    build: Callable[[], Awaitable[bytes]],
+    media_type: str = "application/json",
+    variant: str = ""
+) -> Response:
+    """
+    Return the cached response of a request, computing and caching it on a miss.
+
+    If the client sends an `If-None-Match` header matching the ETag, a 304 response
+    without body is returned. The body is compressed with the coding negotiated from
+    `Accept-Encoding` (the compressed copy is cached with the entry).
+
+    Args:
+        request (Request): Incoming request.
+        version (str): Dataset version the response is computed from.
+        build (Callable[[], Awaitable[bytes]]): Coroutine function computing the body on a cache miss.
+        media_type (str, optional): Content type of the body.
+        variant (str, optional): Response variant (negotiated format), part of the key.
+
+    Returns:
+        Response: 200 response with the body, or 304 Not Modified.
+    """
+    key = request_key(request, version, variant)
+    entry = response_cache.get(key)
+    if entry is None:
+        entry = CachedResponse(await build(), media_type)
+        response_cache.put(key, entry)
+
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"public, max-age={CACHE_MAX_AGE}",
+        "Vary": "Accept, Accept-Encoding",
+    }
+    encoding = compression.negotiate_encoding(request.headers.get("accept-encoding"))
+    if encoding is not None and compression.is_compressible(entry.media_type, len(entry.body)):
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = "W/" + entry.etag
+    else:
+        encoding = None
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or entry.etag in [
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ]):
+        return Response(status_code=304, headers=headers)
+
+    body = entry.body if encoding is None else await entry.encoded(encoding)
+    return Response(content=body, media_type=entry.media_type, headers=headers)
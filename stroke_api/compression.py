@@ -0,0 +1,256 @@
+from typing import Optional
+import gzip
+import os
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from stroke_api import metrics
+from stroke_api import workers
+
+try:
+    # Optional Brotli encoder (Content-Encoding: br)
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    # Optional Zstandard encoder (Content-Encoding: zstd)
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Responses smaller than this (bytes) are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.environ.get("STROKE_API_COMPRESS_MIN_BYTES", "1024"))
+
+# Bodies larger than this (bytes) are compressed on the worker pool instead of the event loop
+COMPRESS_OFFLOAD_BYTES = 256 * 1024
+
+# Compression levels : fast settings, responses are compressed while the client waits
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# Media types that are already compressed
+COMPRESSED_MEDIA_TYPES = ("application/vnd.apache.parquet", "application/x-parquet")
+
+# Content codings available here, preferred first
+ENCODINGS = [
+    encoding for encoding, module in (("zstd", zstandard), ("br", brotli), ("gzip", gzip)) if module is not None
+]
+
+
+# function that chooses the content coding from the Accept-Encoding header
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Choose the response coding: the accepted coding with the highest q-value,
+    the server preference (zstd, br, gzip) breaking ties.
+
+    Args:
+        accept_encoding (Optional[str]): Accept-Encoding header, e.g. "gzip, br;q=0.9".
+
+    Returns:
+        Optional[str]: "zstd", "br" or "gzip", or None to send the body as is.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.strip().partition(";")
+        weight = 1.0
+        parameter = parameters.strip()
+        if parameter.startswith("q="):
+            try:
+                weight = float(parameter[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+# function that tells whether a response is worth compressing
+def is_compressible(media_type: Optional[str], size: Optional[int] = None) -> bool:
+    """
+    Check the media type and size of a response.
+
+    Args:
+        media_type (Optional[str]): Content type of the response.
+        size (Optional[int], optional): Body size, None for a stream.
+
+    Returns:
+        bool: True if the response should be compressed.
+    """
+    if media_type and media_type.split(";")[0].strip() in COMPRESSED_MEDIA_TYPES:
+        return False
+    return size is None or size >= COMPRESS_MIN_BYTES
+
+
+# function that compresses a whole body
+def compress(body: bytes, encoding: str) -> bytes:
+    """
+    Compress a response body.
+
+    Args:
+        body (bytes): Body.
+        encoding (str): "zstd", "br" or "gzip".
+
+    Returns:
+        bytes: Compressed body.
+    """
+    with metrics.stage("compress"):
+        if encoding == "zstd":
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+        if encoding == "br":
+            return brotli.compress(body, quality=BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# function that compresses a body off the event loop when it is large
+async def compress_body(body: bytes, encoding: str) -> bytes:
+    """
+    Compress a body, on the worker pool when it is larger than COMPRESS_OFFLOAD_BYTES.
+
+    Args:
+        body (bytes): Body.
+        encoding (str): Content coding.
+
+    Returns:
+        bytes: Compressed body.
+    """
+    if len(body) >= COMPRESS_OFFLOAD_BYTES:
+        return await workers.pool.run(compress, body, encoding)
+    return compress(body, encoding)
+
+
+# Incremental compressor for streamed responses
+class StreamCompressor:
+    """
+    Compress a streamed body chunk by chunk. Each chunk is flushed, so the client
+    can decode the records of a batch as soon as it arrives.
+
+    Args:
+        encoding (str): "zstd", "br" or "gzip".
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compress and flush one chunk."""
+        with metrics.stage("compress"):
+            if self.encoding == "zstd":
+                return self._compressor.compress(chunk) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+            if self.encoding == "br":
+                return self._compressor.process(chunk) + self._compressor.flush()
+            return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """End of the compressed stream."""
+        with metrics.stage("compress"):
+            if self.encoding == "br":
+                return self._compressor.finish()
+            return self._compressor.flush()
+
+
+# function that marks the headers of a compressed response
+def set_encoding_headers(headers: MutableHeaders, encoding: str):
+    """
+    Set Content-Encoding and Vary, and make the ETag weak: the compressed bytes
+    differ from the identity representation but If-None-Match still matches.
+
+    Args:
+        headers (MutableHeaders): Response headers.
+        encoding (str): Content coding.
+    """
+    headers["Content-Encoding"] = encoding
+    headers.add_vary_header("Accept-Encoding")
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        headers["ETag"] = "W/" + etag
+
+
+# ASGI middleware compressing the responses negotiated with Accept-Encoding
+class CompressionMiddleware:
+    """
+    Compress the responses with zstd, brotli or gzip, according to the client's
+    Accept-Encoding. Bodies under COMPRESS_MIN_BYTES, Parquet files, responses that
+    are already encoded and files served with byte ranges (their offsets refer to
+    the stored bytes) are sent as is; streams are compressed chunk by chunk.
+
+    Args:
+        app: ASGI application.
+        minimum_size (int, optional): Smallest body compressed.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor: Optional[StreamCompressor] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk tells the size of the response
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                size = None if more_body else len(body)
+                if (
+                    "content-encoding" in headers or start["status"] in (204, 206, 304)
+                    or "accept-ranges" in headers
+                    or not is_compressible(headers.get("content-type"), size)
+                    or (size is not None and size < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                set_encoding_headers(headers, encoding)
+                if more_body:
+                    del headers["Content-Length"]
+                    compressor = StreamCompressor(encoding)
+                else:
+                    body = await compress_body(body, encoding)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    start = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start)
+                start = None
+
+            chunk = compressor.compress(body) if body else b""
+            if not more_body:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,231 @@
+from math import prod
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from stroke_api.schema import AGE_GROUP_WIDTH, CATEGORIES, RANGES
+
+# Dimensions of the cube (low-cardinality columns and the age group)
+DIMENSIONS = [
+    'gender', 'stroke', 'hypertension', 'heart_disease', 'ever_married', 'work_type',
+    'Residence_type', 'smoking_status', 'age_group'
+]
+
+# Binary dimensions, whose rate can be asked with `rate:<flag>`
+FLAG_DIMENSIONS = ['stroke', 'hypertension', 'heart_disease']
+
+# Measures summed in every cell
+MEASURES = ['age', 'avg_glucose_level', 'bmi']
+
+# First age of every age group
+AGE_GROUPS = list(range(0, RANGES['age'][1] + 1, AGE_GROUP_WIDTH))
+
+
+# function that lists the values of every dimension
+def dimension_labels() -> dict:
+    """
+    Values of each dimension, in axis order.
+
+    Returns:
+        dict: dimension -> list of values.
+    """
+    labels = {dimension: [0, 1] for dimension in FLAG_DIMENSIONS}
+    labels.update(CATEGORIES)
+    labels['age_group'] = AGE_GROUPS
+    return {dimension: labels[dimension] for dimension in DIMENSIONS}
+
+
+# function that parses a cube metric ("count", "share", "mean:bmi", "sum:age", "rate:stroke")
+def parse_cube_metric(metric: str) -> tuple:
+    """
+    Parse a metric of the cube.
+
+    Supported forms:
+    - `count`, `share` (count divided by the count of the whole slice)
+    - `mean:<measure>` and `sum:<measure>` with measure in age, avg_glucose_level, bmi
+    - `rate:<flag>` with flag in stroke, hypertension, heart_disease
+
+    Args:
+        metric (str): Metric specification.
+
+    Returns:
+        tuple: (output name, function, column).
+
+    Raises:
+        ValueError: If the metric is not valid.
+    """
+    parts = metric.split(':')
+    if parts in (['count'], ['share']):
+        return parts[0], parts[0], None
+    if len(parts) == 2 and parts[0] in ('mean', 'sum') and parts[1] in MEASURES:
+        return f"{parts[0]}_{parts[1]}", parts[0], parts[1]
+    if len(parts) == 2 and parts[0] == 'rate' and parts[1] in FLAG_DIMENSIONS:
+        return f"rate_{parts[1]}", 'rate', parts[1]
+    raise ValueError(f"Unknown crosstab metric: {metric}")
+
+
+# OLAP cube : counts and sums of every combination of the dimensions
+class DataCube:
+    """
+    Dense cube of pre-aggregated values, one cell per combination of the dimensions
+    (about 21k cells), built once per dataset version with one `np.bincount` per measure.
+
+    Each cell holds the patient count and, for each measure, its sum and number of
+    non-missing values. A slice selects values along some axes and a roll-up sums the
+    other axes, so any cross-tab is answered from the cube without touching the rows.
+
+    Args:
+        df (pd.DataFrame): Patient rows.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.labels = dimension_labels()
+        self.shape = tuple(len(values) for values in self.labels.values())
+        self.channels = ['count'] + [f"{kind}_{measure}" for measure in MEASURES for kind in ('sum', 'n')]
+
+        codes = [self._codes(df, dimension) for dimension in DIMENSIONS]
+        flat = np.ravel_multi_index(codes, self.shape)
+        size = prod(self.shape)
+        channels = [np.bincount(flat, minlength=size)]
+        for measure in MEASURES:
+            values = df[measure].to_numpy(dtype=np.float64)
+            known = ~np.isnan(values)
+            channels.append(np.bincount(flat, weights=np.where(known, values, 0.0), minlength=size))
+            channels.append(np.bincount(flat, weights=known.astype(np.float64), minlength=size))
+        # Cells in axis order, channels last : (gender, stroke, ..., age_group, channel)
+        self.values = np.stack(channels, axis=-1).astype(np.float64).reshape(self.shape + (len(channels),))
+
+    def _codes(self, df: pd.DataFrame, dimension: str) -> np.ndarray:
+        """Axis position of every row along one dimension."""
+        if dimension == 'age_group':
+            groups = df['age'].to_numpy(dtype=np.float64) // AGE_GROUP_WIDTH
+            return np.clip(np.nan_to_num(groups), 0, len(AGE_GROUPS) - 1).astype(np.intp)
+        codes = pd.Categorical(df[dimension], categories=self.labels[dimension]).codes
+        if (codes < 0).any():
+            raise ValueError(f"Values of {dimension} outside the cube dimension")
+        return codes.astype(np.intp)
+
+    def _positions(self, dimension: str, values: list) -> np.ndarray:
+        """Axis positions of the filter values of a dimension."""
+        labels = [str(label) for label in self.labels[dimension]]
+        positions = []
+        for value in values:
+            if str(value) not in labels:
+                raise ValueError(f"Unknown value for {dimension}: {value}")
+            positions.append(labels.index(str(value)))
+        return np.array(sorted(set(positions)), dtype=np.intp)
+
+    def query(
+        self,
+        group_by: Optional[List[str]] = None,
+        metrics: Optional[List[str]] = None,
+        filters: Optional[dict] = None
+    ) -> list:
+        """
+        Answer a slice / roll-up from the pre-aggregated cells.
+
+        Args:
+            group_by (Optional[List[str]], optional): Dimensions kept in the result (none = one total row).
+            metrics (Optional[List[str]], optional): Metrics (default: count), see parse_cube_metric.
+            filters (Optional[dict], optional): dimension -> list of values to keep.
+
+        Returns:
+            list[dict]: One record per non-empty group, with the group values and the metrics.
+
+        Raises:
+            ValueError: If a dimension, value or metric is not valid.
+        """
+        group_by = list(dict.fromkeys(group_by or []))
+        parsed = [parse_cube_metric(metric) for metric in (metrics or ['count'])]
+        for dimension in list(group_by) + list(filters or {}):
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown crosstab dimension: {dimension}")
+
+        # Slice : keep the filtered values along each axis
+        cells = self.values
+        labels = dict(self.labels)
+        for dimension, values in (filters or {}).items():
+            if values:
+                axis = DIMENSIONS.index(dimension)
+                positions = self._positions(dimension, values)
+                cells = np.take(cells, positions, axis=axis)
+                labels[dimension] = [self.labels[dimension][position] for position in positions]
+
+        # Rates : count of the cells where the flag is 1, as an extra channel
+        rate_flags = sorted({column for _, function, column in parsed if function == 'rate'})
+        extra = []
+        for flag in rate_flags:
+            positive = np.array([label == 1 for label in labels[flag]], dtype=np.float64)
+            axis_shape = [1] * len(DIMENSIONS)
+            axis_shape[DIMENSIONS.index(flag)] = len(positive)
+            extra.append(cells[..., 0] * positive.reshape(axis_shape))
+        if extra:
+            cells = np.concatenate([cells] + [channel[..., None] for channel in extra], axis=-1)
+
+        # Roll-up : sum the axes that are not grouped, in group_by order
+        kept = [DIMENSIONS.index(dimension) for dimension in group_by]
+        summed = tuple(axis for axis in range(len(DIMENSIONS)) if axis not in kept)
+        rolled = cells.sum(axis=summed)
+        rolled = np.moveaxis(rolled, list(np.argsort(np.argsort(kept))), list(range(len(kept)))) if kept else rolled
+        rolled = rolled.reshape(-1, cells.shape[-1])
+        total = rolled[:, 0].sum()
+
+        # Non-empty groups only
+        index = np.flatnonzero(rolled[:, 0] > 0)
+        keys = np.unravel_index(index, tuple(len(labels[dimension]) for dimension in group_by)) if kept else []
+        rows = rolled[index]
+
+        columns = {}
+        for position, dimension in enumerate(group_by):
+            columns[dimension] = np.asarray(labels[dimension], dtype=object)[keys[position]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name, function, column in parsed:
+                if function == 'count':
+                    columns[name] = rows[:, 0].astype(np.int64)
+                elif function == 'share':
+                    columns[name] = rows[:, 0] / total if total else rows[:, 0] * np.nan
+                elif function == 'rate':
+                    columns[name] = rows[:, len(self.channels) + rate_flags.index(column)] / rows[:, 0]
+                else:
+                    channel = self.channels.index(f"sum_{column}")
+                    sums, counts = rows[:, channel], rows[:, channel + 1]
+                    columns[name] = sums if function == 'sum' else np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+        result = pd.DataFrame(columns)
+        # Empty measures give NaN, which is not valid JSON
+        return result.astype(object).where(result.notna(), None).to_dict(orient='records')
+
+
+# function that returns the cube of a dataset version (built on first use)
+def dataset_cube(dataset) -> DataCube:
+    """
+    Get the data cube of a dataset version, built once with `dataset.derived`.
+
+    Args:
+        dataset (Dataset): Dataset version.
+
+    Returns:
+        DataCube: Cube of the dataset.
+    """
+    return dataset.derived("cube", lambda data: DataCube(data.rows()))
+
+
+# function that answers a cross-tab on a dataset (used by /crosstab)
+def crosstab(
+    group_by: Optional[List[str]] = None,
+    metrics: Optional[List[str]] = None,
+    filters: Optional[dict] = None,
+    dataset=None
+) -> list:
+    """
+    Cross-tab of the patients from the data cube of the dataset.
+
+    Args:
+        group_by (Optional[List[str]], optional): Dimensions of the result.
+        metrics (Optional[List[str]], optional): Metrics (default: count).
+        filters (Optional[dict], optional): dimension -> values to keep.
+        dataset (Optional[Dataset], optional): Dataset to query.
+
+    Returns:
+        list[dict]: One record per non-empty group.
+    """
+    return dataset_cube(dataset).query(group_by=group_by, metrics=metrics, filters=filters)
@@ -0,0 +1,378 @@
+from typing import List, Optional
+import math
+import os
+import numpy as np
+import pandas as pd
+from stroke_api.schema import CATEGORIES, RANGES
+
+# Columns whose distribution is kept
+DISTRIBUTION_COLUMNS = ['age', 'bmi', 'avg_glucose_level']
+
+# Group keys of the sketches : the filters of /distribution are answered by merging groups
+GROUP_KEYS = ['gender', 'stroke']
+
+# Compression of the t-digests (a digest keeps about compression / 2 centroids)
+COMPRESSION = int(os.environ.get("STROKE_API_TDIGEST_COMPRESSION", "200"))
+
+# Number of fixed-width histogram bins over the documented range of each column
+HISTOGRAM_BINS = 20
+
+# Percentiles returned when none are asked
+DEFAULT_PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+
+
+# function that merges sorted weighted points into t-digest centroids
+def _compress(means: np.ndarray, weights: np.ndarray, compression: int) -> tuple:
+    """
+    Group sorted points into centroids of at most one unit of the t-digest scale
+    function k(q) = compression / (2 pi) * asin(2q - 1): centroids are small in the
+    tails and large around the median, which keeps the extreme quantiles accurate.
+
+    Args:
+        means (np.ndarray): Point values (or centroid means), sorted.
+        weights (np.ndarray): Weight of each point.
+        compression (int): Compression of the digest.
+
+    Returns:
+        tuple: (centroid means, centroid weights).
+    """
+    total = weights.sum()
+    middle = (np.cumsum(weights) - weights / 2) / total
+    scale = compression / (2 * math.pi) * np.arcsin(2 * middle - 1)
+    cluster = np.floor(scale - scale[0]).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, cluster[1:] != cluster[:-1]])
+    cluster_weights = np.add.reduceat(weights, starts)
+    return np.add.reduceat(means * weights, starts) / cluster_weights, cluster_weights
+
+
+# Mergeable quantile sketch
+class TDigest:
+    """
+    Merging t-digest: about a hundred (mean, weight) centroids summarizing a distribution.
+    Digests of disjoint groups merge into the digest of their union, so the quantiles of
+    any combination of groups are computed without the rows.
+
+    Args:
+        means (np.ndarray): Centroid means, sorted.
+        weights (np.ndarray): Centroid weights.
+        minimum (float): Smallest value.
+        maximum (float): Largest value.
+        compression (int, optional): Compression of the digest.
+    """
+
+    def __init__(
+        self,
+        means: np.ndarray,
+        weights: np.ndarray,
+        minimum: float,
+        maximum: float,
+        compression: int = COMPRESSION
+    ):
+        self.means = means
+        self.weights = weights
+        self.minimum = minimum
+        self.maximum = maximum
+        self.compression = compression
+
+    @classmethod
+    def from_values(cls, values: np.ndarray, compression: int = COMPRESSION) -> "TDigest":
+        """
+        Build the digest of values (missing values are ignored).
+
+        Args:
+            values (np.ndarray): Values.
+            compression (int, optional): Compression of the digest.
+
+        Returns:
+            TDigest: Digest of the values.
+        """
+        values = np.sort(values[~np.isnan(values)].astype(np.float64))
+        if len(values) == 0:
+            return cls(np.empty(0), np.empty(0), math.nan, math.nan, compression)
+        means, weights = _compress(values, np.ones(len(values)), compression)
+        return cls(means, weights, float(values[0]), float(values[-1]), compression)
+
+    @classmethod
+    def merge(cls, digests: list, compression: int = COMPRESSION) -> "TDigest":
+        """
+        Merge digests into the digest of all their values.
+
+        Args:
+            digests (list): Digests to merge.
+            compression (int, optional): Compression of the result.
+
+        Returns:
+            TDigest: Merged digest.
+        """
+        digests = [digest for digest in digests if digest.count]
+        if not digests:
+            return cls(np.empty(0), np.empty(0), math.nan, math.nan, compression)
+        if len(digests) == 1:
+            return digests[0]
+        means = np.concatenate([digest.means for digest in digests])
+        weights = np.concatenate([digest.weights for digest in digests])
+        order = np.argsort(means, kind='stable')
+        means, weights = _compress(means[order], weights[order], compression)
+        return cls(
+            means, weights,
+            min(digest.minimum for digest in digests), max(digest.maximum for digest in digests),
+            compression
+        )
+
+    @property
+    def count(self) -> int:
+        """Number of values summarized."""
+        return int(self.weights.sum())
+
+    def mean(self) -> float:
+        """Exact mean of the values."""
+        return float(np.dot(self.means, self.weights) / self.weights.sum()) if self.count else math.nan
+
+    def quantile(self, q: np.ndarray) -> np.ndarray:
+        """
+        Estimate quantiles by interpolating between the centroid centers
+        (and the exact minimum / maximum at both ends).
+
+        Args:
+            q (np.ndarray): Quantiles between 0 and 1.
+
+        Returns:
+            np.ndarray: Estimated values (NaN if the digest is empty).
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if not self.count:
+            return np.full(q.shape, math.nan)
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        ranks = np.r_[0.0, centers, total]
+        values = np.r_[self.minimum, self.means, self.maximum]
+        return np.interp(q * total, ranks, values)
+
+
+# function that returns the histogram bin edges of a column
+def histogram_edges(column: str) -> np.ndarray:
+    """
+    Fixed bin edges over the documented valid range of a column.
+
+    Args:
+        column (str): Column name.
+
+    Returns:
+        np.ndarray: HISTOGRAM_BINS + 1 edges.
+    """
+    low, high = RANGES[column]
+    return np.linspace(low, high, HISTOGRAM_BINS + 1)
+
+
+# Sketch of one column in one group : t-digest and fixed-bin histogram
+class ColumnSketch:
+    """
+    Quantile digest and histogram of one column. Histograms are additive,
+    values outside the documented range are counted in `below` / `above`.
+
+    Args:
+        digest (TDigest): Quantile digest.
+        counts (np.ndarray): Counts of the histogram bins.
+        below (int): Values under the first edge.
+        above (int): Values over the last edge.
+        missing (int): Missing values.
+    """
+
+    def __init__(self, digest: TDigest, counts: np.ndarray, below: int, above: int, missing: int):
+        self.digest = digest
+        self.counts = counts
+        self.below = below
+        self.above = above
+        self.missing = missing
+
+    @classmethod
+    def from_values(cls, column: str, values: np.ndarray) -> "ColumnSketch":
+        """Build the sketch of the values of a column."""
+        known = ~np.isnan(values)
+        values = values[known].astype(np.float64)
+        edges = histogram_edges(column)
+        counts, _ = np.histogram(values, bins=edges)
+        return cls(
+            TDigest.from_values(values), counts,
+            int(np.count_nonzero(values < edges[0])), int(np.count_nonzero(values > edges[-1])),
+            int(np.count_nonzero(~known))
+        )
+
+    @classmethod
+    def merge(cls, sketches: list) -> "ColumnSketch":
+        """Merge the sketches of disjoint groups."""
+        return cls(
+            TDigest.merge([sketch.digest for sketch in sketches]),
+            np.sum([sketch.counts for sketch in sketches], axis=0),
+            sum(sketch.below for sketch in sketches),
+            sum(sketch.above for sketch in sketches),
+            sum(sketch.missing for sketch in sketches)
+        )
+
+
+# function that computes the sketches of each (gender, stroke) group
+def compute_sketches(df: pd.DataFrame) -> dict:
+    """
+    Compute the column sketches of each (gender, stroke) group.
+
+    Args:
+        df (pd.DataFrame): Patient rows.
+
+    Returns:
+        dict: (gender, stroke) -> {column: ColumnSketch}.
+    """
+    sketches = {}
+    if df.empty:
+        return sketches
+    columns = {column: df[column].to_numpy(dtype=np.float64) for column in DISTRIBUTION_COLUMNS}
+    for (gender, stroke), positions in df.groupby(GROUP_KEYS, observed=True).indices.items():
+        sketches[(gender, int(stroke))] = {
+            column: ColumnSketch.from_values(column, values[positions]) for column, values in columns.items()
+        }
+    return sketches
+
+
+# function that merges two sets of group sketches
+def merge_sketches(left: dict, right: dict) -> dict:
+    """
+    Merge group sketches : the sketches of a group present on both sides are merged.
+
+    Args:
+        left (dict): Group sketches.
+        right (dict): Group sketches of other rows.
+
+    Returns:
+        dict: Merged group sketches.
+    """
+    merged = dict(left)
+    for key, sketches in right.items():
+        if key in merged:
+            merged[key] = {
+                column: ColumnSketch.merge([merged[key][column], sketch]) for column, sketch in sketches.items()
+            }
+        else:
+            merged[key] = sketches
+    return merged
+
+
+# Distribution subsystem : sketches computed once at load time and served from memory
+class DistributionAggregator:
+    """
+    Keep t-digests and histograms of age, bmi and avg_glucose_level per (gender, stroke)
+    group; the distribution of any combination of groups is a merge of a few sketches.
+
+    Args:
+        df (pd.DataFrame): Patient dataset.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.groups = compute_sketches(df)
+
+    def add_rows(self, rows: pd.DataFrame):
+        """
+        Update the sketches incrementally with new patient rows.
+
+        Args:
+            rows (pd.DataFrame): New patient rows.
+        """
+        if not rows.empty:
+            self.groups = merge_sketches(self.groups, compute_sketches(rows))
+
+    def replace_groups(self, groups: pd.MultiIndex, rows: pd.DataFrame):
+        """
+        Sketch some groups again from their current rows (used when rows are removed).
+
+        Args:
+            groups (pd.MultiIndex): (gender, stroke) groups to recompute.
+            rows (pd.DataFrame): Every current row of these groups.
+        """
+        self.groups = {key: sketches for key, sketches in self.groups.items() if key not in groups}
+        self.add_rows(rows)
+
+    def reload(self, old_df: pd.DataFrame, new_df: pd.DataFrame):
+        """
+        Update the sketches after the dataset has been reloaded : only the appended rows
+        are sketched, the sketches are rebuilt if rows changed or were removed.
+
+        Args:
+            old_df (pd.DataFrame): Dataset before the reload.
+            new_df (pd.DataFrame): Dataset after the reload.
+        """
+        n_old = len(old_df)
+        if len(new_df) >= n_old and new_df.iloc[:n_old].equals(old_df):
+            self.add_rows(new_df.iloc[n_old:])
+        else:
+            self.groups = compute_sketches(new_df)
+
+    def compute(
+        self,
+        columns: Optional[List[str]] = None,
+        gender: Optional[List[str]] = None,
+        stroke: Optional[List[int]] = None,
+        percentiles: Optional[List[float]] = None
+    ) -> dict:
+        """
+        Return the percentiles and histograms of the patients matching the filters.
+
+        Args:
+            columns (Optional[List[str]], optional): Columns (default: age, bmi, avg_glucose_level).
+            gender (Optional[List[str]], optional): Genders to keep.
+            stroke (Optional[List[int]], optional): Stroke statuses to keep (0 or 1).
+            percentiles (Optional[List[float]], optional): Percentiles between 0 and 100.
+
+        Returns:
+            dict: Patient count and, per column, count, min, max, mean, percentiles and histogram.
+
+        Raises:
+            ValueError: If a column, filter value or percentile is not valid.
+        """
+        columns = list(dict.fromkeys(columns or DISTRIBUTION_COLUMNS))
+        percentiles = list(dict.fromkeys(percentiles or DEFAULT_PERCENTILES))
+        for column in columns:
+            if column not in DISTRIBUTION_COLUMNS:
+                raise ValueError(f"Unknown distribution column: {column}")
+        for value in gender or []:
+            if value not in CATEGORIES['gender']:
+                raise ValueError(f"Unknown value for gender: {value}")
+        for value in stroke or []:
+            if value not in (0, 1):
+                raise ValueError("stroke must be 0 or 1")
+        for percentile in percentiles:
+            if not 0 <= percentile <= 100:
+                raise ValueError("percentiles must be between 0 and 100")
+
+        selected = [
+            sketches for (group_gender, group_stroke), sketches in self.groups.items()
+            if (not gender or group_gender in gender) and (not stroke or group_stroke in stroke)
+        ]
+        result = {"count": 0, "columns": {}}
+        for column in columns:
+            edges = histogram_edges(column)
+            if selected:
+                sketch = ColumnSketch.merge([sketches[column] for sketches in selected])
+            else:
+                sketch = ColumnSketch(TDigest.merge([]), np.zeros(HISTOGRAM_BINS, dtype=np.int64), 0, 0, 0)
+            digest = sketch.digest
+            values = digest.quantile(np.array(percentiles) / 100)
+            result["count"] = digest.count + sketch.missing
+            result["columns"][column] = {
+                "count": digest.count,
+                "missing": sketch.missing,
+                "min": _number(digest.minimum),
+                "max": _number(digest.maximum),
+                "mean": _number(digest.mean()),
+                "percentiles": {f"p{percentile:g}": _number(value) for percentile, value in zip(percentiles, values)},
+                "histogram": {
+                    "edges": edges.tolist(),
+                    "counts": sketch.counts.astype(int).tolist(),
+                    "below": sketch.below,
+                    "above": sketch.above,
+                },
+            }
+        return result
+
+
+# function that converts a statistic for JSON
+def _number(value: float) -> Optional[float]:
+    """Rounded float for JSON (None for NaN)."""
+    return None if math.isnan(value) else round(float(value), 4)
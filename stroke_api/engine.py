@@ -0,0 +1,485 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# Columns with a sorted array index for range lookups
+RANGE_COLUMNS = ['age', 'bmi', 'avg_glucose_level']
+
+# Low-cardinality columns whose value counts are kept (used to estimate selectivity)
+COUNTED_COLUMNS = [
+    'gender', 'hypertension', 'heart_disease', 'ever_married', 'work_type',
+    'Residence_type', 'smoking_status', 'stroke'
+]
+
+
+# Query engine built once when the dataset is loaded.
+# It keeps small precomputed indexes so filters never copy or rescan the DataFrame.
+class QueryEngine:
+    """
+    Index-backed query engine over the patient DataFrame.
+
+    Indexes built at load time:
+    - a hash index on `id` (patient id -> row position)
+    - categorical bitmaps for `gender` and `stroke` (one boolean mask per value)
+    - sorted `age`, `bmi` and `avg_glucose_level` arrays (with the matching row positions) for range lookups
+    - a sorted `id` array used as a keyset cursor for pagination
+    - value counts of the low-cardinality columns (to estimate the selectivity of a filter)
+
+    Every row is visible (`visible` is None); see LayeredEngine for the hidden rows.
+
+    Args:
+        df (pd.DataFrame): Patient dataset (as loaded from clean_health.parquet).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+
+        # Hash index on id : O(1) lookup of a row position
+        ids = df['id'].to_numpy()
+        self.ids = ids
+        self.visible = None
+        self.id_index = {int(patient_id): position for position, patient_id in enumerate(ids)}
+
+        # Sorted id array : keyset pagination walks the rows in id order
+        self.id_order = np.argsort(ids, kind='stable')
+        self.sorted_ids = ids[self.id_order]
+
+        # Categorical bitmaps : one boolean mask per distinct value
+        self.gender_bitmaps = self._build_bitmaps(df['gender'])
+        self.stroke_bitmaps = self._build_bitmaps(df['stroke'])
+
+        # Sorted arrays and the row positions in that order (NaN values sort last)
+        self.range_indexes = {}
+        for column in RANGE_COLUMNS:
+            if column in df.columns:
+                values = df[column].to_numpy()
+                order = np.argsort(values, kind='stable')
+                n_valid = int(np.count_nonzero(~np.isnan(values)))
+                self.range_indexes[column] = (order, values[order], n_valid)
+
+        # Number of rows of each value of the low-cardinality columns
+        self.value_counts = {
+            column: {
+                (value.item() if hasattr(value, 'item') else value): int(count)
+                for value, count in df[column].value_counts(sort=False).items()
+            }
+            for column in COUNTED_COLUMNS if column in df.columns
+        }
+
+    @staticmethod
+    def _build_bitmaps(column: pd.Series) -> dict:
+        """
+        Build one boolean mask per distinct value of a column.
+        Categorical columns are compared on their integer codes.
+
+        Args:
+            column (pd.Series): Low-cardinality column (gender, stroke).
+
+        Returns:
+            dict: value -> numpy boolean array of length n_rows.
+        """
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy()
+            return {category: codes == code for code, category in enumerate(column.cat.categories)}
+        values = column.to_numpy()
+        return {value.item() if hasattr(value, 'item') else value: values == value
+                for value in pd.unique(values)}
+
+    def _range_bounds(
+        self,
+        column: str,
+        low: Optional[float] = None,
+        high: Optional[float] = None,
+        include_low: bool = True,
+        include_high: bool = True
+    ) -> tuple:
+        """Start and end offsets of a value range in the sorted array of a column."""
+        _, sorted_values, n_valid = self.range_indexes[column]
+        valid = sorted_values[:n_valid]
+        # (the bounds are cast to the column dtype, e.g. float32, so equal values are kept)
+        start = 0 if low is None else np.searchsorted(
+            valid, np.asarray(low, dtype=valid.dtype), side='left' if include_low else 'right'
+        )
+        end = n_valid if high is None else np.searchsorted(
+            valid, np.asarray(high, dtype=valid.dtype), side='right' if include_high else 'left'
+        )
+        return start, max(start, end)
+
+    def range_positions(
+        self,
+        column: str,
+        low: Optional[float] = None,
+        high: Optional[float] = None,
+        include_low: bool = True,
+        include_high: bool = True
+    ) -> np.ndarray:
+        """
+        Find the rows whose value is in a range, with a binary search in the sorted array.
+
+        Args:
+            column (str): Column with a range index (age, bmi, avg_glucose_level).
+            low (Optional[float], optional): Lower bound (None = no bound).
+            high (Optional[float], optional): Upper bound (None = no bound).
+            include_low (bool, optional): Keep values equal to the lower bound.
+            include_high (bool, optional): Keep values equal to the upper bound.
+
+        Returns:
+            np.ndarray: Matching row positions, in value order (not row order).
+        """
+        order = self.range_indexes[column][0]
+        start, end = self._range_bounds(column, low, high, include_low, include_high)
+        return order[start:end]
+
+    def range_count(
+        self,
+        column: str,
+        low: Optional[float] = None,
+        high: Optional[float] = None,
+        include_low: bool = True,
+        include_high: bool = True
+    ) -> int:
+        """
+        Count the rows whose value is in a range (two binary searches, no scan).
+
+        Returns:
+            int: Number of matching rows.
+        """
+        start, end = self._range_bounds(column, low, high, include_low, include_high)
+        return int(end - start)
+
+    def all_positions(self) -> np.ndarray:
+        """
+        Positions of all the visible rows.
+
+        Returns:
+            np.ndarray: Row positions, in row order.
+        """
+        return np.arange(self.n_rows)
+
+    def id_at(self, position: int) -> int:
+        """
+        Patient id of a row.
+
+        Args:
+            position (int): Row position.
+
+        Returns:
+            int: Patient id.
+        """
+        return int(self.ids[position])
+
+    def lookup_id(self, patient_id: int) -> Optional[int]:
+        """
+        Find the row position of a patient id.
+
+        Args:
+            patient_id (int): Patient id.
+
+        Returns:
+            Optional[int]: Row position, or None if the id does not exist.
+        """
+        return self.id_index.get(patient_id)
+
+    def lookup_ids(self, patient_ids: np.ndarray) -> tuple:
+        """
+        Find the row positions of many patient ids at once (vectorized join on the sorted id array).
+
+        Args:
+            patient_ids (np.ndarray): Patient ids.
+
+        Returns:
+            tuple: (row positions of the ids found, boolean mask of the ids found).
+        """
+        patient_ids = np.asarray(patient_ids, dtype=self.sorted_ids.dtype)
+        if self.n_rows == 0:
+            return np.empty(0, dtype=np.intp), np.zeros(len(patient_ids), dtype=bool)
+        slots = np.searchsorted(self.sorted_ids, patient_ids)
+        slots = np.minimum(slots, self.n_rows - 1)
+        found = self.sorted_ids[slots] == patient_ids
+        return self.id_order[slots[found]], found
+
+    def filter_positions(
+        self,
+        gender: Optional[str] = None,
+        stroke: Optional[int] = None,
+        max_age: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Intersect the indexes to find the rows matching the filters.
+
+        Args:
+            gender (Optional[str], optional): Gender to keep.
+            stroke (Optional[int], optional): Stroke status to keep (0 or 1).
+            max_age (Optional[float], optional): Maximum age (inclusive).
+
+        Returns:
+            np.ndarray: Matching row positions, in the original row order.
+        """
+        mask = None
+
+        # Bitmap intersection for the categorical filters
+        for bitmaps, value in ((self.stroke_bitmaps, stroke), (self.gender_bitmaps, gender)):
+            if value is None:
+                continue
+            bitmap = bitmaps.get(value)
+            if bitmap is None:
+                # Unknown value : nothing can match
+                return np.empty(0, dtype=np.intp)
+            mask = bitmap if mask is None else mask & bitmap
+
+        if max_age is None:
+            if mask is None:
+                return np.arange(self.n_rows)
+            return np.flatnonzero(mask)
+
+        # Age range : binary search in the sorted array, then keep the rows
+        # also present in the bitmap intersection
+        positions = self.range_positions('age', high=max_age)
+        if mask is not None:
+            positions = positions[mask[positions]]
+        return np.sort(positions)
+
+    def page_positions(
+        self,
+        positions: np.ndarray,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Order matching rows by id and cut a page with a keyset cursor.
+
+        Args:
+            positions (np.ndarray): Matching row positions (from filter_positions).
+            after_id (Optional[int], optional): Only keep ids strictly greater than this cursor.
+            limit (Optional[int], optional): Maximum number of rows in the page.
+
+        Returns:
+            np.ndarray: Row positions of the page, in increasing id order.
+        """
+        start = 0 if after_id is None else np.searchsorted(self.sorted_ids, after_id, side='right')
+        candidates = self.id_order[start:]
+
+        if len(positions) < self.n_rows:
+            selected = np.zeros(self.n_rows, dtype=bool)
+            selected[positions] = True
+            candidates = candidates[selected[candidates]]
+
+        if limit is not None:
+            candidates = candidates[:limit]
+        return candidates
+
+
+# Query engine of a base version followed by a small delta segment
+class LayeredEngine:
+    """
+    Query engine over the rows of a base version followed by the rows of a delta
+    segment (the layout of store.DeltaDataset): positions below `offset` are base rows,
+    the next ones delta rows.
+
+    Only the delta gets a new QueryEngine; every lookup queries both engines and
+    combines their positions, so adding rows to the delta never rebuilds the indexes
+    of the base. The base rows replaced by a delta row (same id) are hidden: `visible`
+    masks them out (None when nothing is hidden).
+
+    Args:
+        base (QueryEngine): Engine of the base rows.
+        delta (pd.DataFrame): Delta rows (unique ids).
+    """
+
+    def __init__(self, base: QueryEngine, delta: pd.DataFrame):
+        self.base = base
+        self.delta = QueryEngine(delta)
+        self.offset = base.n_rows
+        self.n_rows = base.n_rows + self.delta.n_rows
+
+        # Base rows replaced by the delta
+        self.hidden, _ = base.lookup_ids(self.delta.ids)
+        self.visible = None
+        if len(self.hidden):
+            self.visible = np.ones(self.n_rows, dtype=bool)
+            self.visible[self.hidden] = False
+
+        # Columns with a range index (the lookups combine the indexes of both engines)
+        self.range_indexes = base.range_indexes
+
+        # Value counts of both engines (selectivity estimates : the hidden rows are still counted)
+        self.value_counts = {
+            column: {
+                value: counts.get(value, 0) + self.delta.value_counts[column].get(value, 0)
+                for value in {**counts, **self.delta.value_counts[column]}
+            }
+            for column, counts in base.value_counts.items()
+        }
+        self._gender_bitmaps: Optional[dict] = None
+        self._stroke_bitmaps: Optional[dict] = None
+
+    def _visible_base(self, positions: np.ndarray) -> np.ndarray:
+        """Drop the hidden rows from base positions."""
+        if self.visible is None:
+            return positions
+        return positions[self.visible[positions]]
+
+    def _combine_bitmaps(self, base: dict, delta: dict) -> dict:
+        """Concatenate the bitmaps of both engines (hidden rows are False)."""
+        bitmaps = {}
+        for value in {**base, **delta}:
+            bitmap = np.concatenate([
+                base.get(value, np.zeros(self.offset, dtype=bool)),
+                delta.get(value, np.zeros(self.delta.n_rows, dtype=bool))
+            ])
+            bitmaps[value] = bitmap if self.visible is None else bitmap & self.visible
+        return bitmaps
+
+    @property
+    def gender_bitmaps(self) -> dict:
+        """Gender bitmaps over all the positions (built on first use)."""
+        if self._gender_bitmaps is None:
+            self._gender_bitmaps = self._combine_bitmaps(self.base.gender_bitmaps, self.delta.gender_bitmaps)
+        return self._gender_bitmaps
+
+    @property
+    def stroke_bitmaps(self) -> dict:
+        """Stroke bitmaps over all the positions (built on first use)."""
+        if self._stroke_bitmaps is None:
+            self._stroke_bitmaps = self._combine_bitmaps(self.base.stroke_bitmaps, self.delta.stroke_bitmaps)
+        return self._stroke_bitmaps
+
+    def all_positions(self) -> np.ndarray:
+        """
+        Positions of all the visible rows.
+
+        Returns:
+            np.ndarray: Row positions, in row order.
+        """
+        if self.visible is None:
+            return np.arange(self.n_rows)
+        return np.flatnonzero(self.visible)
+
+    def id_at(self, position: int) -> int:
+        """
+        Patient id of a row.
+
+        Args:
+            position (int): Row position.
+
+        Returns:
+            int: Patient id.
+        """
+        if position >= self.offset:
+            return self.delta.id_at(position - self.offset)
+        return self.base.id_at(position)
+
+    def range_positions(
+        self,
+        column: str,
+        low: Optional[float] = None,
+        high: Optional[float] = None,
+        include_low: bool = True,
+        include_high: bool = True
+    ) -> np.ndarray:
+        """
+        Find the rows whose value is in a range (see QueryEngine.range_positions).
+
+        Returns:
+            np.ndarray: Matching row positions : the base rows in value order, then the delta rows in value order.
+        """
+        return np.concatenate([
+            self._visible_base(self.base.range_positions(column, low, high, include_low, include_high)),
+            self.delta.range_positions(column, low, high, include_low, include_high) + self.offset
+        ])
+
+    def range_count(
+        self,
+        column: str,
+        low: Optional[float] = None,
+        high: Optional[float] = None,
+        include_low: bool = True,
+        include_high: bool = True
+    ) -> int:
+        """
+        Estimate the number of rows whose value is in a range (the hidden rows are still counted).
+
+        Returns:
+            int: Number of matching rows.
+        """
+        return (
+            self.base.range_count(column, low, high, include_low, include_high)
+            + self.delta.range_count(column, low, high, include_low, include_high)
+        )
+
+    def lookup_id(self, patient_id: int) -> Optional[int]:
+        """
+        Find the row position of a patient id, in the delta first.
+
+        Args:
+            patient_id (int): Patient id.
+
+        Returns:
+            Optional[int]: Row position, or None if the id does not exist.
+        """
+        position = self.delta.lookup_id(patient_id)
+        if position is not None:
+            return position + self.offset
+        return self.base.lookup_id(patient_id)
+
+    def lookup_ids(self, patient_ids: np.ndarray) -> tuple:
+        """
+        Find the row positions of many patient ids, in the delta first.
+
+        Args:
+            patient_ids (np.ndarray): Patient ids.
+
+        Returns:
+            tuple: (row positions of the ids found, boolean mask of the ids found).
+        """
+        patient_ids = np.asarray(patient_ids, dtype=self.base.sorted_ids.dtype)
+        positions = np.full(len(patient_ids), -1, dtype=np.intp)
+        delta_positions, in_delta = self.delta.lookup_ids(patient_ids)
+        positions[in_delta] = delta_positions + self.offset
+        others = np.flatnonzero(~in_delta)
+        base_positions, in_base = self.base.lookup_ids(patient_ids[others])
+        positions[others[in_base]] = base_positions
+        found = positions >= 0
+        return positions[found], found
+
+    def filter_positions(
+        self,
+        gender: Optional[str] = None,
+        stroke: Optional[int] = None,
+        max_age: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Find the rows matching the filters in both engines (see QueryEngine.filter_positions).
+
+        Returns:
+            np.ndarray: Matching row positions, in the original row order.
+        """
+        return np.concatenate([
+            self._visible_base(self.base.filter_positions(gender=gender, stroke=stroke, max_age=max_age)),
+            self.delta.filter_positions(gender=gender, stroke=stroke, max_age=max_age) + self.offset
+        ])
+
+    def page_positions(
+        self,
+        positions: np.ndarray,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Order matching rows by id and cut a page with a keyset cursor : a page is cut
+        in each engine, then the two pages are merged by id.
+
+        Args:
+            positions (np.ndarray): Matching row positions (visible rows only).
+            after_id (Optional[int], optional): Only keep ids strictly greater than this cursor.
+            limit (Optional[int], optional): Maximum number of rows in the page.
+
+        Returns:
+            np.ndarray: Row positions of the page, in increasing id order.
+        """
+        in_delta = positions >= self.offset
+        base_page = self.base.page_positions(positions[~in_delta], after_id=after_id, limit=limit)
+        delta_page = self.delta.page_positions(positions[in_delta] - self.offset, after_id=after_id, limit=limit)
+        ids = np.concatenate([self.base.ids[base_page], self.delta.ids[delta_page]])
+        page = np.concatenate([base_page, delta_page + self.offset])[np.argsort(ids, kind='stable')]
+        return page if limit is None else page[:limit]
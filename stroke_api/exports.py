@@ -0,0 +1,484 @@
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from stroke_api import filters
+from stroke_api import query as patient_query
+from stroke_api.serialization import PARQUET_MEDIA_TYPE, widen_floats
+from stroke_api.store import DATA_DIR, Dataset
+
+logger = logging.getLogger(__name__)
+
+# Directory of the export files
+EXPORT_DIR = Path(os.environ.get("STROKE_API_EXPORT_DIR", DATA_DIR / "exports"))
+
+# Number of exports written at the same time (dedicated threads, not the request pool)
+EXPORT_WORKERS = int(os.environ.get("STROKE_API_EXPORT_WORKERS", "2"))
+
+# Rows taken and written per chunk
+EXPORT_BATCH_ROWS = 50_000
+
+# Jobs kept in memory; the oldest finished ones (and their files) are dropped beyond this
+MAX_EXPORT_JOBS = int(os.environ.get("STROKE_API_MAX_EXPORT_JOBS", "64"))
+
+# Export format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": (PARQUET_MEDIA_TYPE, "parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", "arrow"),
+}
+
+# Job states
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+# Format of the job ids (hex digest prefix), checked before a path is built from an id
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{24}")
+
+
+# Raised in the writer thread when the job is cancelled
+class ExportCancelled(Exception):
+    """The export was cancelled between two chunks."""
+
+
+# One export : a filter and a format written to a file in the background
+class ExportJob:
+    """
+    State of an export, shared between the API (status, download) and the writer thread.
+    The state is also saved in `<id>.json` next to the export file, so the other server
+    processes can report, download and cancel the job.
+
+    Args:
+        job_id (str): Job id (hash of the export key).
+        version (str): Dataset version exported.
+        response_format (str): csv, parquet or arrow.
+        query (Optional[Node]): Compiled filter (see stroke_api.query).
+        fields (Optional[list]): Columns to export (see filters.parse_fields), default all.
+        with_risk_score (bool): Add the precomputed `risk_score` column.
+        path (Path): File written by the job.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        version: str,
+        response_format: str,
+        query: Optional[patient_query.Node],
+        fields: Optional[list],
+        with_risk_score: bool,
+        path: Path
+    ):
+        self.id = job_id
+        self.version = version
+        self.response_format = response_format
+        self.query = query
+        self.fields = fields
+        self.with_risk_score = with_risk_score
+        self.path = path
+        self.status = QUEUED
+        self.rows_total: Optional[int] = None
+        self.rows_written = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.pid = os.getpid()
+        self.cancelled = threading.Event()
+
+    @property
+    def media_type(self) -> str:
+        """Media type of the export file."""
+        return EXPORT_FORMATS[self.response_format][0]
+
+    @property
+    def filename(self) -> str:
+        """File name proposed to the client."""
+        return f"patients-{self.id}.{EXPORT_FORMATS[self.response_format][1]}"
+
+    @property
+    def finished(self) -> bool:
+        """True once the job is done, failed or cancelled."""
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def state_path(self) -> Path:
+        """File holding the state of the job, read by the other processes."""
+        return self.path.with_name(f"{self.id}.json")
+
+    @property
+    def cancel_path(self) -> Path:
+        """File asking the process that writes the job to stop."""
+        return self.path.with_name(f"{self.id}.cancel")
+
+    def is_cancelled(self) -> bool:
+        """True once the job was cancelled by this process or by another one."""
+        if not self.cancelled.is_set() and self.cancel_path.exists():
+            self.cancelled.set()
+        return self.cancelled.is_set()
+
+    def save(self):
+        """Write the state of the job to its state file (atomically)."""
+        state = {
+            "id": self.id,
+            "version": self.version,
+            "format": self.response_format,
+            "fields": self.fields,
+            "with_risk_score": self.with_risk_score,
+            "status": self.status,
+            "rows_total": self.rows_total,
+            "rows_written": self.rows_written,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "pid": self.pid,
+        }
+        partial_path = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.part")
+        partial_path.write_text(json.dumps(state))
+        os.replace(partial_path, self.state_path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["ExportJob"]:
+        """
+        Read a job from its state file (without its filter, only needed to write it).
+
+        Args:
+            path (Path): State file of the job.
+
+        Returns:
+            Optional[ExportJob]: The job, or None if the file does not exist (or is being replaced).
+        """
+        try:
+            state = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        job = cls(
+            state["id"], state["version"], state["format"], None, state["fields"], state["with_risk_score"],
+            path.with_name(f"{state['id']}.{EXPORT_FORMATS[state['format']][1]}")
+        )
+        for name in ("status", "rows_total", "rows_written", "error", "created_at", "finished_at", "pid"):
+            setattr(job, name, state[name])
+        return job
+
+    def remove(self):
+        """Delete the state and cancel files of the job, and its export file."""
+        for path in (self.path, self.state_path, self.cancel_path):
+            path.unlink(missing_ok=True)
+
+    def to_dict(self) -> dict:
+        """
+        Status of the job as returned by the API.
+
+        Returns:
+            dict: id, status, format, dataset version, progress, size and download path.
+        """
+        progress = None
+        if self.status == DONE:
+            progress = 1.0
+        elif self.rows_total:
+            progress = round(self.rows_written / self.rows_total, 4)
+        elif self.rows_total == 0:
+            progress = 0.0
+        return {
+            "id": self.id,
+            "status": self.status,
+            "format": self.response_format,
+            "version": self.version,
+            "rows_total": self.rows_total,
+            "rows_written": self.rows_written,
+            "progress": progress,
+            "size_bytes": self.path.stat().st_size if self.status == DONE and self.path.exists() else None,
+            "seconds": round((self.finished_at or time.time()) - self.created_at, 3),
+            "error": self.error,
+            "download": f"/exports/{self.id}/download" if self.status == DONE else None,
+        }
+
+
+# function that opens a chunked writer for an export format
+@contextmanager
+def frame_writer(response_format: str, path: Path, schema: pa.Schema) -> Iterator[Callable]:
+    """
+    Open an export file and yield a function writing one DataFrame chunk to it.
+    The header / schema is written first, so an empty export is still a valid file.
+
+    Args:
+        response_format (str): csv, parquet (one row group per chunk) or arrow (IPC file).
+        path (Path): File to write.
+        schema (pa.Schema): Schema of the rows (see filters.row_schema).
+
+    Yields:
+        Callable: write(df) appending the rows to the file.
+    """
+    if response_format == "csv":
+        with open(path, "w", newline="") as file:
+            pd.DataFrame(columns=schema.names).to_csv(file, index=False)
+            yield lambda df: widen_floats(df).to_csv(file, header=False, index=False)
+    elif response_format == "parquet":
+        with pq.ParquetWriter(path, schema) as writer:
+            yield lambda df: writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+    else:
+        with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            yield lambda df: writer.write_batch(pa.RecordBatch.from_pandas(df, schema=schema, preserve_index=False))
+
+
+# function that writes the rows of an export to its file (runs on the export threads)
+def write_export(job: ExportJob, dataset: Dataset):
+    """
+    Select the matching rows and write them chunk by chunk to a temporary file,
+    renamed to the job path once complete. Progress is saved after each chunk.
+
+    Args:
+        job (ExportJob): Job to run.
+        dataset (Dataset): Dataset version of the job.
+
+    Raises:
+        ExportCancelled: If the job is cancelled while it runs.
+    """
+    positions = filters.matching_positions(query=job.query, dataset=dataset)
+    job.rows_total = len(positions)
+    job.save()
+    schema = filters.row_schema(dataset, job.fields, job.with_risk_score)
+    partial_path = job.path.with_name(f"{job.path.name}.{os.getpid()}.part")
+    try:
+        with frame_writer(job.response_format, partial_path, schema) as write:
+            for batch in filters.iter_patient_batches(
+                positions, EXPORT_BATCH_ROWS, job.with_risk_score, job.fields, dataset
+            ):
+                if job.is_cancelled():
+                    raise ExportCancelled(job.id)
+                write(batch)
+                job.rows_written += len(batch)
+                job.save()
+        os.replace(partial_path, job.path)
+    finally:
+        partial_path.unlink(missing_ok=True)
+
+
+# Registry and background runner of the export jobs
+class ExportManager:
+    """
+    Run export jobs on a small dedicated thread pool and keep their state.
+
+    Identical exports (same dataset version, filter, format, columns and scores)
+    share one job : a request made while the job runs or after it finished gets the
+    same job and file. Finished jobs of older dataset versions are dropped, with their
+    files, as soon as an export of a newer version is asked.
+
+    The jobs run by this process are kept in memory; the jobs of the other server
+    processes are read from their state files in the directory (see ExportJob.save).
+
+    Args:
+        directory (Path, optional): Directory of the export files.
+        workers (int, optional): Number of exports written at the same time.
+        max_jobs (int, optional): Number of jobs kept.
+    """
+
+    def __init__(self, directory: Path = EXPORT_DIR, workers: int = EXPORT_WORKERS, max_jobs: int = MAX_EXPORT_JOBS):
+        self.directory = Path(directory)
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, ExportJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        """Thread executor of the writers (created on first use)."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stroke-export")
+        return self._executor
+
+    def submit(
+        self,
+        dataset: Dataset,
+        response_format: str = "csv",
+        query: Optional[patient_query.Node] = None,
+        fields: Optional[list] = None,
+        with_risk_score: bool = False,
+        variant: str = ""
+    ) -> ExportJob:
+        """
+        Start an export, or return the job of an identical one.
+
+        Args:
+            dataset (Dataset): Dataset version to export.
+            response_format (str, optional): csv, parquet or arrow.
+            query (Optional[Node], optional): Compiled filter (see stroke_api.query).
+            fields (Optional[list], optional): Columns to export, default all.
+            with_risk_score (bool, optional): Add the precomputed `risk_score` column.
+            variant (str, optional): Other inputs of the content (e.g. the model version).
+
+        Returns:
+            ExportJob: New or shared job.
+
+        Raises:
+            ValueError: If the format is not supported.
+        """
+        if response_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {response_format} (valid formats: {', '.join(EXPORT_FORMATS)})")
+        key = (dataset.version, response_format, query, tuple(fields or ()), with_risk_score, variant)
+        job_id = hashlib.sha256(repr(key).encode()).hexdigest()[:24]
+
+        with self._lock:
+            self._drop_versions(dataset.version)
+            job = self._jobs.get(job_id) or self._load(job_id)
+            if job is not None and job.status in (QUEUED, RUNNING, DONE) and (job.status != DONE or job.path.exists()):
+                if job_id in self._jobs:
+                    self._jobs.move_to_end(job_id)
+                return job
+            self.directory.mkdir(parents=True, exist_ok=True)
+            job = ExportJob(
+                job_id, dataset.version, response_format, query, fields, with_risk_score,
+                self.directory / f"{job_id}.{EXPORT_FORMATS[response_format][1]}"
+            )
+            job.cancel_path.unlink(missing_ok=True)
+            job.save()
+            self._jobs[job_id] = job
+            self._evict()
+        self.executor.submit(self._run, job, dataset)
+        return job
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        """
+        Get a job by id, run by this process or by another one.
+
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            Optional[ExportJob]: The job, or None if it does not exist (or was dropped).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.finished and not job.state_path.exists():
+                # Deleted by another process
+                del self._jobs[job_id]
+                return None
+            return job or self._load(job_id)
+
+    def cancel(self, job_id: str) -> Optional[ExportJob]:
+        """
+        Stop a queued or running job, or delete a finished one and its file.
+        A job run by another process is stopped by that process before its next chunk.
+
+        Args:
+            job_id (str): Job id.
+
+        Returns:
+            Optional[ExportJob]: The job, or None if it does not exist.
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                job = self._load(job_id)
+                if job is None:
+                    return None
+                if not job.finished:
+                    job.cancel_path.touch()
+        job.cancelled.set()
+        if job.finished:
+            job.remove()
+        else:
+            job.state_path.unlink(missing_ok=True)
+        return job
+
+    def _run(self, job: ExportJob, dataset: Dataset):
+        """Write the export and record its outcome (runs on the export threads)."""
+        if job.is_cancelled():
+            job.status, job.finished_at = CANCELLED, time.time()
+            self._forget(job)
+            return
+        job.status = RUNNING
+        try:
+            job.save()
+            write_export(job, dataset)
+            job.status = DONE
+            logger.info("Export %s done: %d rows in %s", job.id, job.rows_written, job.path)
+        except ExportCancelled:
+            job.status = CANCELLED
+        except Exception as error:
+            logger.exception("Export %s failed", job.id)
+            job.status, job.error = FAILED, str(error)
+        finally:
+            job.finished_at = time.time()
+            if job.is_cancelled():
+                # Cancelled (possibly after the last chunk) : the job is no longer listed, remove its files
+                if job.status == DONE:
+                    job.status = CANCELLED
+                self._forget(job)
+            else:
+                job.save()
+
+    def _forget(self, job: ExportJob):
+        """Remove a cancelled job from the registry and delete its files."""
+        with self._lock:
+            if self._jobs.get(job.id) is job:
+                del self._jobs[job.id]
+        job.remove()
+
+    def _load(self, job_id: str) -> Optional[ExportJob]:
+        """
+        Read a job of another process from its state file (lock held). A job left
+        unfinished by a process that no longer runs is reported as failed.
+        """
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        job = ExportJob.load(self.directory / f"{job_id}.json")
+        if job is not None and not job.finished and not _process_alive(job.pid):
+            job.status, job.error = FAILED, "The process writing the export stopped"
+        return job
+
+    def _drop_versions(self, version: str):
+        """Drop the finished jobs of other dataset versions and their files (lock held)."""
+        for job_id, job in list(self._jobs.items()):
+            if job.version != version and job.finished:
+                del self._jobs[job_id]
+                job.remove()
+        # Jobs of the other processes
+        for path in self.directory.glob("*.json"):
+            job = self._load(path.stem)
+            if job is not None and job.version != version and job.finished and path.stem not in self._jobs:
+                job.remove()
+
+    def _evict(self):
+        """Drop the oldest finished jobs above max_jobs (lock held)."""
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if job.finished:
+                del self._jobs[job_id]
+                job.remove()
+
+    def shutdown(self):
+        """Cancel the running jobs and stop the threads."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancelled.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# function that tells whether a process still runs
+def _process_alive(pid: int) -> bool:
+    """True if a process with this id exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Export jobs of the API
+manager = ExportManager()
@@ -1,57 +1,441 @@
-from typing import Optional
+from typing import Iterator, Optional
 import pandas as pd
 import numpy as np
-# Chargement des données (une fois)
-stroke_data_df = pd.read_parquet("stroke_api/data/clean_health.parquet")
+import pyarrow as pa
+from stroke_api import metrics
+from stroke_api import model
+from stroke_api import partitions
+from stroke_api import query as patient_query
+from stroke_api.schema import COLUMNS
+from stroke_api.serialization import frame_to_records
+from stroke_api.store import Dataset, DatasetStore
+# Store des données : fichier mappé en mémoire, rechargé à chaud quand il change
+store = DatasetStore()
+
+# Nombre de lignes par batch dans les réponses en streaming
+BATCH_SIZE = 1000
+
+# Colonnes qui peuvent être demandées avec fields= (risk_score : score précalculé du modèle)
+FIELDS = COLUMNS + ['risk_score']
+
+# Anciens noms des données chargées, résolus sur la version courante du dataset
+_DATASET_ATTRIBUTES = {
+    'stroke_data_df': 'df',
+    'query_engine': 'engine',
+    'patient_stats': 'stats',
+    'stroke_data_schema': 'schema',
+}
+
+
+def __getattr__(name: str):
+    """Resolve the legacy module attributes (stroke_data_df, ...) on the current dataset."""
+    if name in _DATASET_ATTRIBUTES:
+        return getattr(store.current(), _DATASET_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# function that returns the current version of the dataset
+def current_dataset() -> Dataset:
+    """
+    Get the current dataset. A request should call it once and keep the result,
+    so a hot reload does not change the data in the middle of the request.
+
+    Returns:
+        Dataset: Current dataset (rows, indexes, stats and version).
+    """
+    return store.current()
+
+
+# function that gets the row positions matching the filters
+def matching_positions(
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[float] = None,
+    query: Optional[patient_query.Node] = None,
+    dataset: Optional[Dataset] = None
+) -> np.ndarray:
+    """
+    Select the row positions matching the filters. The simple filters use the bitmap
+    and range indexes directly; a compiled query is run as a plan over the indexes,
+    most selective predicate first.
+
+    Args:
+        gender (Optional[str], optional): 
+        stroke (Optional[int], optional): 
+        max_age (Optional[float], optional):
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query).
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        np.ndarray: Matching row positions, in row order.
+    """
+    dataset = dataset or current_dataset()
+    with metrics.stage("filter"):
+        if query is None:
+            positions = dataset.engine.filter_positions(gender=gender, stroke=stroke, max_age=max_age)
+        else:
+            simple = patient_query.from_params(gender=gender, stroke=stroke, ranges={'age': (None, max_age)})
+            positions = patient_query.execute(patient_query.combine(simple, query), dataset)
+    metrics.record_rows(len(positions))
+    return positions
+
+
+# function that validates a fields= projection
+def parse_fields(fields: Optional[list]) -> Optional[list]:
+    """
+    Validate the columns asked with `fields` (repeated and/or comma-separated names).
+
+    Args:
+        fields (Optional[list]): Requested column names, None for every column.
+
+    Returns:
+        Optional[list]: Columns in the requested order without duplicates, or None for every column.
+
+    Raises:
+        ValueError: If a column does not exist.
+    """
+    if not fields:
+        return None
+    names = [name.strip() for value in fields for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {unknown} (valid fields: {', '.join(FIELDS)})")
+    return list(dict.fromkeys(names)) or None
+
+
+# function that lists the columns of the returned rows
+def row_columns(dataset: Dataset, fields: Optional[list] = None, with_risk_score: bool = False) -> list:
+    """
+    Columns returned for a projection : the requested fields (every column by default),
+    plus `risk_score` when the scores are asked.
+
+    Args:
+        dataset (Dataset): Dataset the rows come from.
+        fields (Optional[list], optional): Validated projection (see parse_fields).
+        with_risk_score (bool, optional): Add the `risk_score` column.
+
+    Returns:
+        list: Column names, in output order.
+    """
+    columns = list(fields) if fields is not None else list(dataset.schema.names)
+    if with_risk_score and 'risk_score' not in columns:
+        columns.append('risk_score')
+    return columns
+
+
+# function that builds the Arrow schema of the returned rows
+def row_schema(dataset: Dataset, fields: Optional[list] = None, with_risk_score: bool = False) -> pa.Schema:
+    """
+    Arrow schema of the rows returned for a projection (see row_columns), known
+    before any row is taken so streams and files can be started on empty results.
+
+    Args:
+        dataset (Dataset): Dataset the rows come from.
+        fields (Optional[list], optional): Validated projection (see parse_fields).
+        with_risk_score (bool, optional): Add the `risk_score` column.
+
+    Returns:
+        pa.Schema: Schema of the rows.
+    """
+    return pa.schema([
+        pa.field('risk_score', pa.float64()) if column == 'risk_score' else dataset.schema.field(column)
+        for column in row_columns(dataset, fields, with_risk_score)
+    ])
+
+
+# function that takes rows by position, with their precomputed risk score if asked
+def take_rows(
+    dataset: Dataset,
+    positions: np.ndarray,
+    with_risk_score: bool = False,
+    fields: Optional[list] = None
+) -> pd.DataFrame:
+    """
+    Take rows of the dataset by position. With a projection only the requested
+    columns are read, so the other ones are never copied nor serialized.
+
+    Args:
+        dataset (Dataset): Dataset the positions come from.
+        positions (np.ndarray): Row positions.
+        with_risk_score (bool, optional): Add the `risk_score` column (scores precomputed once per dataset version).
+        fields (Optional[list], optional): Columns to return (see parse_fields), default all.
+
+    Returns:
+        pd.DataFrame: Selected rows.
+    """
+    if fields is None:
+        with metrics.stage("take"):
+            rows = dataset.take(positions)
+        if with_risk_score:
+            rows = rows.assign(risk_score=model.dataset_scores(dataset)[positions])
+        return rows
+
+    columns = row_columns(dataset, fields, with_risk_score)
+    with metrics.stage("take"):
+        rows = dataset.take(positions, [column for column in columns if column != 'risk_score'])
+    if 'risk_score' in columns:
+        rows['risk_score'] = model.dataset_scores(dataset)[positions]
+        if list(rows.columns) != columns:
+            rows = rows[columns]
+    return rows
 
 
 # function that gets patients info by (stroke, gender and age) filters
 def filter_patient(
     gender: Optional[str] = None,
     stroke: Optional[int] = None,
-    max_age: Optional[int] = None
+    max_age: Optional[int] = None,
+    query: Optional[patient_query.Node] = None,
+    dataset: Optional[Dataset] = None
 ):
-    """_summary_
+    """
+    Filter patients using the precomputed indexes of the query engine.
+    No copy of the dataset is made : only the matching rows are taken.
+    In partitioned mode (STROKE_API_PARTITIONS) the partitions are scanned instead.
 
     Args:
         gender (Optional[str], optional): 
         stroke (Optional[int], optional): 
         max_age (Optional[int], optional):
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query), combined with the other filters.
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
 
     Returns:
         list[dict]: Filtered patient records. 
         Each dictionary represents a row from the stroke dataset with column names as keys (e.g., id, gender, age, stroke, etc.)
     """
-    df = stroke_data_df.copy()
-    
-    if stroke is not None :
-        df = df.loc[df['stroke'] == stroke ]
-    if gender is not None :
-        df = df.loc[df['gender'] == gender]
-    if max_age is not None : 
-        df = df.loc[df['age'] <= max_age]
-        
+    if dataset is None and partitions.enabled():
+        # Mode partitionné : scatter-gather sur les partitions parquet
+        return frame_to_records(partitions.select_patients(
+            gender=gender, stroke=stroke, max_age=max_age, query=query
+        ))
+    return frame_to_records(select_patients(
+        gender=gender, stroke=stroke, max_age=max_age, query=query, dataset=dataset
+    ))
+
+
+# function that gets the filtered patients as a DataFrame (for the fast serializers)
+def select_patients(
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[int] = None,
+    query: Optional[patient_query.Node] = None,
+    with_risk_score: bool = False,
+    fields: Optional[list] = None,
+    dataset: Optional[Dataset] = None
+) -> pd.DataFrame:
+    """
+    Take the rows matching the filters, without converting them to Python dicts.
+
+    Args:
+        gender (Optional[str], optional): 
+        stroke (Optional[int], optional): 
+        max_age (Optional[int], optional):
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query), combined with the other filters.
+        with_risk_score (bool, optional): Add the precomputed `risk_score` column.
+        fields (Optional[list], optional): Columns to return (see parse_fields), default all.
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        pd.DataFrame: Filtered patient rows.
+    """
+    dataset = dataset or current_dataset()
+    positions = matching_positions(gender=gender, stroke=stroke, max_age=max_age, query=query, dataset=dataset)
+    return take_rows(dataset, positions, with_risk_score, fields)
+
+
+# function that gets one page of patients, ordered by id, after a keyset cursor
+def filter_patient_page(
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[int] = None,
+    query: Optional[patient_query.Node] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    dataset: Optional[Dataset] = None
+) -> np.ndarray:
+    """
+    Select the row positions of one page of filtered patients.
+
+    Args:
+        gender (Optional[str], optional): 
+        stroke (Optional[int], optional): 
+        max_age (Optional[int], optional):
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query), combined with the other filters.
+        after_id (Optional[int], optional): Keyset cursor, only ids greater than it are returned.
+        limit (Optional[int], optional): Maximum number of patients in the page.
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        np.ndarray: Row positions of the page, in increasing id order.
+    """
+    dataset = dataset or current_dataset()
+    positions = matching_positions(gender=gender, stroke=stroke, max_age=max_age, query=query, dataset=dataset)
+    with metrics.stage("page"):
+        return dataset.engine.page_positions(positions, after_id=after_id, limit=limit)
+
+
+# function that gets one page of patients, with the cursor of the next page
+def get_patient_page(
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[int] = None,
+    query: Optional[patient_query.Node] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    with_risk_score: bool = False,
+    fields: Optional[list] = None,
+    dataset: Optional[Dataset] = None
+) -> tuple:
+    """
+    Get one page of filtered patients, ordered by id.
+
+    Args:
+        gender (Optional[str], optional): 
+        stroke (Optional[int], optional): 
+        max_age (Optional[int], optional):
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query), combined with the other filters.
+        after_id (Optional[int], optional): Keyset cursor, only ids greater than it are returned.
+        limit (Optional[int], optional): Maximum number of patients in the page.
+        with_risk_score (bool, optional): Add the precomputed `risk_score` column.
+        fields (Optional[list], optional): Columns to return (see parse_fields), default all.
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        tuple: (DataFrame of the page, id to use as after_id for the next page or None).
+    """
+    dataset = dataset or current_dataset()
+    positions = filter_patient_page(
+        gender=gender, stroke=stroke, max_age=max_age, query=query,
+        after_id=after_id, limit=limit, dataset=dataset
+    )
+    # Cursor of the next page, only when the page is full
+    next_after_id = None
+    if limit is not None and len(positions) == limit:
+        next_after_id = dataset.engine.id_at(positions[-1])
+    return take_rows(dataset, positions, with_risk_score, fields), next_after_id
+
+
+# function that yields the selected rows in small batches
+def iter_patient_batches(
+    positions: np.ndarray,
+    batch_size: int = BATCH_SIZE,
+    with_risk_score: bool = False,
+    fields: Optional[list] = None,
+    dataset: Optional[Dataset] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Yield the selected rows as small DataFrames, so a response can be streamed
+    without building the whole result in memory.
 
-    return df.to_dict(orient='records')
+    Args:
+        positions (np.ndarray): Row positions to return.
+        batch_size (int, optional): Number of rows per batch.
+        with_risk_score (bool, optional): Add the precomputed `risk_score` column.
+        fields (Optional[list], optional): Columns to return (see parse_fields), default all.
+        dataset (Optional[Dataset], optional): Dataset the positions come from (default: current one).
+
+    Yields:
+        pd.DataFrame: Batch of patient rows.
+    """
+    dataset = dataset or current_dataset()
+    for start in range(0, len(positions), batch_size):
+        yield take_rows(dataset, positions[start:start + batch_size], with_risk_score, fields)
 
 
 
 # function to get patient info by his ID 
-def get_info_by_id(patient_id: int):
-    """_summary_
+def get_info_by_id(patient_id: int, fields: Optional[list] = None, dataset: Optional[Dataset] = None):
+    """
+    Get a patient with an O(1) lookup in the id hash index.
 
     Args:
         patient_id (int)
+        fields (Optional[list], optional): Columns to return (see parse_fields), default all.
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
 
     Returns:
         patient info by his id
     """
-    df = stroke_data_df.copy()
-    
-    if patient_id is not None:
-        
-        df = df.loc[df['id'] == patient_id]
-        
-    return df.to_dict(orient='records')
+    dataset = dataset or current_dataset()
+    if patient_id is None:
+        return frame_to_records(dataset.rows())
 
+    with metrics.stage("lookup"):
+        position = dataset.engine.lookup_id(patient_id)
+    if position is None:
+        return []
+
+    row = take_rows(dataset, np.array([position]), fields=fields)
+    with metrics.stage("serialize"):
+        return frame_to_records(row)
+
+
+# function to get many patients by their IDs in one call
+def get_info_by_ids(patient_ids: list, dataset: Optional[Dataset] = None) -> tuple:
+    """
+    Resolve many patient ids with one vectorized join against the id index.
+
+    Args:
+        patient_ids (list): Patient ids (duplicates are ignored, order is kept).
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        tuple: (row positions of the patients found, list of the ids not found).
+    """
+    dataset = dataset or current_dataset()
+    with metrics.stage("lookup"):
+        ids = pd.unique(np.asarray(patient_ids, dtype=np.int64))
+        positions, found = dataset.engine.lookup_ids(ids)
+    metrics.record_rows(len(positions))
+    return positions, ids[~found].tolist()
+
+
+# function to get many patients by their IDs as a DataFrame
+def get_patients_batch(
+    patient_ids: list,
+    fields: Optional[list] = None,
+    dataset: Optional[Dataset] = None
+) -> tuple:
+    """
+    Get many patients by id in one call.
 
+    Args:
+        patient_ids (list): Patient ids.
+        fields (Optional[list], optional): Columns to return (see parse_fields), default all.
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        tuple: (DataFrame of the patients found, ids not found).
+    """
+    dataset = dataset or current_dataset()
+    positions, missing = get_info_by_ids(patient_ids, dataset=dataset)
+    return take_rows(dataset, positions, fields=fields), missing
+
+
+# function that gets the precomputed statistics of the filtered patients
+def patient_statistics(
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[float] = None,
+    dataset: Optional[Dataset] = None
+) -> dict:
+    """
+    Get the /stats/ statistics of the patients matching the filters
+    (merged from the partitions in partitioned mode).
+
+    Args:
+        gender (Optional[str], optional): 
+        stroke (Optional[int], optional): 
+        max_age (Optional[float], optional):
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        dict: Statistics (count, averages, glucose min/max).
+    """
+    if dataset is None and partitions.enabled():
+        # Mode partitionné : agrégats partiels de chaque partition, fusionnés
+        return partitions.patient_statistics(gender=gender, stroke=stroke, max_age=max_age)
+    dataset = dataset or current_dataset()
+    with metrics.stage("stats"):
+        return dataset.stats.compute(gender=gender, stroke=stroke, max_age=max_age)
@@ -0,0 +1,137 @@
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import os
+import pandas as pd
+from stroke_api.schema import COLUMNS, RANGES, apply_schema, range_violations
+from stroke_api.store import Dataset, DatasetStore
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of patients in one ingestion request
+MAX_INGEST_ROWS = int(os.environ.get("STROKE_API_MAX_INGEST_ROWS", "10000"))
+
+# Seconds between two compactions of the ingested rows
+COMPACT_INTERVAL = float(os.environ.get("STROKE_API_COMPACT_INTERVAL", "10"))
+
+# Ingested rows that trigger a compaction without waiting for the interval
+COMPACT_ROWS = int(os.environ.get("STROKE_API_COMPACT_ROWS", "5000"))
+
+
+# function that validates ingested patients against the valid values of the README
+def validate_rows(records: list) -> pd.DataFrame:
+    """
+    Check new patient records and convert them to the compact representation.
+
+    Every column is required; categories and flags must be valid values and the
+    measures must be in their documented range (README "A list of Valid values").
+
+    Args:
+        records (list): Patient records (dicts with the dataset columns).
+
+    Returns:
+        pd.DataFrame: Rows in the compact representation (see schema.apply_schema).
+
+    Raises:
+        ValueError: If a record is not valid.
+    """
+    df = pd.DataFrame.from_records(records, columns=COLUMNS)
+    missing = [column for column in COLUMNS if df[column].isna().any()]
+    if missing:
+        raise ValueError(f"Missing values in {missing}")
+    duplicated = df['id'][df['id'].duplicated()]
+    if not duplicated.empty:
+        raise ValueError(f"Duplicated patient ids in the request: {sorted(duplicated.unique().tolist())[:20]}")
+
+    rows = apply_schema(df)
+    for column, invalid in range_violations(rows).items():
+        if invalid.any():
+            low, high = RANGES[column]
+            raise ValueError(
+                f"{column} must be between {low} and {high} (ids {rows['id'][invalid].tolist()[:20]})"
+            )
+    return rows
+
+
+# function that adds validated patients to the store
+def ingest(records: list, replace: bool, store: DatasetStore) -> Dataset:
+    """
+    Validate patient records and append them to the delta segment of the store.
+
+    Args:
+        records (list): Patient records.
+        replace (bool): Replace existing patients (PUT) instead of rejecting them (POST).
+        store (DatasetStore): Store receiving the rows.
+
+    Returns:
+        Dataset: New current version.
+
+    Raises:
+        ValueError: If a record is not valid.
+        PatientExistsError: If replace is False and a patient id already exists.
+    """
+    return store.append(validate_rows(records), replace=replace)
+
+
+# Background compaction of the ingested rows
+class Compactor:
+    """
+    Periodically write the delta segment of the store to a parquet segment,
+    every `interval` seconds or as soon as `max_pending` rows are waiting.
+    The compaction runs off the event loop; ingestion and reads go on meanwhile.
+
+    Args:
+        store (DatasetStore): Store to compact.
+        run (callable): Coroutine function running a blocking function off the event loop
+            (e.g. workers.pool.run).
+        interval (float, optional): Seconds between two compactions.
+        max_pending (int, optional): Pending rows that trigger a compaction.
+    """
+
+    def __init__(
+        self,
+        store: DatasetStore,
+        run: Callable[..., Awaitable],
+        interval: float = COMPACT_INTERVAL,
+        max_pending: int = COMPACT_ROWS
+    ):
+        self.store = store
+        self.run = run
+        self.interval = interval
+        self.max_pending = max_pending
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        """Start the background task if needed, and wake it up when enough rows are pending."""
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+        if self.store.pending_rows >= self.max_pending:
+            self._wake.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self.store.pending_rows:
+                try:
+                    await self.run(self.store.compact)
+                except Exception:
+                    # The rows stay in the delta segment and are retried at the next round
+                    logger.exception("Compaction of the ingested rows failed")
+
+    async def stop(self):
+        """Stop the background task and compact the rows still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.store.pending_rows:
+            await self.run(self.store.compact)
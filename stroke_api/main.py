@@ -1,10 +1,49 @@
+from contextlib import asynccontextmanager
+import time
 from fastapi import FastAPI
 import pandas as pd
 import numpy as np
-from stroke_api.api import router
+from stroke_api.api import compactor, predict_batcher, router
+from stroke_api import workers
+from stroke_api import exports
+from stroke_api import partitions
+from stroke_api import model
+from stroke_api.compression import CompressionMiddleware
+from stroke_api.metrics import MetricsMiddleware
+
+
+# Cycle de vie de l'application : chargement des données et du modèle au démarrage
+# (déjà faits par le processus parent avec stroke_api.serve), compaction des patients
+# ingérés, arrêt des micro-batchs de /predict, annulation des exports en cours
+# et arrêt du pool de workers à la fermeture
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.started_at = time.time()
+    if partitions.enabled():
+        # Mode partitionné : seules les statistiques des fichiers sont lues au démarrage,
+        # les workers de scan sont démarrés avant les premières requêtes
+        await workers.pool.run(partitions.current_catalog)
+        partitions.start()
+    else:
+        await workers.current_dataset()
+    if model.MODEL_PATH.exists():
+        model.load_model()
+    yield
+    await predict_batcher.stop()
+    await compactor.stop()
+    exports.manager.shutdown()
+    partitions.shutdown()
+    workers.pool.shutdown()
+
 
 # Création d'un objet FastAPI
-app = FastAPI(title="Stroke Dataset API")
+app = FastAPI(title="Stroke Dataset API", lifespan=lifespan)
 
 # Inclusion des routes définies dans api.py
 app.include_router(router)
+
+# Compression des réponses (zstd, brotli ou gzip selon Accept-Encoding), sauf les petites
+app.add_middleware(CompressionMiddleware)
+
+# Mesures des requêtes : latence par route, taille des réponses, durée de chaque étape (/metrics)
+app.add_middleware(MetricsMiddleware)
@@ -0,0 +1,344 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator, Optional
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+
+# Latency buckets (seconds) of the request and stage histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Size buckets (bytes) of the response size histogram
+SIZE_BUCKETS = tuple(4 ** exponent for exponent in range(3, 14))
+
+# Buckets of the number of rows returned per request
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+# Opt-in sampling profiler : requests slower than this (milliseconds) dump their samples (0 = disabled)
+PROFILE_SLOW_MS = float(os.environ.get("STROKE_API_PROFILE_SLOW_MS", "0"))
+
+# Interval (milliseconds) between two stack samples of the profiler
+PROFILE_INTERVAL_MS = float(os.environ.get("STROKE_API_PROFILE_INTERVAL_MS", "5"))
+
+# Directory where the folded stacks of the slow requests are written
+PROFILE_DIR = Path(os.environ.get("STROKE_API_PROFILE_DIR", Path(__file__).parent / "data" / "profiles"))
+
+
+# Histogram with fixed buckets and optional labels, in the Prometheus exposition format
+class Histogram:
+    """
+    Thread-safe histogram (cumulative buckets, sum and count per label set).
+
+    Args:
+        name (str): Metric name.
+        description (str): Help text.
+        buckets (tuple): Upper bounds of the buckets (+Inf is added).
+        labels (tuple, optional): Label names.
+    """
+
+    def __init__(self, name: str, description: str, buckets: tuple, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        """
+        Record one observation.
+
+        Args:
+            value (float): Observed value.
+            *label_values (str): Values of the labels, in the order of `labels`.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> Iterator[str]:
+        """
+        Yield the lines of the metric in the Prometheus text format.
+
+        Yields:
+            str: Exposition lines.
+        """
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = ",".join(labels + ['le="' + le + '"'])
+                yield f"{self.name}_bucket{{{bucket_labels}}} {cumulative}"
+            suffix = "{" + ",".join(labels) + "}" if labels else ""
+            yield f"{self.name}_sum{suffix} {total}"
+            yield f"{self.name}_count{suffix} {count}"
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metrics of the API
+REQUEST_LATENCY = Histogram(
+    "stroke_api_request_duration_seconds", "Request latency, from the first byte received to the last byte sent.",
+    LATENCY_BUCKETS, ("method", "route", "status")
+)
+RESPONSE_SIZE = Histogram(
+    "stroke_api_response_size_bytes", "Size of the response bodies.", SIZE_BUCKETS, ("route",)
+)
+RESPONSE_ROWS = Histogram(
+    "stroke_api_response_rows", "Number of patient rows selected per request.", ROW_BUCKETS, ("route",)
+)
+STAGE_LATENCY = Histogram(
+    "stroke_api_stage_duration_seconds", "Time spent in each stage (filter, take, aggregate, serialize...).",
+    LATENCY_BUCKETS, ("stage",)
+)
+METRICS = [REQUEST_LATENCY, RESPONSE_SIZE, RESPONSE_ROWS, STAGE_LATENCY]
+
+# Media type of the /metrics response
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Measures of the request being handled (shared with the worker threads through the context)
+class RequestMetrics:
+    """Stage timings and row count of one request."""
+
+    def __init__(self):
+        self.stages = {}
+        self.rows: Optional[int] = None
+
+
+_current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("stroke_api_request", default=None)
+
+
+# function that times a stage of the request
+@contextmanager
+def stage(name: str):
+    """
+    Time a block of code as one stage of the request (histogram and Server-Timing header).
+
+    Args:
+        name (str): Stage name (filter, take, aggregate, serialize...).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, name)
+        request = _current_request.get()
+        if request is not None:
+            request.stages[name] = request.stages.get(name, 0.0) + elapsed
+
+
+# function that records the number of rows selected by the request
+def record_rows(count: int):
+    """
+    Record the number of patient rows selected by the current request.
+
+    Args:
+        count (int): Number of rows.
+    """
+    request = _current_request.get()
+    if request is not None:
+        request.rows = count
+
+
+# function that renders all the metrics in the Prometheus text format
+def render_metrics() -> bytes:
+    """
+    Render the metrics for the /metrics endpoint.
+
+    Returns:
+        bytes: Prometheus text exposition.
+    """
+    lines = [line for metric in METRICS for line in metric.render()]
+    return ("\n".join(lines) + "\n").encode()
+
+
+# function that measures the memory of the current process
+def process_memory() -> dict:
+    """
+    Memory of the current process. On Linux the resident memory is split into the
+    pages shared with other processes (e.g. forked workers, memory-mapped data) and
+    the private ones; `pss_bytes` counts each shared page once across the processes.
+
+    Returns:
+        dict: Memory figures in bytes (only the peak resident size outside Linux).
+    """
+    fields = {
+        'Rss': 'rss_bytes', 'Pss': 'pss_bytes', 'Shared_Clean': 'shared_bytes', 'Shared_Dirty': 'shared_bytes',
+        'Private_Clean': 'private_bytes', 'Private_Dirty': 'private_bytes',
+    }
+    try:
+        with open("/proc/self/smaps_rollup") as rollup:
+            memory = Counter()
+            for line in rollup:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    memory[fields[name]] += int(value.split()[0]) * 1024
+            return dict(memory)
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        return {"max_rss_bytes": peak if sys.platform == "darwin" else peak * 1024}
+
+
+# Sampling profiler : collects the Python stacks of the API threads while slow requests run
+class SamplingProfiler:
+    """
+    Background thread sampling the stacks of every thread at a fixed interval
+    while at least one request is running. Samples are counted per request as
+    folded stacks (`frame;frame;frame count`), the input format of flame graph tools.
+
+    Concurrent requests see the samples of each other's threads.
+
+    Args:
+        interval (float): Seconds between two samples.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, key: int) -> None:
+        """Start collecting samples for a request."""
+        with self._lock:
+            self._active[key] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stroke-api-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, key: int) -> Counter:
+        """Stop collecting samples for a request and return them."""
+        with self._lock:
+            return self._active.pop(key, Counter())
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            if not self._active:
+                self._wake.clear()
+                self._wake.wait()
+            stacks = [
+                _fold(frame) for thread_id, frame in sys._current_frames().items() if thread_id != own_id
+            ]
+            with self._lock:
+                for samples in self._active.values():
+                    samples.update(stacks)
+            time.sleep(self.interval)
+
+
+def _fold(frame) -> str:
+    """Folded representation of a stack (outermost frame first)."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000) if PROFILE_SLOW_MS > 0 else None
+
+
+# function that writes the samples of a slow request as folded stacks
+def dump_profile(samples: Counter, method: str, route: str, elapsed: float) -> Optional[Path]:
+    """
+    Write the samples of a slow request to PROFILE_DIR (one `.folded` file per request).
+
+    Args:
+        samples (Counter): Folded stack -> number of samples.
+        method (str): HTTP method.
+        route (str): Route template.
+        elapsed (float): Request duration in seconds.
+
+    Returns:
+        Optional[Path]: Written file, or None if there was no sample.
+    """
+    if not samples:
+        return None
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r"[^\w]+", "_", f"{method}{route}").strip("_")
+    path = PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{name}.folded"
+    path.write_text("".join(f"{stack} {count}\n" for stack, count in samples.most_common()))
+    return path
+
+
+# ASGI middleware recording the request metrics
+class MetricsMiddleware:
+    """
+    Record the latency, response size and selected rows of every request, per route template
+    (e.g. `/patients/{patient_id}`, so the label set stays small), add a `Server-Timing`
+    header with the stage timings, and run the sampling profiler when it is enabled.
+
+    Args:
+        app: ASGI application.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestMetrics()
+        token = _current_request.set(request)
+        start = time.perf_counter()
+        status, size = 500, 0
+        if profiler is not None:
+            profiler.start(id(request))
+
+        async def send_with_metrics(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if request.stages:
+                    timing = ", ".join(
+                        f"{name};dur={seconds * 1000:.2f}" for name, seconds in request.stages.items()
+                    )
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode())
+                    ]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_request.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.observe(elapsed, scope["method"], route, str(status))
+            RESPONSE_SIZE.observe(size, route)
+            if request.rows is not None:
+                RESPONSE_ROWS.observe(request.rows, route)
+            if profiler is not None:
+                samples = profiler.stop(id(request))
+                if elapsed * 1000 >= PROFILE_SLOW_MS:
+                    dump_profile(samples, scope["method"], route, elapsed)
@@ -0,0 +1,407 @@
+from pathlib import Path
+from typing import Optional
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from stroke_api.schema import CATEGORIES, FLAGS
+from stroke_api.store import DATA_DIR, DEFAULT_DATA_PATH
+
+logger = logging.getLogger(__name__)
+
+# Model artifact loaded by the API
+MODEL_PATH = Path(os.environ.get("STROKE_API_MODEL", DATA_DIR / "stroke_model.json"))
+
+# Measures standardized with the training means / standard deviations (missing = mean)
+NUMERIC_FEATURES = ['age', 'avg_glucose_level', 'bmi']
+
+# Binary features used as they are
+FLAG_FEATURES = [flag for flag in FLAGS if flag != 'stroke']
+
+# Categorical features, one-hot encoded over their valid values
+CATEGORICAL_FEATURES = list(CATEGORIES)
+
+# Columns a patient payload must provide (bmi may be missing)
+INPUT_COLUMNS = NUMERIC_FEATURES + FLAG_FEATURES + CATEGORICAL_FEATURES
+
+# Micro-batching of /predict : largest batch and longest wait (seconds) before scoring
+MAX_BATCH_ROWS = int(os.environ.get("STROKE_API_PREDICT_BATCH", "4096"))
+MAX_BATCH_WAIT = float(os.environ.get("STROKE_API_PREDICT_WAIT_MS", "2")) / 1000
+
+
+# function that lists the names of the model features
+def feature_names() -> list:
+    """
+    Names of the columns of the feature matrix (e.g. `age`, `gender=Male`).
+
+    Returns:
+        list: Feature names, in matrix order.
+    """
+    names = NUMERIC_FEATURES + FLAG_FEATURES
+    for column in CATEGORICAL_FEATURES:
+        names += [f"{column}={category}" for category in CATEGORIES[column]]
+    return names
+
+
+# function that encodes patient rows as a numeric matrix
+def feature_matrix(df: pd.DataFrame, means: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    Encode patient rows as a float64 matrix (one column per feature name), in one vectorized pass.
+
+    Args:
+        df (pd.DataFrame): Patient rows (compact or pandas default dtypes).
+        means (np.ndarray): Means of the numeric features.
+        scales (np.ndarray): Standard deviations of the numeric features.
+
+    Returns:
+        np.ndarray: Feature matrix of shape (rows, features).
+    """
+    numeric = (df[NUMERIC_FEATURES].to_numpy(dtype=np.float64) - means) / scales
+    blocks = [np.nan_to_num(numeric, nan=0.0), df[FLAG_FEATURES].to_numpy(dtype=np.float64)]
+    for column in CATEGORICAL_FEATURES:
+        categories = CATEGORIES[column]
+        codes = pd.Categorical(df[column], categories=categories).codes
+        one_hot = np.zeros((len(df), len(categories)))
+        known = codes >= 0
+        one_hot[np.flatnonzero(known), codes[known]] = 1.0
+        blocks.append(one_hot)
+    return np.hstack(blocks)
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    """Logistic function."""
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -35, 35)))
+
+
+# function that computes the area under the ROC curve
+def roc_auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    """
+    Area under the ROC curve (Mann-Whitney statistic, ties counted as 1/2).
+
+    Args:
+        labels (np.ndarray): 0/1 labels.
+        scores (np.ndarray): Predicted scores.
+
+    Returns:
+        float: AUC.
+    """
+    ranks = pd.Series(scores).rank().to_numpy()
+    positives = labels == 1
+    n_pos, n_neg = positives.sum(), (~positives).sum()
+    if n_pos == 0 or n_neg == 0:
+        return float('nan')
+    return float((ranks[positives].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg))
+
+
+# Logistic regression model used to score the stroke risk
+class RiskModel:
+    """
+    L2-regularized logistic regression on the patient features.
+
+    Args:
+        coefficients (np.ndarray): One weight per feature.
+        intercept (float): Bias.
+        means (np.ndarray): Means of the numeric features.
+        scales (np.ndarray): Standard deviations of the numeric features.
+        metrics (Optional[dict], optional): Evaluation metrics of the training run.
+    """
+
+    def __init__(
+        self,
+        coefficients: np.ndarray,
+        intercept: float,
+        means: np.ndarray,
+        scales: np.ndarray,
+        metrics: Optional[dict] = None
+    ):
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.means = np.asarray(means, dtype=np.float64)
+        self.scales = np.asarray(scales, dtype=np.float64)
+        self.metrics = metrics or {}
+        self.version = hashlib.blake2b(self.to_json().encode(), digest_size=8).hexdigest()
+
+    @classmethod
+    def fit(cls, df: pd.DataFrame, l2: float = 1.0, iterations: int = 50) -> "RiskModel":
+        """
+        Fit the model with Newton's method (IRLS) on the whole table.
+
+        Args:
+            df (pd.DataFrame): Patient rows with the `stroke` label.
+            l2 (float, optional): L2 penalty on the coefficients (not on the intercept).
+            iterations (int, optional): Maximum Newton steps.
+
+        Returns:
+            RiskModel: Fitted model.
+        """
+        numeric = df[NUMERIC_FEATURES].to_numpy(dtype=np.float64)
+        means = np.nanmean(numeric, axis=0)
+        scales = np.nanstd(numeric, axis=0)
+        scales[scales == 0] = 1.0
+        X = np.hstack([np.ones((len(df), 1)), feature_matrix(df, means, scales)])
+        y = df['stroke'].to_numpy(dtype=np.float64)
+
+        penalty = np.full(X.shape[1], l2)
+        penalty[0] = 0.0
+        weights = np.zeros(X.shape[1])
+        for _ in range(iterations):
+            p = _sigmoid(X @ weights)
+            gradient = X.T @ (p - y) + penalty * weights
+            hessian = (X * (p * (1 - p))[:, None]).T @ X + np.diag(penalty)
+            step = np.linalg.solve(hessian, gradient)
+            weights -= step
+            if np.abs(step).max() < 1e-8:
+                break
+        return cls(weights[1:], weights[0], means, scales)
+
+    def score(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Stroke probability of each patient, in one matrix product.
+
+        Args:
+            df (pd.DataFrame): Patient rows (INPUT_COLUMNS).
+
+        Returns:
+            np.ndarray: Risk scores between 0 and 1.
+        """
+        if df.empty:
+            return np.empty(0)
+        return _sigmoid(feature_matrix(df, self.means, self.scales) @ self.coefficients + self.intercept)
+
+    def to_json(self) -> str:
+        """Serialize the model (JSON artifact)."""
+        return json.dumps({
+            "model": "logistic_regression",
+            "features": feature_names(),
+            "coefficients": self.coefficients.tolist(),
+            "intercept": self.intercept,
+            "numeric_means": self.means.tolist(),
+            "numeric_scales": self.scales.tolist(),
+            "metrics": self.metrics,
+        }, indent=2)
+
+    @classmethod
+    def from_json(cls, text: str) -> "RiskModel":
+        """
+        Load a serialized model.
+
+        Raises:
+            ValueError: If the artifact was trained on other features.
+        """
+        artifact = json.loads(text)
+        if artifact["features"] != feature_names():
+            raise ValueError("The model artifact does not match the current features, train it again")
+        return cls(
+            artifact["coefficients"], artifact["intercept"],
+            artifact["numeric_means"], artifact["numeric_scales"], artifact.get("metrics")
+        )
+
+
+# function that trains the model and evaluates it on a held-out split
+def train(
+    data_path: Path = DEFAULT_DATA_PATH,
+    model_path: Path = MODEL_PATH,
+    l2: float = 1.0,
+    test_fraction: float = 0.2,
+    seed: int = 0
+) -> RiskModel:
+    """
+    Train the model on the cleaned dataset and write the artifact.
+
+    The metrics (AUC, log loss) are measured on a held-out split; the saved model is
+    then refitted on all the rows.
+
+    Args:
+        data_path (Path, optional): Cleaned parquet file.
+        model_path (Path, optional): Artifact to write.
+        l2 (float, optional): L2 penalty.
+        test_fraction (float, optional): Share of the rows held out for evaluation.
+        seed (int, optional): Random seed of the split.
+
+    Returns:
+        RiskModel: Model fitted on all the rows.
+    """
+    df = pd.read_parquet(data_path)
+    test = np.random.default_rng(seed).random(len(df)) < test_fraction
+    held_out = RiskModel.fit(df[~test], l2=l2)
+    y_test = df.loc[test, 'stroke'].to_numpy()
+    p_test = np.clip(held_out.score(df[test]), 1e-12, 1 - 1e-12)
+    metrics = {
+        "rows": len(df),
+        "test_rows": int(test.sum()),
+        "test_auc": round(roc_auc(y_test, p_test), 4),
+        "test_log_loss": round(float(-np.mean(y_test * np.log(p_test) + (1 - y_test) * np.log(1 - p_test))), 4),
+        "l2": l2,
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    model = RiskModel.fit(df, l2=l2)
+    model = RiskModel(model.coefficients, model.intercept, model.means, model.scales, metrics)
+    model_path.write_text(model.to_json())
+    logger.info("Model written to %s: %s", model_path, metrics)
+    return model
+
+
+_model: Optional[RiskModel] = None
+_model_lock = threading.Lock()
+
+
+# function that returns the model artifact, loading it once
+def load_model() -> RiskModel:
+    """
+    Get the risk model, loading the artifact on first use (the API preloads it at startup).
+
+    Returns:
+        RiskModel: Loaded model.
+
+    Raises:
+        FileNotFoundError: If the artifact does not exist (run `python -m stroke_api.model`).
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = RiskModel.from_json(MODEL_PATH.read_text())
+    return _model
+
+
+# function that tells whether the model artifact has been loaded
+def is_loaded() -> bool:
+    """
+    Check if the model is in memory, without loading it.
+
+    Returns:
+        bool: True once load_model has succeeded.
+    """
+    return _model is not None
+
+
+# function that scores every patient of a dataset version (kept with the dataset)
+def dataset_scores(dataset) -> np.ndarray:
+    """
+    Precomputed risk scores of all the patients of a dataset, built once per version
+    with `dataset.derived_rows` (a version with ingested rows only scores them).
+
+    Args:
+        dataset (Dataset): Dataset version.
+
+    Returns:
+        np.ndarray: Risk score of each row.
+    """
+    model = load_model()
+    return dataset.derived_rows(f"risk_scores:{model.version}", model.score)
+
+
+# Micro-batcher : concurrent /predict calls are scored together in one vectorized call
+class MicroBatcher:
+    """
+    Collect the patient rows of concurrent requests for at most `max_wait` seconds
+    (or `max_rows` rows), score them with a single model call on the worker pool,
+    and give each request its slice of the scores.
+
+    The queue and the task collecting it belong to an event loop : each running loop
+    (e.g. one per test client, or after a server restart in the same process) gets its own.
+
+    Args:
+        run (callable): Coroutine function running a blocking function off the event loop
+            (e.g. workers.pool.run).
+        max_rows (int, optional): Largest batch.
+        max_wait (float, optional): Longest wait before scoring a partial batch.
+    """
+
+    def __init__(self, run, max_rows: int = MAX_BATCH_ROWS, max_wait: float = MAX_BATCH_WAIT):
+        self.run = run
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self._batches: dict = {}  # event loop -> (queue, collecting task)
+
+    async def score(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Score patient rows, batched with the other pending requests.
+
+        Args:
+            df (pd.DataFrame): Patient rows.
+
+        Returns:
+            np.ndarray: Risk scores.
+        """
+        loop = asyncio.get_running_loop()
+        queue, task = self._batches.get(loop, (None, None))
+        if task is None or task.done():
+            queue = asyncio.Queue()
+            task = loop.create_task(self._collect(queue))
+            # The queues of the loops closed since are dropped
+            self._batches = {
+                other: batch for other, batch in self._batches.items() if not other.is_closed()
+            }
+            self._batches[loop] = (queue, task)
+        future = loop.create_future()
+        await queue.put((df, future))
+        return await future
+
+    async def stop(self):
+        """Stop the task of the running event loop (at shutdown)."""
+        _, task = self._batches.pop(asyncio.get_running_loop(), (None, None))
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _collect(self, queue: asyncio.Queue):
+        """Score the rows of the queue batch by batch (task of one event loop)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await queue.get()]
+            rows = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while rows < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+
+            try:
+                frames = [df for df, _ in pending]
+                scores = await self.run(lambda: load_model().score(pd.concat(frames, ignore_index=True)))
+            except Exception as error:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            start = 0
+            for df, future in pending:
+                if not future.done():
+                    future.set_result(scores[start:start + len(df)])
+                start += len(df)
+
+
+def main(argv=None):
+    """Command line entry point : python -m stroke_api.model"""
+    parser = argparse.ArgumentParser(description="Train the stroke risk model.")
+    parser.add_argument("--data", default=str(DEFAULT_DATA_PATH), help="Cleaned parquet file")
+    parser.add_argument("--output", default=str(MODEL_PATH), help="Model artifact to write")
+    parser.add_argument("--l2", type=float, default=1.0, help="L2 penalty")
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Share of rows held out for evaluation")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the split")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    model = train(Path(args.data), Path(args.output), l2=args.l2, test_fraction=args.test_fraction, seed=args.seed)
+    print(json.dumps(model.metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
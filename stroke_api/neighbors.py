@@ -0,0 +1,223 @@
+from typing import Optional, Union
+import math
+import os
+import numpy as np
+import pandas as pd
+from stroke_api import filters
+from stroke_api import metrics
+from stroke_api import model
+from stroke_api import query as patient_query
+from stroke_api.store import Dataset, DeltaDataset
+
+# Squared distance added by one categorical attribute that differs (a flag that differs adds 1,
+# a standardized measure adds the square of its difference in standard deviations)
+CATEGORY_WEIGHT = 1.0
+
+# Rows per block of the distance computation (bounds the temporary memory of a query)
+BLOCK_ROWS = int(os.environ.get("STROKE_API_NEIGHBORS_BLOCK", "65536"))
+
+# Largest number of neighbours returned
+MAX_NEIGHBORS = 1000
+
+
+# Nearest-neighbour index over the patient features
+class SimilarityIndex:
+    """
+    Patients encoded as float32 vectors: standardized age / glucose / bmi, the
+    hypertension and heart_disease flags and the one-hot categories (scaled so a
+    different category adds CATEGORY_WEIGHT to the squared distance).
+
+    A query computes the squared Euclidean distances to all the candidates block by
+    block, as `|c|^2 - 2 c.x + |x|^2` with one matrix-vector product per block and the
+    norms precomputed, and keeps the k smallest with `np.argpartition`.
+
+    Args:
+        df (pd.DataFrame): Patient rows.
+        standardization (Optional[tuple], optional): (means, scales) of the numeric features,
+            computed from the rows by default.
+    """
+
+    def __init__(self, df: pd.DataFrame, standardization: Optional[tuple] = None):
+        if standardization is None:
+            numeric = df[model.NUMERIC_FEATURES].to_numpy(dtype=np.float64)
+            means = np.nan_to_num(np.nanmean(numeric, axis=0)) if len(df) else np.zeros(numeric.shape[1])
+            scales = np.nan_to_num(np.nanstd(numeric, axis=0)) if len(df) else np.ones(numeric.shape[1])
+            scales[scales == 0] = 1.0
+            standardization = (means, scales)
+        self.means, self.scales = standardization
+
+        self.weights = np.ones(len(model.feature_names()))
+        self.weights[len(model.NUMERIC_FEATURES) + len(model.FLAG_FEATURES):] = math.sqrt(CATEGORY_WEIGHT / 2)
+        self.features = (model.feature_matrix(df, self.means, self.scales) * self.weights).astype(np.float32)
+        self.norms = np.einsum('ij,ij->i', self.features, self.features)
+
+    def nearest(self, position: int, k: int, candidates: Optional[np.ndarray] = None) -> tuple:
+        """
+        Find the k patients closest to one patient.
+
+        Args:
+            position (int): Row position of the patient.
+            k (int): Number of neighbours.
+            candidates (Optional[np.ndarray], optional): Row positions to search (default: every row).
+
+        Returns:
+            tuple: (row positions, distances), closest first; the patient itself is excluded.
+        """
+        return _closest(*self.search(self.features[position], self.norms[position], k, candidates, position), k)
+
+    def search(
+        self,
+        target: np.ndarray,
+        target_norm: float,
+        k: int,
+        candidates: Optional[np.ndarray] = None,
+        exclude: Optional[int] = None
+    ) -> tuple:
+        """
+        Find the k rows closest to a feature vector, in no particular order.
+
+        Args:
+            target (np.ndarray): Feature vector.
+            target_norm (float): Its squared norm.
+            k (int): Number of neighbours.
+            candidates (Optional[np.ndarray], optional): Row positions to search (default: every row).
+            exclude (Optional[int], optional): Row position never returned (the patient itself).
+
+        Returns:
+            tuple: (row positions, squared distances) of at most k rows.
+        """
+        n_rows = len(self.features) if candidates is None else len(candidates)
+        best_positions = np.empty(0, dtype=np.intp)
+        best_distances = np.empty(0, dtype=np.float32)
+
+        for start in range(0, n_rows, BLOCK_ROWS):
+            if candidates is None:
+                rows = np.arange(start, min(start + BLOCK_ROWS, n_rows))
+                block = self.features[start:start + BLOCK_ROWS]
+            else:
+                rows = candidates[start:start + BLOCK_ROWS]
+                block = self.features[rows]
+            distances = self.norms[rows] - 2 * (block @ target) + target_norm
+            distances[rows == exclude] = np.inf
+
+            if len(distances) > k:
+                kept = np.argpartition(distances, k)[:k]
+                rows, distances = rows[kept], distances[kept]
+            best_positions = np.concatenate([best_positions, rows])
+            best_distances = np.concatenate([best_distances, distances])
+            if len(best_distances) > k:
+                kept = np.argpartition(best_distances, k)[:k]
+                best_positions, best_distances = best_positions[kept], best_distances[kept]
+        return best_positions, best_distances
+
+
+# Index of a version with ingested rows : the index of its base plus the delta rows
+class DeltaIndex:
+    """
+    Nearest-neighbour index of a DeltaDataset. The base index is built once per base
+    version and shared by all the versions appended to it; only the delta rows are
+    encoded for a new version (with the standardization of the base) and searched
+    separately, then the two top-k lists are merged.
+
+    Args:
+        base (SimilarityIndex): Index of the base rows.
+        delta (pd.DataFrame): Ingested rows, at the positions following the base rows.
+        offset (int): Position of the first delta row.
+    """
+
+    def __init__(self, base: SimilarityIndex, delta: pd.DataFrame, offset: int):
+        self.base = base
+        self.delta = SimilarityIndex(delta, (base.means, base.scales))
+        self.offset = offset
+
+    def nearest(self, position: int, k: int, candidates: Optional[np.ndarray] = None) -> tuple:
+        """Find the k patients closest to one patient (see SimilarityIndex.nearest)."""
+        segment = self.delta if position >= self.offset else self.base
+        local = position - self.offset if position >= self.offset else position
+        target, target_norm = segment.features[local], segment.norms[local]
+
+        base_candidates = delta_candidates = None
+        if candidates is not None:
+            in_delta = candidates >= self.offset
+            base_candidates, delta_candidates = candidates[~in_delta], candidates[in_delta] - self.offset
+        base_positions, base_distances = self.base.search(
+            target, target_norm, k, base_candidates, position if segment is self.base else None
+        )
+        delta_positions, delta_distances = self.delta.search(
+            target, target_norm, k, delta_candidates, local if segment is self.delta else None
+        )
+        return _closest(
+            np.concatenate([base_positions, delta_positions + self.offset]),
+            np.concatenate([base_distances, delta_distances]),
+            k
+        )
+
+
+def _closest(positions: np.ndarray, distances: np.ndarray, k: int) -> tuple:
+    """The k closest rows with their distances, closest first (ties by position), excluded rows dropped."""
+    if len(distances) > k:
+        kept = np.argpartition(distances, k)[:k]
+        positions, distances = positions[kept], distances[kept]
+    order = np.lexsort((positions, distances))
+    positions, distances = positions[order], distances[order]
+    found = np.isfinite(distances)
+    return positions[found], np.sqrt(np.maximum(distances[found], 0)).astype(np.float64)
+
+
+# function that returns the similarity index of a dataset version (built on first use)
+def dataset_index(dataset: Dataset) -> Union[SimilarityIndex, DeltaIndex]:
+    """
+    Get the nearest-neighbour index of a dataset version, built once with `dataset.derived`.
+    A version with ingested rows reuses the index of its base (see DeltaIndex).
+
+    Args:
+        dataset (Dataset): Dataset version.
+
+    Returns:
+        Union[SimilarityIndex, DeltaIndex]: Index of the dataset.
+    """
+    if isinstance(dataset, DeltaDataset):
+        return dataset.derived(
+            "similarity", lambda data: DeltaIndex(dataset_index(data.base), data.delta, data.offset)
+        )
+    return dataset.derived("similarity", lambda data: SimilarityIndex(data.df))
+
+
+# function that gets the patients most similar to one patient
+def similar_patients(
+    patient_id: int,
+    k: int = 10,
+    query: Optional[patient_query.Node] = None,
+    fields: Optional[list] = None,
+    dataset: Optional[Dataset] = None
+) -> pd.DataFrame:
+    """
+    Get the k patients closest to a patient, optionally among the patients matching a filter.
+
+    Args:
+        patient_id (int): Patient id.
+        k (int, optional): Number of neighbours.
+        query (Optional[Node], optional): Compiled filter of the candidates (see stroke_api.query).
+        fields (Optional[list], optional): Columns to return (see filters.parse_fields), default all.
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        pd.DataFrame: Neighbour rows, closest first, with their `distance`.
+
+    Raises:
+        KeyError: If the patient does not exist.
+    """
+    dataset = dataset or filters.current_dataset()
+    position = dataset.engine.lookup_id(patient_id)
+    if position is None:
+        raise KeyError(patient_id)
+
+    index = dataset_index(dataset)
+    candidates = None
+    if query is not None or dataset.engine.visible is not None:
+        # (the rows replaced by ingested rows are never candidates)
+        candidates = filters.matching_positions(query=query, dataset=dataset)
+    with metrics.stage("neighbors"):
+        positions, distances = index.nearest(position, k, candidates)
+    rows = filters.take_rows(dataset, positions, fields=fields)
+    return rows.assign(distance=distances)
@@ -0,0 +1,514 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import reduce
+from pathlib import Path
+from typing import Callable, Optional
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from stroke_api import metrics
+from stroke_api import model
+from stroke_api import query as patient_query
+from stroke_api.pipeline import MANIFEST_NAME
+from stroke_api.schema import AGE_GROUP_WIDTH, COLUMNS, apply_schema
+from stroke_api.serialization import frame_to_records
+from stroke_api.stats import GROUP_KEYS, SUM_COLUMNS, compute_partials, merge_partials, statistics_from_partials
+from stroke_api.store import RELOAD_CHECK_INTERVAL
+
+# Directory of the partitioned dataset written by stroke_api.pipeline (empty : in-memory mode)
+PARTITION_DIR = os.environ.get("STROKE_API_PARTITIONS", "")
+
+# Worker processes scanning the partitions (0 : scan in the calling process)
+PARTITION_WORKERS = int(os.environ.get("STROKE_API_PARTITION_WORKERS", str(os.cpu_count() or 4)))
+
+# Start method of the partition workers : the API process runs threads, which a fork would copy
+# in whatever state they are (e.g. holding a lock), so the workers are started from a clean server
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Minimum delay (seconds) between two scans of the partition files for changes (same setting as the data file)
+CATALOG_CHECK_INTERVAL = RELOAD_CHECK_INTERVAL
+
+# Columns read to compute the /stats/ partial aggregates of a partition
+PARTIAL_COLUMNS = list(dict.fromkeys(['id'] + GROUP_KEYS + list(SUM_COLUMNS)))
+
+
+# function that tells whether the API runs on the partitions
+def enabled() -> bool:
+    """
+    Check the partitioned mode (STROKE_API_PARTITIONS set to the pipeline output directory).
+
+    Returns:
+        bool: True if /patients/ and /stats/ run on the partitions.
+    """
+    return bool(PARTITION_DIR)
+
+
+# One parquet file of the partitioned dataset
+class Partition:
+    """
+    A partition file with its key (from the `gender=.../age_group=...` directories)
+    and the min / max statistics of its row groups, read from the parquet footer.
+
+    Args:
+        path (Path): Parquet file.
+        root (Path): Root directory of the partitioned dataset.
+    """
+
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        stat = path.stat()
+        self.signature = (str(path.relative_to(root)), stat.st_mtime_ns, stat.st_size)
+        self.keys = dict(
+            part.split('=', 1) for part in path.relative_to(root).parent.parts if '=' in part
+        )
+
+        metadata = pq.ParquetFile(path).metadata
+        self.rows = metadata.num_rows
+        self.row_groups = []
+        for index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(index)
+            bounds = {}
+            for position in range(row_group.num_columns):
+                chunk = row_group.column(position)
+                statistics = chunk.statistics
+                if statistics is None or not statistics.has_null_count:
+                    continue
+                missing = statistics.null_count > 0
+                if statistics.has_min_max:
+                    bounds[chunk.path_in_schema] = (statistics.min, statistics.max, missing)
+                elif statistics.null_count == row_group.num_rows:
+                    bounds[chunk.path_in_schema] = (None, None, True)
+            self.row_groups.append((index, row_group.num_rows, bounds))
+
+    @property
+    def bounds(self) -> dict:
+        """Bounds of the whole partition, from its key (gender, age group)."""
+        bounds = {}
+        if 'gender' in self.keys:
+            bounds['gender'] = (self.keys['gender'], self.keys['gender'], False)
+        if 'age_group' in self.keys:
+            first = float(self.keys['age_group'])
+            bounds['age'] = (first, first + AGE_GROUP_WIDTH, False)
+        return bounds
+
+    def plan(self, query: Optional[patient_query.Node]) -> list:
+        """
+        Row groups that can hold rows matching the query.
+
+        Args:
+            query (Optional[Node]): Compiled filter.
+
+        Returns:
+            list: Indexes of the row groups to read (empty : skip the partition).
+        """
+        if not patient_query.may_match(query, self.bounds):
+            return []
+        return [index for index, _, bounds in self.row_groups if patient_query.may_match(query, bounds)]
+
+
+# Partitions of the dataset and their cached partial aggregates
+class PartitionCatalog:
+    """
+    List the partition files of a directory and their row-group statistics.
+    The version changes whenever a file is added, removed or rewritten.
+
+    Args:
+        directory (Path): Output directory of stroke_api.pipeline.
+        previous (Optional[PartitionCatalog], optional): Catalog of the same directory,
+            whose per-file partial aggregates are kept for the unchanged files.
+    """
+
+    def __init__(self, directory: Path, previous: Optional["PartitionCatalog"] = None):
+        start = time.perf_counter()
+        self.directory = Path(directory)
+        self.partitions = [
+            Partition(path, self.directory) for path in sorted(self.directory.rglob("*.parquet"))
+            if path.name != MANIFEST_NAME and not path.name.startswith(".")
+        ]
+        signatures = [partition.signature for partition in self.partitions]
+        self.version = hashlib.sha256(repr(signatures).encode()).hexdigest()[:16]
+        self.rows = sum(partition.rows for partition in self.partitions)
+        self.partials = {}
+        if previous is not None:
+            self.partials = {
+                signature: partials for signature, partials in previous.partials.items() if signature in signatures
+            }
+        self.load_seconds = time.perf_counter() - start
+        self.loaded_at = time.time()
+
+
+# function that lists the signatures of the partition files (cheap change check)
+def _signatures(directory: Path) -> list:
+    """Relative path, mtime and size of every partition file."""
+    signatures = []
+    for path in sorted(directory.rglob("*.parquet")):
+        if path.name != MANIFEST_NAME and not path.name.startswith("."):
+            stat = path.stat()
+            signatures.append((str(path.relative_to(directory)), stat.st_mtime_ns, stat.st_size))
+    return signatures
+
+
+_catalog: Optional[PartitionCatalog] = None
+_catalog_lock = threading.Lock()
+_last_check = 0.0
+
+
+# function that returns the catalog of the partitions, rescanned when the files change
+def current_catalog(directory: Optional[Path] = None) -> PartitionCatalog:
+    """
+    Get the partition catalog, reading the footers again if a file changed.
+    The files are listed at most once per CATALOG_CHECK_INTERVAL; between two checks,
+    or while another thread checks, the current catalog is returned without waiting.
+
+    Args:
+        directory (Optional[Path], optional): Partition directory (default: STROKE_API_PARTITIONS).
+
+    Returns:
+        PartitionCatalog: Current catalog.
+    """
+    global _catalog, _last_check
+    directory = Path(directory or PARTITION_DIR)
+    current = _catalog
+    if current is not None and current.directory == directory:
+        if time.monotonic() - _last_check < CATALOG_CHECK_INTERVAL:
+            return current
+        # Another thread is already checking : keep serving the current catalog
+        if not _catalog_lock.acquire(blocking=False):
+            return current
+    else:
+        _catalog_lock.acquire()
+    try:
+        current = _catalog
+        _last_check = time.monotonic()
+        if (
+            current is None or current.directory != directory
+            or [partition.signature for partition in current.partitions] != _signatures(directory)
+        ):
+            previous = current if current is not None and current.directory == directory else None
+            _catalog = PartitionCatalog(directory, previous)
+        return _catalog
+    finally:
+        _catalog_lock.release()
+
+
+# function that returns the loaded catalog without scanning the directory
+def loaded() -> Optional[PartitionCatalog]:
+    """The catalog, or None if no query has loaded it yet."""
+    return _catalog
+
+
+# function that reads and filters the rows of one partition (runs in a worker process)
+def scan_rows(
+    path: str,
+    row_groups: list,
+    query: Optional[patient_query.Node] = None,
+    fields: Optional[list] = None,
+    limit: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Read the selected row groups of a partition and keep the rows matching the query.
+    Only this partition is in the memory of the worker.
+
+    Args:
+        path (str): Parquet file.
+        row_groups (list): Row groups that can match (see Partition.plan).
+        query (Optional[Node], optional): Compiled filter.
+        fields (Optional[list], optional): Columns to return, default all.
+        limit (Optional[int], optional): Only return the `limit` smallest ids.
+
+    Returns:
+        pd.DataFrame: Matching rows in the compact dtypes of the API.
+    """
+    df = apply_schema(pq.ParquetFile(path).read_row_groups(row_groups, columns=COLUMNS).to_pandas())
+    df = df[patient_query.evaluate_frame(query, df)]
+    if limit is not None:
+        df = df.nsmallest(limit, 'id')
+    return df if fields is None else df[fields]
+
+
+# function that computes the /stats/ partial aggregates of one partition (runs in a worker process)
+def scan_partials(path: str) -> pd.DataFrame:
+    """
+    Read the columns needed by /stats/ from a partition and aggregate them by (gender, stroke, age).
+
+    Args:
+        path (str): Parquet file.
+
+    Returns:
+        pd.DataFrame: Partial aggregates of the partition.
+    """
+    return compute_partials(pq.read_table(path, columns=PARTIAL_COLUMNS).to_pandas())
+
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+# function that starts the partition workers
+def start() -> Optional[Executor]:
+    """
+    Create the worker processes (called at startup, else by the first scatter).
+
+    Returns:
+        Optional[Executor]: Process executor, None when the scans run inline (PARTITION_WORKERS = 0).
+    """
+    global _executor
+    if PARTITION_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            context = multiprocessing.get_context(START_METHOD)
+            if START_METHOD == "forkserver":
+                # The server imports the scan functions once, the workers forked from it start ready
+                context.set_forkserver_preload([__name__])
+            _executor = ProcessPoolExecutor(max_workers=PARTITION_WORKERS, mp_context=context)
+        return _executor
+
+
+# function that runs one task per partition on the worker processes
+def scatter(fn: Callable, tasks: list) -> list:
+    """
+    Run `fn(*task)` for every task, in parallel on the partition worker processes.
+
+    Args:
+        fn (Callable): Top-level function (picklable).
+        tasks (list): Argument tuples, one per partition.
+
+    Returns:
+        list: Results, in the order of the tasks.
+    """
+    if PARTITION_WORKERS <= 0 or len(tasks) <= 1:
+        return [fn(*task) for task in tasks]
+    executor = start()
+    futures = [executor.submit(fn, *task) for task in tasks]
+    return [future.result() for future in futures]
+
+
+# function that selects the patients matching the filters across the partitions
+def select_patients(
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[float] = None,
+    query: Optional[patient_query.Node] = None,
+    fields: Optional[list] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    with_risk_score: bool = False,
+    catalog: Optional[PartitionCatalog] = None
+) -> pd.DataFrame:
+    """
+    Scatter-gather selection : the partitions and row groups that cannot match are
+    pruned with their keys and statistics, the others are filtered in parallel by the
+    worker processes and the rows are concatenated, ordered by id.
+
+    With `limit` (keyset pagination after `after_id`) every partition only returns
+    its `limit` first ids, so the merge never holds more than `limit` rows per partition.
+
+    Args:
+        gender (Optional[str], optional):
+        stroke (Optional[int], optional):
+        max_age (Optional[float], optional):
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query).
+        fields (Optional[list], optional): Columns to return (see filters.parse_fields), default all.
+        after_id (Optional[int], optional): Only patients with a greater id.
+        limit (Optional[int], optional): Maximum number of patients.
+        with_risk_score (bool, optional): Add the `risk_score` of the loaded risk model.
+        catalog (Optional[PartitionCatalog], optional): Catalog to query (default: current one).
+
+    Returns:
+        pd.DataFrame: Matching patients, ordered by id.
+    """
+    rows = _gather_rows(gender, stroke, max_age, query, fields, after_id, limit, with_risk_score, catalog)
+    return _project(rows, fields, with_risk_score)
+
+
+# function that gets one page of patients across the partitions, ordered by id
+def get_patient_page(
+    query: Optional[patient_query.Node] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    with_risk_score: bool = False,
+    fields: Optional[list] = None,
+    catalog: Optional[PartitionCatalog] = None
+) -> tuple:
+    """
+    Keyset pagination over the partitions (see select_patients).
+
+    Args:
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query).
+        after_id (Optional[int], optional): Only patients with a greater id.
+        limit (Optional[int], optional): Page size.
+        with_risk_score (bool, optional): Add the `risk_score` of the loaded risk model.
+        fields (Optional[list], optional): Columns to return, default all.
+        catalog (Optional[PartitionCatalog], optional): Catalog to query (default: current one).
+
+    Returns:
+        tuple: (page DataFrame, id to use as after_id for the next page, None on the last page).
+    """
+    rows = _gather_rows(None, None, None, query, fields, after_id, limit, with_risk_score, catalog)
+    next_after_id = None
+    if limit is not None and len(rows) == limit:
+        next_after_id = int(rows['id'].iat[-1])
+    return _project(rows, fields, with_risk_score), next_after_id
+
+
+# function that gets many patients by id across the partitions
+def get_patients_batch(
+    patient_ids: list,
+    fields: Optional[list] = None,
+    catalog: Optional[PartitionCatalog] = None
+) -> tuple:
+    """
+    Get many patients by id : only the row groups whose id range holds one of the ids are read.
+
+    Args:
+        patient_ids (list): Patient ids (duplicates are ignored, order is kept).
+        fields (Optional[list], optional): Columns to return (see filters.parse_fields), default all.
+        catalog (Optional[PartitionCatalog], optional): Catalog to query (default: current one).
+
+    Returns:
+        tuple: (DataFrame of the patients found, in the order of the ids, ids not found).
+    """
+    ids = pd.unique(np.asarray(patient_ids, dtype=np.int64))
+    with_risk_score = fields is not None and 'risk_score' in fields
+    if len(ids):
+        query = patient_query.make_condition('id', 'in', ids.tolist())
+        rows = _gather_rows(None, None, None, query, fields, None, None, with_risk_score, catalog)
+    else:
+        rows = _empty_rows(None)
+    # Rows in the order of the requested ids
+    rows = rows.iloc[np.argsort(pd.Index(ids).get_indexer(rows['id']), kind='stable')].reset_index(drop=True)
+    missing = ids[~np.isin(ids, rows['id'].to_numpy())].tolist()
+    return _project(rows, fields, False), missing
+
+
+# function that gets one patient by id across the partitions
+def get_info_by_id(patient_id: int, fields: Optional[list] = None, catalog: Optional[PartitionCatalog] = None) -> list:
+    """
+    Get a patient from the row groups whose id range holds its id (see get_patients_batch).
+
+    Args:
+        patient_id (int): Patient id.
+        fields (Optional[list], optional): Columns to return, default all.
+        catalog (Optional[PartitionCatalog], optional): Catalog to query (default: current one).
+
+    Returns:
+        list: The record of the patient, empty if the id does not exist.
+    """
+    rows, _ = get_patients_batch([patient_id], fields=fields, catalog=catalog)
+    return frame_to_records(rows)
+
+
+def _empty_rows(columns: Optional[list]) -> pd.DataFrame:
+    """No rows, in the compact dtypes of the API."""
+    empty = apply_schema(pd.DataFrame(columns=COLUMNS))
+    return empty if columns is None else empty[columns]
+
+
+def _gather_rows(
+    gender: Optional[str],
+    stroke: Optional[int],
+    max_age: Optional[float],
+    query: Optional[patient_query.Node],
+    fields: Optional[list],
+    after_id: Optional[int],
+    limit: Optional[int],
+    with_risk_score: bool,
+    catalog: Optional[PartitionCatalog]
+) -> pd.DataFrame:
+    """Prune, scatter and merge : matching rows ordered by id, with the id column."""
+    catalog = catalog or current_catalog()
+    simple = patient_query.from_params(gender=gender, stroke=stroke, ranges={'age': (None, max_age)})
+    cursor = None if after_id is None else patient_query.make_condition('id', '>', after_id)
+    query = patient_query.combine(simple, query, cursor)
+
+    # The workers only return the projected columns, plus the id that orders the merge;
+    # the risk model needs every input column, so scored rows are projected after scoring
+    columns = None
+    if fields is not None and not with_risk_score:
+        columns = list(dict.fromkeys(['id'] + [column for column in fields if column != 'risk_score']))
+    with metrics.stage("prune"):
+        tasks = [
+            (str(partition.path), row_groups, query, columns, limit)
+            for partition in catalog.partitions
+            for row_groups in [partition.plan(query)] if row_groups
+        ]
+    with metrics.stage("scatter"):
+        parts = scatter(scan_rows, tasks)
+
+    with metrics.stage("gather"):
+        parts = [part for part in parts if len(part)] or [_empty_rows(columns)]
+        rows = pd.concat(parts, ignore_index=True).sort_values('id', kind='stable', ignore_index=True)
+        if limit is not None:
+            rows = rows.head(limit)
+    if with_risk_score:
+        rows = rows.assign(risk_score=model.load_model().score(rows))
+    metrics.record_rows(len(rows))
+    return rows
+
+
+def _project(rows: pd.DataFrame, fields: Optional[list], with_risk_score: bool) -> pd.DataFrame:
+    """Keep the requested columns, in the order of filters.row_columns."""
+    columns = list(fields) if fields is not None else list(COLUMNS)
+    if with_risk_score and 'risk_score' not in columns:
+        columns.append('risk_score')
+    return rows[columns]
+
+
+# function that computes the /stats/ statistics across the partitions
+def patient_statistics(
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[float] = None,
+    catalog: Optional[PartitionCatalog] = None
+) -> dict:
+    """
+    Statistics of the filtered patients from per-partition partial aggregates.
+
+    The partials of a partition are computed once per file version by a worker
+    process (only for the partitions the filters can reach) and merged with
+    `merge_partials`; the filters are then applied to the merged groups.
+
+    Args:
+        gender (Optional[str], optional):
+        stroke (Optional[int], optional):
+        max_age (Optional[float], optional):
+        catalog (Optional[PartitionCatalog], optional): Catalog to query (default: current one).
+
+    Returns:
+        dict: Same statistics as /stats/.
+
+    Raises:
+        ValueError: If no patient matches the filters.
+    """
+    catalog = catalog or current_catalog()
+    query = patient_query.from_params(gender=gender, stroke=stroke, ranges={'age': (None, max_age)})
+    partitions = [
+        partition for partition in catalog.partitions if patient_query.may_match(query, partition.bounds)
+    ]
+    missing = [partition for partition in partitions if partition.signature not in catalog.partials]
+    with metrics.stage("scatter"):
+        for partition, partials in zip(missing, scatter(scan_partials, [(str(p.path),) for p in missing])):
+            catalog.partials[partition.signature] = partials
+
+    with metrics.stage("stats"):
+        selected = [catalog.partials[partition.signature] for partition in partitions]
+        if not selected:
+            raise ValueError("No patient matches these filters")
+        return statistics_from_partials(
+            reduce(merge_partials, selected), gender=gender, stroke=stroke, max_age=max_age
+        )
+
+
+# function that stops the partition workers
+def shutdown():
+    """Stop the worker processes."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
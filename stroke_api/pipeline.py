@@ -0,0 +1,399 @@
+from pathlib import Path
+from typing import Iterator, Optional
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from stroke_api.schema import AGE_GROUP_WIDTH, CATEGORIES, COLUMNS, FLAGS, range_violations
+from stroke_api.store import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+# Raw dataset and output of the pipeline
+SOURCE_PATH = DATA_DIR / "healthcare-dataset-stroke-data.csv"
+OUTPUT_DIR = DATA_DIR / "clean_health"
+
+# File (in the output directory) recording the hash and partition of every processed source row
+MANIFEST_NAME = "_manifest.parquet"
+
+# Number of CSV rows read at a time
+CHUNK_SIZE = 100_000
+
+# Rows per parquet row group in the partitions (unit skipped with the min / max statistics)
+ROW_GROUP_SIZE = 65_536
+
+# Order of the rows in a partition : consecutive row groups cover narrow stroke / age ranges
+PARTITION_SORT = ['stroke', 'age', 'id']
+
+# Half-width (years) of the age window used to impute a missing BMI
+BMI_WINDOW = 1.0
+
+# Dtypes of the CSV columns (flags are read as floats so missing values can be detected)
+SOURCE_DTYPES = {
+    'id': 'int64', 'gender': 'object', 'age': 'float64', 'hypertension': 'float64',
+    'heart_disease': 'float64', 'ever_married': 'object', 'work_type': 'object',
+    'Residence_type': 'object', 'avg_glucose_level': 'float64', 'bmi': 'float64',
+    'smoking_status': 'object', 'stroke': 'float64',
+}
+
+# Columns that must be present in every row (bmi is imputed when missing)
+REQUIRED_COLUMNS = [column for column in COLUMNS if column != 'bmi']
+
+
+# function that streams the raw CSV in chunks
+def read_source(source: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Read the raw dataset in chunks with fixed dtypes ("N/A" is read as missing).
+
+    Args:
+        source (Path): CSV file.
+        chunk_size (int, optional): Rows per chunk.
+
+    Yields:
+        pd.DataFrame: Chunk of raw rows, with the columns in the cleaned dataset order.
+
+    Raises:
+        ValueError: If a column is missing from the CSV.
+    """
+    for chunk in pd.read_csv(source, dtype=SOURCE_DTYPES, na_values=['N/A'], chunksize=chunk_size):
+        missing = [column for column in COLUMNS if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing columns in {source}: {missing}")
+        yield chunk[COLUMNS]
+
+
+# function that hashes the source rows (to detect new or changed rows on reruns)
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    Hash every row of a chunk from its values.
+
+    Args:
+        df (pd.DataFrame): Raw rows.
+
+    Returns:
+        np.ndarray: One int64 hash per row.
+    """
+    return pd.util.hash_pandas_object(df, index=False).to_numpy().view(np.int64)
+
+
+# function that gives the output partition of every row
+def partition_keys(df: pd.DataFrame) -> pd.Series:
+    """
+    Partition of each row : `gender=<gender>/age_group=<first age of the group>`.
+
+    Args:
+        df (pd.DataFrame): Valid rows.
+
+    Returns:
+        pd.Series: Relative partition directory of each row.
+    """
+    age_groups = (df['age'] // AGE_GROUP_WIDTH * AGE_GROUP_WIDTH).astype(int).astype(str)
+    return "gender=" + df['gender'].astype(str) + "/age_group=" + age_groups
+
+
+# function that checks the rows against the documented valid values
+def validate(df: pd.DataFrame, strict: bool = False) -> tuple:
+    """
+    Split a chunk into valid and rejected rows.
+
+    Rows with a missing required value, a categorical value outside its valid values
+    or a flag other than 0/1 are rejected. Measures outside the documented ranges are
+    counted (and kept, as decided in the README) unless `strict` is set.
+
+    Args:
+        df (pd.DataFrame): Raw rows.
+        strict (bool, optional): Also reject the rows with a measure out of range.
+
+    Returns:
+        tuple: (valid rows with the flags as int64, rejected count per reason, out-of-range count per column).
+    """
+    reasons = {'missing_value': df[REQUIRED_COLUMNS].isna().any(axis=1)}
+    for column, categories in CATEGORIES.items():
+        reasons[f"invalid_{column}"] = df[column].notna() & ~df[column].isin(categories)
+    for column in FLAGS:
+        reasons[f"invalid_{column}"] = df[column].notna() & ~df[column].isin([0, 1])
+
+    out_of_range = range_violations(df)
+    if strict:
+        reasons.update({f"out_of_range_{column}": mask for column, mask in out_of_range.items()})
+
+    rejected = np.logical_or.reduce([mask.to_numpy() for mask in reasons.values()])
+    valid = df[~rejected].astype({column: 'int64' for column in FLAGS})
+    return (
+        valid,
+        {reason: int(mask.sum()) for reason, mask in reasons.items() if mask.any()},
+        {column: int((mask & ~rejected).sum()) for column, mask in out_of_range.items() if mask.any()},
+    )
+
+
+# Imputation of the missing BMI values from patients of the same gender and a close age
+class BmiImputer:
+    """
+    Mean BMI of the patients of the same gender whose age is within ±window years,
+    computed for all the missing values at once.
+
+    For each gender the known (age, bmi) pairs are sorted by age and cumulated, so the
+    mean over an age window is two binary searches and a difference of prefix sums,
+    instead of one scan of the dataset per missing row. This gives the same values as
+    the notebook's row-wise `compute_bmi_mean` used to build clean_health.parquet.
+    When the window is empty the gender mean (then the overall mean) is used.
+
+    Args:
+        genders (np.ndarray): Gender of the patients with a known BMI.
+        ages (np.ndarray): Their age.
+        bmis (np.ndarray): Their BMI.
+        window (float, optional): Half-width of the age window.
+    """
+
+    def __init__(self, genders: np.ndarray, ages: np.ndarray, bmis: np.ndarray, window: float = BMI_WINDOW):
+        self.window = window
+        self.overall_mean = float(bmis.mean()) if len(bmis) else np.nan
+        self.groups = {}
+        for gender in pd.unique(genders):
+            selected = genders == gender
+            order = np.argsort(ages[selected], kind='stable')
+            sorted_ages = ages[selected][order]
+            cumulative = np.concatenate([[0.0], np.cumsum(bmis[selected][order])])
+            self.groups[gender] = (sorted_ages, cumulative)
+
+    def means(self, genders: np.ndarray, ages: np.ndarray) -> np.ndarray:
+        """
+        Mean BMI around each (gender, age).
+
+        Args:
+            genders (np.ndarray): Genders.
+            ages (np.ndarray): Ages.
+
+        Returns:
+            np.ndarray: Imputed BMI values.
+        """
+        result = np.full(len(ages), self.overall_mean)
+        for gender, (sorted_ages, cumulative) in self.groups.items():
+            selected = np.flatnonzero(genders == gender)
+            if not len(selected):
+                continue
+            start = np.searchsorted(sorted_ages, ages[selected] - self.window, side='left')
+            end = np.searchsorted(sorted_ages, ages[selected] + self.window, side='right')
+            count = end - start
+            gender_mean = cumulative[-1] / len(sorted_ages)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                window_mean = (cumulative[end] - cumulative[start]) / count
+            result[selected] = np.where(count > 0, window_mean, gender_mean)
+        return result
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fill the missing BMI values of a DataFrame.
+
+        Args:
+            df (pd.DataFrame): Rows with possibly missing bmi.
+
+        Returns:
+            pd.DataFrame: Rows with the missing bmi imputed.
+        """
+        missing = df['bmi'].isna().to_numpy()
+        if not missing.any():
+            return df
+        df = df.copy()
+        df.loc[missing, 'bmi'] = self.means(
+            df['gender'].to_numpy()[missing], df['age'].to_numpy()[missing]
+        )
+        return df
+
+
+# function that reads the manifest of a previous run
+def load_manifest(output_dir: Path) -> pd.DataFrame:
+    """
+    Read the manifest of the previous run (id, hash, partition and source position of every row).
+
+    Args:
+        output_dir (Path): Output directory.
+
+    Returns:
+        pd.DataFrame: Manifest (empty if there was no previous run).
+    """
+    path = output_dir / MANIFEST_NAME
+    if not path.exists():
+        return pd.DataFrame({
+            'id': pd.Series(dtype='int64'), 'hash': pd.Series(dtype='int64'),
+            'partition': pd.Series(dtype='object'), 'position': pd.Series(dtype='int64'),
+        })
+    return pd.read_parquet(path)
+
+
+def _write_parquet(df: pd.DataFrame, path: Path, row_group_size: Optional[int] = None):
+    """Write a parquet file through a temporary file, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    df.to_parquet(tmp_path, index=False, row_group_size=row_group_size)
+    os.replace(tmp_path, path)
+
+
+# function that reads the cleaned rows from the partitions, in the source order
+def read_partitions(output_dir: Path = OUTPUT_DIR) -> pd.DataFrame:
+    """
+    Read every partition written by the pipeline.
+
+    Args:
+        output_dir (Path, optional): Output directory of the pipeline.
+
+    Returns:
+        pd.DataFrame: Cleaned rows, in the order of the source file.
+    """
+    manifest = load_manifest(output_dir)
+    parts = [
+        pd.read_parquet(output_dir / partition / "part-0.parquet")
+        for partition in sorted(manifest['partition'].unique())
+    ]
+    if not parts:
+        return pd.DataFrame(columns=COLUMNS)
+    df = pd.concat(parts, ignore_index=True)
+    order = pd.Series(manifest['position'].to_numpy(), index=manifest['id'].to_numpy())
+    return df.iloc[np.argsort(order.reindex(df['id']).to_numpy(), kind='stable')].reset_index(drop=True)
+
+
+# function that runs the whole pipeline
+def run(
+    source: Path = SOURCE_PATH,
+    output_dir: Path = OUTPUT_DIR,
+    chunk_size: int = CHUNK_SIZE,
+    full: bool = False,
+    strict: bool = False,
+    export: Optional[Path] = None
+) -> dict:
+    """
+    Clean the raw CSV into partitioned parquet (`<output_dir>/gender=.../age_group=.../part-0.parquet`),
+    each partition sorted by stroke and age in row groups of ROW_GROUP_SIZE rows.
+
+    Only the source rows that are new or changed since the previous run (by row hash) are
+    imputed and written, and only the partitions containing them (or removed rows) are
+    rewritten. Rows already processed keep their imputed BMI; `full` rebuilds everything.
+
+    Args:
+        source (Path, optional): Raw CSV file.
+        output_dir (Path, optional): Directory of the partitioned output.
+        chunk_size (int, optional): CSV rows read at a time.
+        full (bool, optional): Ignore the previous run and rebuild every partition.
+        strict (bool, optional): Reject the rows with a measure outside its documented range.
+        export (Optional[Path], optional): Also write all the cleaned rows to one parquet file
+            (e.g. the clean_health.parquet served by the API).
+
+    Returns:
+        dict: Summary of the run (rows read, changed, removed, rejected, imputed...).
+    """
+    start = time.perf_counter()
+    if full and output_dir.exists():
+        shutil.rmtree(output_dir)
+    previous = load_manifest(output_dir)
+    previous_ids = pd.Index(previous['id'])
+    previous_hashes = previous['hash'].to_numpy()
+
+    entries, changed, known_bmi = [], [], []
+    rejected, out_of_range = {}, {}
+    position = 0
+    for chunk in read_source(source, chunk_size):
+        hashes = row_hashes(chunk)
+        positions = np.arange(position, position + len(chunk))
+        position += len(chunk)
+
+        valid, chunk_rejected, chunk_out_of_range = validate(chunk, strict=strict)
+        for counts, chunk_counts in ((rejected, chunk_rejected), (out_of_range, chunk_out_of_range)):
+            for key, count in chunk_counts.items():
+                counts[key] = counts.get(key, 0) + count
+
+        kept = chunk.index.get_indexer(valid.index)
+        valid = valid.assign(_position=positions[kept], _hash=hashes[kept])
+        valid['_partition'] = partition_keys(valid)
+        entries.append(valid[['id', '_hash', '_partition', '_position']])
+
+        # Known BMI values of the whole source feed the imputation of the new rows
+        known = valid[valid['bmi'].notna()]
+        known_bmi.append(known[['gender', 'age', 'bmi']])
+
+        # New or changed rows : unknown id or different hash
+        same = np.zeros(len(valid), dtype=bool)
+        if len(previous_hashes):
+            index = previous_ids.get_indexer(valid['id'])
+            same = (index >= 0) & (previous_hashes[np.maximum(index, 0)] == valid['_hash'].to_numpy())
+        changed.append(valid[~same])
+
+    manifest = pd.concat(entries, ignore_index=True).rename(columns=lambda name: name.lstrip('_'))
+    duplicated = manifest['id'].duplicated()
+    if duplicated.any():
+        # Only the first row of a duplicated id is kept
+        rejected['duplicate_id'] = int(duplicated.sum())
+        manifest = manifest[~duplicated]
+    changed = pd.concat(changed, ignore_index=True)
+    changed = changed[changed['_position'].isin(manifest['position'])]
+    removed = previous[~previous['id'].isin(manifest['id'])]
+
+    known_bmi = pd.concat(known_bmi, ignore_index=True)
+    imputer = BmiImputer(known_bmi['gender'].to_numpy(), known_bmi['age'].to_numpy(), known_bmi['bmi'].to_numpy())
+    imputed = int(changed['bmi'].isna().sum())
+    changed = imputer.transform(changed)
+
+    # Partitions to rewrite : those receiving changed rows and those losing changed or removed rows
+    touched_ids = pd.concat([changed['id'], removed['id']])
+    affected = set(changed['_partition']) | set(previous.loc[previous['id'].isin(touched_ids), 'partition'])
+    current_partition = pd.Series(manifest['partition'].to_numpy(), index=manifest['id'].to_numpy())
+    for partition in sorted(affected):
+        path = output_dir / partition / "part-0.parquet"
+        parts = []
+        if path.exists():
+            existing = pd.read_parquet(path)
+            keep = (current_partition.reindex(existing['id']).to_numpy() == partition) \
+                & ~existing['id'].isin(changed['id']).to_numpy()
+            parts.append(existing[keep])
+        parts.append(changed.loc[changed['_partition'] == partition, COLUMNS])
+        rows = pd.concat(parts, ignore_index=True)
+        if rows.empty:
+            shutil.rmtree(path.parent, ignore_errors=True)
+            continue
+        # Sorted rows give row groups with tight statistics (read_partitions restores the source order)
+        rows = rows.sort_values(PARTITION_SORT, kind='stable')[COLUMNS]
+        _write_parquet(rows, path, row_group_size=ROW_GROUP_SIZE)
+
+    _write_parquet(manifest[['id', 'hash', 'partition', 'position']], output_dir / MANIFEST_NAME)
+    if export is not None and (affected or not export.exists()):
+        _write_parquet(read_partitions(output_dir), export)
+
+    summary = {
+        "rows_read": position,
+        "rows_valid": len(manifest),
+        "rows_changed": len(changed),
+        "rows_removed": len(removed),
+        "rows_rejected": rejected,
+        "out_of_range": out_of_range,
+        "bmi_imputed": imputed,
+        "partitions_written": len(affected),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    logger.info("Pipeline run: %s", summary)
+    return summary
+
+
+def main(argv=None):
+    """Command line entry point : python -m stroke_api.pipeline"""
+    parser = argparse.ArgumentParser(description="Clean the raw stroke CSV into partitioned parquet.")
+    parser.add_argument("--source", default=str(SOURCE_PATH), help="Raw CSV file")
+    parser.add_argument("--output-dir", default=str(OUTPUT_DIR), help="Directory of the partitioned parquet")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="CSV rows read at a time")
+    parser.add_argument("--full", action="store_true", help="Rebuild every partition instead of only the changed rows")
+    parser.add_argument("--strict", action="store_true", help="Reject the rows with a measure out of its valid range")
+    parser.add_argument("--export", help="Also write all the cleaned rows to this parquet file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    summary = run(
+        source=Path(args.source), output_dir=Path(args.output_dir), chunk_size=args.chunk_size,
+        full=args.full, strict=args.strict, export=Path(args.export) if args.export else None
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache, reduce
+from typing import Optional, Union
+import re
+import numpy as np
+import pandas as pd
+from stroke_api.engine import RANGE_COLUMNS
+from stroke_api.schema import CATEGORIES, FLAGS
+
+# Columns that can be filtered, by kind
+CATEGORICAL_COLUMNS = list(CATEGORIES)
+FLAG_COLUMNS = list(FLAGS)
+NUMERIC_COLUMNS = list(RANGE_COLUMNS)
+FILTER_COLUMNS = ['id'] + CATEGORICAL_COLUMNS + FLAG_COLUMNS + NUMERIC_COLUMNS
+
+# Comparison operators of the filter language
+OPERATORS = ['==', '!=', '<', '<=', '>', '>=', 'in', 'not in']
+
+# Tokens of the `where` expressions
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<punct>[()\[\],])
+      | (?P<op>==|!=|<=|>=|<|>|=)
+      | (?P<string>'[^']*'|"[^"]*")
+      | (?P<number>-?\d+(?:\.\d+)?(?![\w-]))
+      | (?P<word>[A-Za-z_][\w-]*)
+    )""", re.VERBOSE)
+
+
+# One comparison : column <op> value(s)
+@dataclass(frozen=True)
+class Condition:
+    """Leaf of a query : `column op values` (values has one item except for in / not in)."""
+    column: str
+    op: str
+    values: tuple
+
+
+# Boolean combinations of conditions
+@dataclass(frozen=True)
+class And:
+    """All the children must match."""
+    children: tuple
+
+
+@dataclass(frozen=True)
+class Or:
+    """At least one child must match."""
+    children: tuple
+
+
+@dataclass(frozen=True)
+class Not:
+    """The child must not match."""
+    child: object
+
+
+Node = Union[Condition, And, Or, Not]
+
+
+# function that checks and converts the values of a condition
+def make_condition(column: str, op: str, values) -> Condition:
+    """
+    Build a condition, checking the column and operator and converting the values.
+
+    Args:
+        column (str): Column name.
+        op (str): Operator (==, !=, <, <=, >, >=, in, not in).
+        values: One value or a list of values.
+
+    Returns:
+        Condition: Validated condition.
+
+    Raises:
+        ValueError: If the column, operator or a value is not valid.
+    """
+    if column not in FILTER_COLUMNS:
+        raise ValueError(f"Unknown filter column: {column}")
+    op = '==' if op == '=' else op
+    if op not in OPERATORS:
+        raise ValueError(f"Unknown operator: {op}")
+    values = tuple(values) if isinstance(values, (list, tuple)) else (values,)
+    if not values:
+        raise ValueError(f"No value given for {column}")
+    if op not in ('in', 'not in') and len(values) != 1:
+        raise ValueError(f"{op} takes a single value")
+    if column in CATEGORICAL_COLUMNS:
+        if op not in ('==', '!=', 'in', 'not in'):
+            raise ValueError(f"{column} only supports ==, !=, in and not in")
+        values = tuple(str(value) for value in values)
+    else:
+        try:
+            values = tuple(float(value) if column in NUMERIC_COLUMNS else int(value) for value in values)
+        except ValueError:
+            raise ValueError(f"{column} values must be numbers")
+    return Condition(column, op, values)
+
+
+# Recursive-descent parser of the `where` expressions
+class _Parser:
+    """
+    Parse `where` expressions such as
+    `(gender in [Male, Female] and age >= 40) or not smoking_status == 'never smoked'`.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = self._tokenize(text)
+        self.index = 0
+
+    @staticmethod
+    def _tokenize(text: str) -> list:
+        tokens, position = [], 0
+        text = text.strip()
+        while position < len(text):
+            match = TOKEN_PATTERN.match(text, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Invalid syntax near: {text[position:position + 20]!r}")
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'string':
+                value = value[1:-1]
+            elif kind == 'word' and value.lower() in ('and', 'or', 'not', 'in'):
+                kind, value = 'keyword', value.lower()
+            tokens.append((kind, value))
+            position = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise ValueError("Unexpected end of expression")
+        self.index += 1
+        return token
+
+    def _expect(self, kind: str, value: str):
+        token = self._next()
+        if token != (kind, value):
+            raise ValueError(f"Expected {value!r}, got {token[1]!r}")
+
+    def parse(self) -> Node:
+        node = self._or()
+        if self._peek()[0] is not None:
+            raise ValueError(f"Unexpected token: {self._peek()[1]!r}")
+        return node
+
+    def _or(self) -> Node:
+        children = [self._and()]
+        while self._peek() == ('keyword', 'or'):
+            self._next()
+            children.append(self._and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def _and(self) -> Node:
+        children = [self._not()]
+        while self._peek() == ('keyword', 'and'):
+            self._next()
+            children.append(self._not())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def _not(self) -> Node:
+        if self._peek() == ('keyword', 'not'):
+            self._next()
+            return Not(self._not())
+        if self._peek() == ('punct', '('):
+            self._next()
+            node = self._or()
+            self._expect('punct', ')')
+            return node
+        return self._condition()
+
+    def _value(self):
+        kind, value = self._next()
+        if kind not in ('string', 'number', 'word'):
+            raise ValueError(f"Expected a value, got {value!r}")
+        return value
+
+    def _condition(self) -> Condition:
+        kind, column = self._next()
+        if kind != 'word':
+            raise ValueError(f"Expected a column name, got {column!r}")
+        kind, op = self._next()
+        if (kind, op) == ('keyword', 'not'):
+            self._expect('keyword', 'in')
+            op = 'not in'
+        elif kind not in ('op', 'keyword') or (kind == 'keyword' and op != 'in'):
+            raise ValueError(f"Expected an operator after {column}, got {op!r}")
+
+        if op in ('in', 'not in'):
+            self._expect('punct', '[')
+            values = [self._value()]
+            while self._peek() == ('punct', ','):
+                self._next()
+                values.append(self._value())
+            self._expect('punct', ']')
+        else:
+            values = [self._value()]
+        return make_condition(column, op, values)
+
+
+# function that compiles a `where` expression (compiled once, then reused)
+@lru_cache(maxsize=1024)
+def compile_where(text: str) -> Node:
+    """
+    Compile a `where` expression into a query tree.
+
+    Syntax: comparisons `column op value` with op in ==, !=, <, <=, >, >=,
+    `column in [v1, v2]`, `column not in [...]`, combined with and / or / not and parentheses.
+    Values with spaces are quoted: `smoking_status == 'never smoked'`.
+
+    Args:
+        text (str): Expression.
+
+    Returns:
+        Node: Query tree.
+
+    Raises:
+        ValueError: If the expression is not valid.
+    """
+    return _Parser(text).parse()
+
+
+# function that combines several query trees with and
+def combine(*nodes: Optional[Node]) -> Optional[Node]:
+    """
+    Combine query trees with `and`, ignoring the missing ones.
+
+    Returns:
+        Optional[Node]: Combined tree, or None if there is no filter.
+    """
+    nodes = [node for node in nodes if node is not None]
+    if not nodes:
+        return None
+    return nodes[0] if len(nodes) == 1 else And(tuple(nodes))
+
+
+# function that builds a query from the /patients/ query parameters
+def from_params(
+    where: Optional[str] = None,
+    ranges: Optional[dict] = None,
+    **values
+) -> Optional[Node]:
+    """
+    Build a query tree from the simple filter parameters.
+
+    Args:
+        where (Optional[str], optional): Boolean expression (see compile_where).
+        ranges (Optional[dict], optional): {column: (min, max)} inclusive ranges, None = no bound.
+        **values: column -> value or list of values (in-list).
+
+    Returns:
+        Optional[Node]: Query tree, or None if there is no filter.
+
+    Raises:
+        ValueError: If a column or value is not valid.
+    """
+    conditions = []
+    for column, value in values.items():
+        if value is None or (isinstance(value, (list, tuple)) and not value):
+            continue
+        if isinstance(value, (list, tuple)) and len(value) > 1:
+            conditions.append(make_condition(column, 'in', value))
+        else:
+            conditions.append(make_condition(column, '==', value))
+    for column, (low, high) in (ranges or {}).items():
+        if low is not None:
+            conditions.append(make_condition(column, '>=', low))
+        if high is not None:
+            conditions.append(make_condition(column, '<=', high))
+    return combine(*conditions, compile_where(where) if where else None)
+
+
+# function that estimates how many rows a query tree matches (to order the plan)
+def estimate(node: Node, dataset) -> int:
+    """
+    Estimate the number of rows matched by a query tree, from the engine indexes only.
+
+    Args:
+        node (Node): Query tree.
+        dataset: Dataset queried.
+
+    Returns:
+        int: Estimated number of matching rows.
+    """
+    engine = dataset.engine
+    n_rows = engine.n_rows
+    if isinstance(node, And):
+        return min(estimate(child, dataset) for child in node.children)
+    if isinstance(node, Or):
+        return min(n_rows, sum(estimate(child, dataset) for child in node.children))
+    if isinstance(node, Not):
+        return n_rows - estimate(node.child, dataset)
+
+    negated = node.op in ('!=', 'not in')
+    if node.column in engine.value_counts:
+        counts = engine.value_counts[node.column]
+        matched = sum(counts.get(value, 0) for value in node.values) if node.op in ('==', '!=', 'in', 'not in') else n_rows
+    elif node.column in engine.range_indexes and node.op not in ('in', 'not in'):
+        value = node.values[0]
+        bounds = {
+            '==': (value, value, True, True), '!=': (value, value, True, True),
+            '<': (None, value, True, False), '<=': (None, value, True, True),
+            '>': (value, None, False, True), '>=': (value, None, True, True),
+        }[node.op]
+        matched = engine.range_count(node.column, *bounds)
+    elif node.column == 'id' and node.op in ('==', 'in', '!=', 'not in'):
+        matched = len(node.values)
+    else:
+        matched = n_rows // 2
+    return n_rows - matched if negated else matched
+
+
+# function that evaluates a condition on the candidate rows
+def _evaluate_condition(node: Condition, dataset, candidates: Optional[np.ndarray]) -> np.ndarray:
+    """Row positions (among the candidates, None = all rows) matching one condition."""
+    engine = dataset.engine
+    negated = node.op in ('!=', 'not in')
+
+    # Range lookups in the sorted arrays when all rows are candidates
+    if candidates is None and node.column in engine.range_indexes and node.op in ('==', '<', '<=', '>', '>='):
+        value = node.values[0]
+        bounds = {
+            '==': (value, value, True, True),
+            '<': (None, value, True, False), '<=': (None, value, True, True),
+            '>': (value, None, False, True), '>=': (value, None, True, True),
+        }[node.op]
+        return engine.range_positions(node.column, *bounds)
+
+    # Equality on gender / stroke : union of the precomputed bitmaps
+    bitmaps = {'gender': 'gender_bitmaps', 'stroke': 'stroke_bitmaps'}.get(node.column)
+    if candidates is None and bitmaps is not None:
+        bitmaps = getattr(engine, bitmaps)
+        mask = np.zeros(engine.n_rows, dtype=bool)
+        for value in node.values:
+            if value in bitmaps:
+                mask |= bitmaps[value]
+        if negated:
+            mask = ~mask if engine.visible is None else ~mask & engine.visible
+        return np.flatnonzero(mask)
+
+    # Id equality : vectorized join on the sorted id array
+    if candidates is None and node.column == 'id' and node.op in ('==', 'in'):
+        positions, _ = engine.lookup_ids(np.asarray(node.values, dtype=np.int64))
+        return positions
+
+    # Otherwise : one vectorized comparison on the column (or its category codes)
+    if candidates is None and engine.visible is not None:
+        # Rows replaced by ingested rows are not scanned
+        candidates = engine.all_positions()
+    if candidates is None:
+        column = dataset.column(node.column)
+    else:
+        column = dataset.take(candidates, [node.column])[node.column]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = list(column.cat.categories)
+        values = column.cat.codes.to_numpy()
+        targets = np.array([categories.index(value) for value in node.values if value in categories], dtype=values.dtype)
+    else:
+        values = column.to_numpy()
+        targets = np.asarray(node.values, dtype=values.dtype)
+
+    if node.op in ('==', '!=', 'in', 'not in'):
+        mask = np.isin(values, targets)
+    else:
+        compare = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}[node.op]
+        mask = compare(values, targets[0])
+    if negated:
+        mask = ~mask
+    return np.flatnonzero(mask) if candidates is None else candidates[mask]
+
+
+# function that evaluates a query tree with the most selective predicates first
+def evaluate(node: Node, dataset, candidates: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Evaluate a query tree over the engine indexes.
+
+    `and` branches are evaluated from the most selective to the least selective, each one
+    only on the rows kept by the previous ones; no DataFrame is copied.
+
+    Args:
+        node (Node): Query tree.
+        dataset: Dataset queried.
+        candidates (Optional[np.ndarray], optional): Rows to consider (None = all rows).
+
+    Returns:
+        np.ndarray: Matching row positions (unordered, without duplicates).
+    """
+    if isinstance(node, Condition):
+        return _evaluate_condition(node, dataset, candidates)
+
+    if isinstance(node, And):
+        positions = candidates
+        for child in sorted(node.children, key=lambda child: estimate(child, dataset)):
+            positions = evaluate(child, dataset, positions)
+            if len(positions) == 0:
+                break
+        return positions
+
+    if isinstance(node, Or):
+        results = [evaluate(child, dataset, candidates) for child in node.children]
+        return reduce(np.union1d, results)
+
+    base = dataset.engine.all_positions() if candidates is None else candidates
+    return np.setdiff1d(base, evaluate(node.child, dataset, candidates))
+
+
+# function that returns the rows matching a query, in row order
+def execute(node: Optional[Node], dataset) -> np.ndarray:
+    """
+    Run a query on a dataset.
+
+    Args:
+        node (Optional[Node]): Query tree (None = all rows).
+        dataset: Dataset queried.
+
+    Returns:
+        np.ndarray: Matching row positions, in the original row order.
+    """
+    if node is None:
+        return dataset.engine.all_positions()
+    return np.sort(evaluate(node, dataset))
+
+
+# function that evaluates a query tree on the rows of a DataFrame (no index needed)
+def evaluate_frame(node: Optional[Node], df: pd.DataFrame) -> np.ndarray:
+    """
+    Evaluate a query tree with vectorized comparisons on the columns of a DataFrame,
+    e.g. the rows of one partition read by a worker process.
+
+    Args:
+        node (Optional[Node]): Query tree (None = all rows).
+        df (pd.DataFrame): Patient rows.
+
+    Returns:
+        np.ndarray: Boolean mask of the matching rows.
+    """
+    if node is None:
+        return np.ones(len(df), dtype=bool)
+    if isinstance(node, And):
+        return reduce(np.logical_and, (evaluate_frame(child, df) for child in node.children))
+    if isinstance(node, Or):
+        return reduce(np.logical_or, (evaluate_frame(child, df) for child in node.children))
+    if isinstance(node, Not):
+        return ~evaluate_frame(node.child, df)
+
+    # Same comparison as _evaluate_condition : category codes, or values cast to the column dtype
+    # (a float64 literal never equals the float32 value it was written as)
+    column = df[node.column]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = list(column.cat.categories)
+        values = column.cat.codes.to_numpy()
+        targets = np.array([categories.index(value) for value in node.values if value in categories], dtype=values.dtype)
+    else:
+        values = column.to_numpy()
+        targets = np.asarray(node.values, dtype=values.dtype)
+    if node.op in ('==', '!=', 'in', 'not in'):
+        mask = np.isin(values, targets)
+        return ~mask if node.op in ('!=', 'not in') else mask
+    compare = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}[node.op]
+    return compare(values, targets[0])
+
+
+# function that sorts the values of an in-list once for the bound checks
+@lru_cache(maxsize=256)
+def _sorted_values(values: tuple) -> list:
+    """Values of an in-list, sorted."""
+    return sorted(values)
+
+
+# function that tells whether rows with the given column bounds can match a query tree
+def may_match(node: Optional[Node], bounds: dict) -> bool:
+    """
+    Check a query tree against the min / max of the columns of a group of rows
+    (a partition or a parquet row group). False means that no row of the group can
+    match, so the group is skipped; True means that it has to be read.
+
+    Args:
+        node (Optional[Node]): Query tree (None = all rows).
+        bounds (dict): column -> (minimum, maximum, has_missing_values); a column
+            without bounds can hold any value.
+
+    Returns:
+        bool: False if the group certainly has no matching row.
+    """
+    if node is None:
+        return True
+    if isinstance(node, And):
+        return all(may_match(child, bounds) for child in node.children)
+    if isinstance(node, Or):
+        return any(may_match(child, bounds) for child in node.children)
+    if isinstance(node, Not) or node.column not in bounds:
+        # A negation can match as soon as one row differs : the bounds cannot exclude it
+        return True
+
+    low, high, missing = bounds[node.column]
+    if node.op in ('!=', 'not in'):
+        # Missing values never equal anything, so they match the negated operators
+        return missing or low is None or not (low == high and low in node.values)
+    if low is None:
+        # Only missing values : no comparison or equality can match
+        return False
+    value = node.values[0]
+    if node.op == '==':
+        return low <= value <= high
+    if node.op == 'in':
+        # Smallest listed value not below the minimum (long id lists are checked against many row groups)
+        values = _sorted_values(node.values)
+        index = bisect_left(values, low)
+        return index < len(values) and values[index] <= high
+    return {
+        '<': low < value, '<=': low <= value, '>': high > value, '>=': high >= value,
+    }[node.op]
@@ -0,0 +1,235 @@
+from typing import Optional
+import math
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from stroke_api import filters
+from stroke_api import metrics
+from stroke_api import query as patient_query
+from stroke_api.schema import CATEGORIES
+from stroke_api.store import Dataset
+
+# Factor columns compared against stroke, with their reference (unexposed) level
+REFERENCE_LEVELS = {
+    'hypertension': 0,
+    'heart_disease': 0,
+    'gender': 'Female',
+    'ever_married': 'No',
+    'work_type': 'Private',
+    'Residence_type': 'Rural',
+    'smoking_status': 'never smoked',
+}
+
+# Levels of every factor, in output order
+FACTOR_LEVELS = {
+    factor: [0, 1] if factor in ('hypertension', 'heart_disease') else CATEGORIES[factor]
+    for factor in REFERENCE_LEVELS
+}
+
+# Default and largest number of bootstrap resamples
+DEFAULT_RESAMPLES = 2000
+MAX_RESAMPLES = 20000
+
+# Resamples per task sent to the worker pool
+RESAMPLES_PER_TASK = int(os.environ.get("STROKE_API_BOOTSTRAP_CHUNK", "500"))
+
+# Seed of the bootstrap : the same request always gets the same intervals (and cache entry)
+BOOTSTRAP_SEED = 20240517
+
+
+# function that validates the factors asked
+def parse_factors(factors: Optional[list]) -> list:
+    """
+    Validate the factor columns (repeated and/or comma-separated names).
+
+    Args:
+        factors (Optional[list]): Requested factors, None for all of them.
+
+    Returns:
+        list: Factor columns.
+
+    Raises:
+        ValueError: If a column is not a factor.
+    """
+    if not factors:
+        return list(REFERENCE_LEVELS)
+    names = [name.strip() for value in factors for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in REFERENCE_LEVELS]
+    if unknown:
+        raise ValueError(f"Unknown factors: {unknown} (valid factors: {', '.join(REFERENCE_LEVELS)})")
+    return list(dict.fromkeys(names))
+
+
+# function that counts the patients with and without stroke at every level of the factors
+def contingency_tables(
+    factors: Optional[list] = None,
+    query: Optional[patient_query.Node] = None,
+    dataset: Optional[Dataset] = None
+) -> dict:
+    """
+    Count the filtered patients by factor level and stroke status, one `np.bincount` per factor.
+
+    Args:
+        factors (Optional[list], optional): Factor columns (see parse_factors), default all.
+        query (Optional[Node], optional): Compiled filter (see stroke_api.query).
+        dataset (Optional[Dataset], optional): Dataset to query (default: current one).
+
+    Returns:
+        dict: factor -> int array of shape (levels, 2), columns [without stroke, with stroke].
+    """
+    dataset = dataset or filters.current_dataset()
+    positions = filters.matching_positions(query=query, dataset=dataset)
+    factors = parse_factors(factors)
+    tables = {}
+    with metrics.stage("aggregate"):
+        rows = dataset.take(positions, ['stroke'] + factors)
+        stroke = rows['stroke'].to_numpy().astype(np.intp)
+        for factor in factors:
+            levels = FACTOR_LEVELS[factor]
+            codes = pd.Categorical(rows[factor], categories=levels).codes.astype(np.intp)
+            known = codes >= 0
+            cells = np.bincount(codes[known] * 2 + stroke[known], minlength=len(levels) * 2)
+            tables[factor] = cells.reshape(len(levels), 2)
+    return tables
+
+
+# function that computes the relative risks and odds ratios of 2x2 tables (vectorized)
+def ratios(counts: np.ndarray, reference: int) -> tuple:
+    """
+    Relative risk and odds ratio of every level against the reference level.
+
+    With a = exposed with stroke, b = exposed without, c = reference with stroke and
+    d = reference without : RR = (a / (a + b)) / (c / (c + d)) and OR = (a * d) / (b * c).
+    Tables with an empty cell get 0.5 added to every cell (Haldane-Anscombe correction);
+    levels or references without patients give NaN.
+
+    Args:
+        counts (np.ndarray): Counts of shape (..., levels, 2), columns [without stroke, with stroke].
+        reference (int): Index of the reference level.
+
+    Returns:
+        tuple: (relative risks, odds ratios), arrays of shape (..., levels).
+    """
+    b, a = counts[..., 0].astype(np.float64), counts[..., 1].astype(np.float64)
+    d, c = b[..., reference:reference + 1], a[..., reference:reference + 1]
+    empty = (a + b == 0) | (c + d == 0)
+    correction = np.where((a == 0) | (b == 0) | (c == 0) | (d == 0), 0.5, 0.0)
+    a, b, c, d = a + correction, b + correction, c + correction, d + correction
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_risk = (a / (a + b)) / (c / (c + d))
+        odds_ratio = (a * d) / (b * c)
+    relative_risk[empty] = np.nan
+    odds_ratio[empty] = np.nan
+    return relative_risk, odds_ratio
+
+
+# function that draws bootstrap replicates of the ratios (runs on the worker pool)
+def bootstrap_ratios(tables: dict, resamples: int, seed: np.random.SeedSequence) -> dict:
+    """
+    Bootstrap the relative risks and odds ratios of every factor.
+
+    Resampling the patients with replacement only changes the counts of the
+    (level, stroke) cells, so each replicate is drawn directly as a multinomial over
+    the cells : one vectorized draw gives all the replicates of a factor, whatever
+    the number of patients.
+
+    Args:
+        tables (dict): factor -> counts (see contingency_tables).
+        resamples (int): Number of replicates.
+        seed (np.random.SeedSequence): Seed of this task.
+
+    Returns:
+        dict: factor -> (relative risks, odds ratios), arrays of shape (resamples, levels).
+    """
+    rng = np.random.default_rng(seed)
+    replicates = {}
+    for factor, counts in tables.items():
+        total = int(counts.sum())
+        reference = FACTOR_LEVELS[factor].index(REFERENCE_LEVELS[factor])
+        if total == 0:
+            empty = np.full((resamples, len(counts)), np.nan)
+            replicates[factor] = (empty, empty)
+            continue
+        draws = rng.multinomial(total, counts.ravel() / total, size=resamples).reshape(resamples, *counts.shape)
+        replicates[factor] = ratios(draws, reference)
+    return replicates
+
+
+# function that splits the resamples into tasks with independent seeds
+def bootstrap_tasks(resamples: int, chunk: int = RESAMPLES_PER_TASK) -> list:
+    """
+    Split the bootstrap into tasks for the worker pool.
+
+    Args:
+        resamples (int): Total number of replicates.
+        chunk (int, optional): Replicates per task.
+
+    Returns:
+        list: (replicates, seed) of every task; the seeds are spawned from BOOTSTRAP_SEED.
+    """
+    sizes = [min(chunk, resamples - start) for start in range(0, resamples, chunk)]
+    seeds = np.random.SeedSequence(BOOTSTRAP_SEED).spawn(len(sizes))
+    return list(zip(sizes, seeds))
+
+
+# function that builds the risk-factor report
+def summarize(tables: dict, replicates: list, confidence: float = 0.95) -> dict:
+    """
+    Combine the counts and the bootstrap replicates of the tasks into the report.
+
+    Args:
+        tables (dict): factor -> counts (see contingency_tables).
+        replicates (list): Results of bootstrap_ratios, one per task.
+        confidence (float, optional): Level of the percentile intervals.
+
+    Returns:
+        dict: patients, strokes, resamples, confidence and one row per factor level
+        (patients, strokes, stroke_rate, relative_risk and odds_ratio with their interval).
+    """
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    first = next(iter(tables.values()))
+    rows = []
+    for factor, counts in tables.items():
+        levels = FACTOR_LEVELS[factor]
+        reference = levels.index(REFERENCE_LEVELS[factor])
+        relative_risk, odds_ratio = ratios(counts, reference)
+        intervals = {}
+        if replicates:
+            for name, index in (("relative_risk", 0), ("odds_ratio", 1)):
+                samples = np.concatenate([task[factor][index] for task in replicates])
+                with warnings.catch_warnings():
+                    # Levels without patients only have NaN replicates
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    intervals[name] = np.nanquantile(samples, quantiles, axis=0)
+        for position, level in enumerate(levels):
+            patients = int(counts[position].sum())
+            strokes = int(counts[position, 1])
+            row = {
+                "factor": factor,
+                "level": level,
+                "reference": REFERENCE_LEVELS[factor],
+                "patients": patients,
+                "strokes": strokes,
+                "stroke_rate": strokes / patients if patients else None,
+            }
+            for name, values in (("relative_risk", relative_risk), ("odds_ratio", odds_ratio)):
+                row[name] = _number(values[position])
+                low, high = (intervals[name][:, position] if name in intervals else (None, None))
+                row[f"{name}_low"] = None if position == reference else _number(low)
+                row[f"{name}_high"] = None if position == reference else _number(high)
+            rows.append(row)
+    return {
+        "patients": int(first.sum()),
+        "strokes": int(first[:, 1].sum()),
+        "resamples": sum(len(task[factor][0]) for task in replicates),
+        "confidence": confidence,
+        "factors": rows,
+    }
+
+
+def _number(value) -> Optional[float]:
+    """Convert to a JSON number (None for missing or infinite values)."""
+    if value is None or not math.isfinite(value):
+        return None
+    return float(value)
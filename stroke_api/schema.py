@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+# Valid values of the categorical columns (see README "A list of Valid values").
+# 'Other' (gender) and 'Unknown' (smoking_status) are kept in the data, as explained in the README.
+CATEGORIES = {
+    'gender': ['Male', 'Female', 'Other'],
+    'ever_married': ['Yes', 'No'],
+    'work_type': ['Private', 'Self-employed', 'Govt_job', 'children', 'Never_worked'],
+    'Residence_type': ['Urban', 'Rural'],
+    'smoking_status': ['never smoked', 'formerly smoked', 'smokes', 'Unknown'],
+}
+
+# Binary columns (0 or 1 only), stored as uint8
+FLAGS = ['hypertension', 'heart_disease', 'stroke']
+
+# Measurements, stored as float32
+MEASURES = ['age', 'avg_glucose_level', 'bmi']
+
+# Documented valid ranges of the measures (see README "A list of Valid values"), inclusive
+RANGES = {
+    'age': (0, 100),
+    'bmi': (10, 60),
+    'avg_glucose_level': (50, 300),
+}
+
+# Width (years) of the age groups (partitions of the cleaning pipeline, dimension of the data cube)
+AGE_GROUP_WIDTH = 10
+
+# Column order of the cleaned dataset
+COLUMNS = [
+    'id', 'gender', 'age', 'hypertension', 'heart_disease', 'ever_married', 'work_type',
+    'Residence_type', 'avg_glucose_level', 'bmi', 'smoking_status', 'stroke'
+]
+
+
+# function that converts the patient table to its compact typed representation
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the patient table to compact dtypes:
+    - categorical columns : dictionary-encoded codes over the valid values
+    - binary flags : uint8
+    - age, bmi, avg_glucose_level : float32
+
+    Args:
+        df (pd.DataFrame): Patient rows with pandas default dtypes.
+
+    Returns:
+        pd.DataFrame: Same rows with the compact dtypes.
+
+    Raises:
+        ValueError: If a categorical or binary column contains a value outside its domain.
+    """
+    typed = {'id': df['id'].astype(np.int64)}
+
+    for column, categories in CATEGORIES.items():
+        values = df[column]
+        invalid = ~values.isin(categories)
+        if invalid.any():
+            raise ValueError(f"Invalid {column} values: {sorted(values[invalid].astype(str).unique())}")
+        typed[column] = pd.Categorical(values, categories=categories)
+
+    for column in FLAGS:
+        values = df[column]
+        if not values.isin([0, 1]).all():
+            raise ValueError(f"{column} must only contain 0 or 1")
+        typed[column] = values.astype(np.uint8)
+
+    for column in MEASURES:
+        typed[column] = df[column].astype(np.float32)
+
+    return pd.DataFrame(typed, index=df.index)[COLUMNS]
+
+
+# function that measures the memory saved by the compact representation
+def memory_report(original: pd.DataFrame, typed: pd.DataFrame) -> dict:
+    """
+    Compare the memory used by the table before and after apply_schema.
+
+    Args:
+        original (pd.DataFrame): Table with pandas default dtypes.
+        typed (pd.DataFrame): Table with the compact dtypes.
+
+    Returns:
+        dict: Bytes before / after, bytes per row and reduction factor.
+    """
+    original_bytes = int(original.memory_usage(index=False, deep=True).sum())
+    typed_bytes = int(typed.memory_usage(index=False, deep=True).sum())
+    n_rows = max(len(typed), 1)
+    return {
+        "rows": len(typed),
+        "original_bytes": original_bytes,
+        "compact_bytes": typed_bytes,
+        "original_bytes_per_row": round(original_bytes / n_rows, 1),
+        "compact_bytes_per_row": round(typed_bytes / n_rows, 1),
+        "saved_bytes": original_bytes - typed_bytes,
+        "reduction_factor": round(original_bytes / max(typed_bytes, 1), 2),
+    }
+
+
+# function that finds the values outside the documented ranges
+def range_violations(df: pd.DataFrame) -> dict:
+    """
+    Flag the measures outside their documented valid range (missing values are not flagged).
+
+    Args:
+        df (pd.DataFrame): Patient rows.
+
+    Returns:
+        dict: column -> boolean Series, True where the value is out of range.
+    """
+    return {
+        column: df[column].notna() & ~df[column].between(low, high)
+        for column, (low, high) in RANGES.items() if column in df.columns
+    }
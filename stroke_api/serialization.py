@@ -0,0 +1,374 @@
+from typing import Callable, Iterable, Iterator, Optional
+import io
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from fastapi.responses import JSONResponse
+from stroke_api import metrics
+
+try:
+    # Optional fast JSON encoder (serializes NumPy arrays directly)
+    import orjson
+except ImportError:
+    orjson = None
+
+# Media types of the response modes
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+# Accept header media types -> response format
+ACCEPTED_FORMATS = {
+    JSON_MEDIA_TYPE: "json",
+    NDJSON_MEDIA_TYPE: "ndjson",
+    ARROW_STREAM_MEDIA_TYPE: "arrow",
+    PARQUET_MEDIA_TYPE: "parquet",
+    "application/x-parquet": "parquet",
+}
+
+# Response format -> media type
+FORMAT_MEDIA_TYPES = {
+    "json": JSON_MEDIA_TYPE,
+    "ndjson": NDJSON_MEDIA_TYPE,
+    "arrow": ARROW_STREAM_MEDIA_TYPE,
+    "parquet": PARQUET_MEDIA_TYPE,
+}
+
+# function that picks the response format from an Accept header
+def negotiate_format(accept: Optional[str], default: str = "json") -> str:
+    """
+    Choose the response format (json, ndjson, arrow, parquet) from an Accept header.
+
+    The supported media type with the highest quality value wins;
+    `*/*`, a missing header or only unsupported types give the default.
+
+    Args:
+        accept (Optional[str]): Accept header value.
+        default (str, optional): Format used when nothing better matches.
+
+    Returns:
+        str: Response format.
+    """
+    best_format, best_quality = default, 0.0
+    for item in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        response_format = ACCEPTED_FORMATS.get(media_type.lower())
+        if response_format is None:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality:
+            best_format, best_quality = response_format, quality
+    return best_format
+
+
+# function that converts float32 values to the float64 of their shortest decimal form
+def shortest_float64(values: np.ndarray) -> np.ndarray:
+    """
+    Round float32 values to the fewest significant digits that still read back as
+    the same float32 (at most 9), with vectorized NumPy rounding instead of strings.
+
+    Args:
+        values (np.ndarray): float32 values.
+
+    Returns:
+        np.ndarray: float64 values, e.g. 30.970085 instead of 30.970085144042969.
+    """
+    wide = values.astype(np.float64)
+    pending = np.flatnonzero(np.isfinite(wide) & (wide != 0))
+    exponent = np.floor(np.log10(np.abs(wide[pending]))).astype(np.int64)
+    # Powers of ten above 1e22 are not exact doubles : the few values that far from 1 use the string path
+    far = (exponent < -13) | (exponent > 13)
+    if far.any():
+        wide[pending[far]] = values[pending[far]].astype(str).astype(np.float64)
+        pending, exponent = pending[~far], exponent[~far]
+    for digits in range(1, 10):
+        if not len(pending):
+            break
+        # value = integer / 10**decimals, with an exact power of ten on the dividing side
+        decimals = digits - 1 - exponent
+        up = 10.0 ** np.abs(decimals)
+        rounded = np.where(
+            decimals >= 0,
+            np.round(wide[pending] * up) / up,
+            np.round(wide[pending] / up) * up
+        )
+        exact = rounded.astype(np.float32) == values[pending]
+        wide[pending[exact]] = rounded[exact]
+        pending, exponent = pending[~exact], exponent[~exact]
+    return wide
+
+
+# function that widens float32 columns without adding float32 rounding noise
+def widen_floats(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert float32 columns to float64 through their shortest decimal form,
+    so 30.970085 (float32) is written as 30.970085 and not 30.970085144042969.
+
+    Args:
+        df (pd.DataFrame): Rows to encode.
+
+    Returns:
+        pd.DataFrame: Same rows, float32 columns converted to float64.
+    """
+    float32_columns = [column for column in df.columns if df[column].dtype == np.float32]
+    if not float32_columns:
+        return df
+    return df.assign(**{column: shortest_float64(df[column].to_numpy()) for column in float32_columns})
+
+
+# function that writes the values of a column as JSON texts
+def json_values(series: pd.Series) -> pa.Array:
+    """
+    JSON text of each value of a column, computed on whole columns with Arrow.
+    Floats get their shortest round-trip form in their own width (float32 values
+    have no float32 noise, float64 values lose no digit), NaN / inf become null.
+
+    Args:
+        series (pd.Series): Column to encode.
+
+    Returns:
+        pa.Array: One large_string per value.
+    """
+    text = pa.large_string()
+    values = series.to_numpy() if not isinstance(series.dtype, pd.CategoricalDtype) else None
+    if values is not None and values.dtype.kind in 'iub':
+        return pa.array(values).cast(text)
+    if values is not None and values.dtype.kind == 'f':
+        numbers = pa.array(values)
+        strings = numbers.cast(text)
+        # Integral floats keep a decimal part (18.0), as the pandas encoder writes them
+        integral = pc.match_substring_regex(strings, r"^-?\d+$")
+        strings = pc.if_else(integral, pc.binary_join_element_wise(strings, pa.scalar(".0", text), pa.scalar("", text)), strings)
+        return pc.if_else(pc.is_finite(numbers), strings, pa.scalar("null", text))
+    # Categories and other values : one json.dumps per distinct value
+    if values is None:
+        codes, labels = series.cat.codes.to_numpy(), series.cat.categories.tolist()
+    else:
+        codes, labels = pd.factorize(series)
+        labels = labels.tolist() if hasattr(labels, 'tolist') else list(labels)
+    encoded = pa.array([json.dumps(label, default=str) for label in labels] + ["null"], type=text)
+    return encoded.take(pa.array(np.where(codes < 0, len(labels), codes)))
+
+
+# function that encodes each row of a DataFrame as one JSON object
+def json_rows(df: pd.DataFrame, separator: bytes) -> bytes:
+    """
+    Encode the rows as JSON objects, each followed by the separator,
+    joined column-wise by Arrow without per-row Python objects.
+
+    Args:
+        df (pd.DataFrame): Rows to encode.
+        separator (bytes): Text written after each object (b"," or b"\n").
+
+    Returns:
+        bytes: Encoded rows.
+    """
+    if df.empty:
+        return (b"{}" + separator) * len(df)
+    text = pa.large_string()
+    parts = []
+    for index, column in enumerate(df.columns):
+        parts.append(pa.scalar(("{" if index == 0 else ",") + json.dumps(column) + ":", text))
+        parts.append(json_values(df[column]))
+    parts.append(pa.scalar("}" + separator.decode(), text))
+    return _concat(pc.binary_join_element_wise(*parts, pa.scalar("", text)))
+
+
+# function that converts a DataFrame to a list of dicts (legacy record format)
+def frame_to_records(df: pd.DataFrame) -> list:
+    """
+    Convert rows to a list of dicts with plain Python values.
+
+    Args:
+        df (pd.DataFrame): Rows to convert.
+
+    Returns:
+        list[dict]: One dict per row.
+    """
+    return widen_floats(df).to_dict(orient='records')
+
+
+# function that encodes a DataFrame as JSON straight from its columns
+def frame_to_json(df: pd.DataFrame, shape: str = "records") -> bytes:
+    """
+    Encode a DataFrame as JSON without building per-row Python dicts.
+
+    - `records`: `[{"id": ..., "age": ...}, ...]` (column-wise Arrow encoder, see json_rows)
+    - `columns`: `{"id": [...], "age": [...]}` (orjson on the NumPy columns when installed)
+
+    Floats are written in their shortest round-trip form: float32 values without
+    float32 noise, float64 values (risk_score, distance) without losing digits.
+
+    Args:
+        df (pd.DataFrame): Rows to encode.
+        shape (str, optional): "records" or "columns".
+
+    Returns:
+        bytes: JSON body.
+    """
+    if shape == "records":
+        return b"[" + json_rows(df, b",")[:-1] + b"]"
+
+    if orjson is not None:
+        columns = {}
+        for column in df.columns:
+            values = df[column].to_numpy()
+            # orjson serializes numeric arrays natively (float32 in its shortest form);
+            # strings, categories and NaN go through lists
+            if values.dtype.kind in 'iub' or (values.dtype.kind == 'f' and not df[column].hasnans):
+                columns[column] = values
+            else:
+                columns[column] = df[column].astype(object).where(df[column].notna(), None).tolist()
+        return orjson.dumps(columns, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    # Without orjson : the values of each column encoded by Arrow
+    comma, empty = pa.scalar(",", pa.large_string()), pa.scalar("", pa.large_string())
+    parts = []
+    for column in df.columns:
+        values = pc.binary_join_element_wise(json_values(df[column]), comma, empty)
+        parts.append(json.dumps(column).encode() + b":[" + _concat(values)[:-1] + b"]")
+    return b"{" + b",".join(parts) + b"}"
+
+
+# function that encodes a DataFrame as a Parquet file
+def frame_to_parquet(df: pd.DataFrame) -> bytes:
+    """
+    Encode a DataFrame as a Parquet file.
+
+    Args:
+        df (pd.DataFrame): Rows to encode.
+
+    Returns:
+        bytes: Parquet file content.
+    """
+    sink = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), sink)
+    return sink.getvalue()
+
+
+# function that encodes a DataFrame in the negotiated format
+def encode_frame(df: pd.DataFrame, response_format: str = "json", shape: str = "records") -> bytes:
+    """
+    Encode a DataFrame as JSON (records or columns), NDJSON, Arrow IPC stream or Parquet.
+
+    Args:
+        df (pd.DataFrame): Rows to encode.
+        response_format (str, optional): json, ndjson, arrow or parquet.
+        shape (str, optional): JSON shape, "records" or "columns".
+
+    Returns:
+        bytes: Encoded body.
+    """
+    if response_format in ("json", "parquet"):
+        with metrics.stage("serialize"):
+            return frame_to_json(df, shape) if response_format == "json" else frame_to_parquet(df)
+    if response_format == "ndjson":
+        return b"".join(ndjson_stream([df]))
+    schema = pa.Schema.from_pandas(df.head(1), preserve_index=False)
+    return b"".join(arrow_stream([df], schema))
+
+
+# function that calls fn and encodes the DataFrame it returns (runs on the worker pool)
+def render_frame(fn: Callable, response_format: str = "json", shape: str = "records", **kwargs) -> bytes:
+    """
+    Call a function returning a DataFrame and encode the result.
+
+    Args:
+        fn (Callable): Function returning a DataFrame.
+        response_format (str, optional): json, ndjson, arrow or parquet.
+        shape (str, optional): JSON shape, "records" or "columns".
+        **kwargs: Arguments of fn.
+
+    Returns:
+        bytes: Encoded body.
+    """
+    return encode_frame(fn(**kwargs), response_format, shape)
+
+
+# function that calls fn and renders its result as JSON bytes (runs on the worker pool)
+def render_json(fn: Callable, **kwargs) -> bytes:
+    """
+    Call a function and serialize its result to JSON.
+
+    Used with the worker pool so both the pandas work and the JSON encoding
+    happen outside the event loop.
+
+    Args:
+        fn (Callable): Function returning JSON-compatible content.
+        **kwargs: Arguments of fn.
+
+    Returns:
+        bytes: JSON body.
+    """
+    content = fn(**kwargs)
+    with metrics.stage("serialize"):
+        return JSONResponse(content).body
+
+
+# function that encodes record batches as NDJSON (one JSON object per line)
+def ndjson_stream(batches: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    Encode DataFrame batches as newline-delimited JSON.
+
+    Args:
+        batches (Iterable[pd.DataFrame]): Record batches to encode.
+
+    Yields:
+        bytes: One chunk of NDJSON lines per batch.
+    """
+    for batch in batches:
+        if batch.empty:
+            continue
+        with metrics.stage("serialize"):
+            lines = json_rows(batch, b"\n")
+        yield lines
+
+
+# function that encodes record batches as an Arrow IPC stream
+def arrow_stream(batches: Iterable[pd.DataFrame], schema: pa.Schema) -> Iterator[bytes]:
+    """
+    Encode DataFrame batches as an Arrow IPC stream.
+
+    The schema message is sent first, then one Arrow record batch per DataFrame batch,
+    so clients can start reading before the whole result is produced.
+
+    Args:
+        batches (Iterable[pd.DataFrame]): Record batches to encode.
+        schema (pa.Schema): Arrow schema of the batches (sent even if there are no rows).
+
+    Yields:
+        bytes: Arrow IPC stream chunks.
+    """
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            with metrics.stage("serialize"):
+                writer.write_batch(pa.RecordBatch.from_pandas(batch, schema=schema, preserve_index=False))
+            yield _drain(sink)
+    yield _drain(sink)
+
+
+def _concat(strings: pa.Array) -> bytes:
+    """Concatenation of a large_string array (its values are contiguous in its data buffer)."""
+    if not len(strings):
+        return b""
+    offsets = np.frombuffer(strings.buffers()[1], dtype=np.int64)[strings.offset:strings.offset + len(strings) + 1]
+    return memoryview(strings.buffers()[2])[offsets[0]:offsets[-1]].tobytes()
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    """Return the bytes written to the sink so far and empty it."""
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
@@ -0,0 +1,215 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Default number of worker processes
+DEFAULT_WORKERS = int(os.environ.get("STROKE_API_WORKERS", str(os.cpu_count() or 2)))
+
+# Seconds a worker must live before a crash is considered a fluke and it is restarted at once
+MIN_WORKER_LIFETIME = 5.0
+
+
+# function that imports the app and loads everything the workers share
+def preload(warm: bool = True):
+    """
+    Import the API and load the current dataset (and the risk model) in this process.
+    In partitioned mode only the partition catalog is loaded, never the whole table.
+
+    The heavy modules (pandas, pyarrow, fastapi) are only imported here, so
+    `--help` and argument errors stay instant.
+
+    Args:
+        warm (bool, optional): Also build the per-version structures built on first use
+            (data cube, risk scores of the patients, similarity index).
+
+    Returns:
+        FastAPI: The application.
+    """
+    from stroke_api import cube, filters, model, neighbors, partitions
+    from stroke_api.main import app
+
+    if partitions.enabled():
+        catalog = partitions.current_catalog()
+        if model.MODEL_PATH.exists():
+            model.load_model()
+        gc.collect()
+        gc.freeze()
+        logger.info(
+            "Pre-loaded partition catalog %s (%d partitions, %d rows) in %.3f s",
+            catalog.version, len(catalog.partitions), catalog.rows, catalog.load_seconds
+        )
+        return app
+
+    dataset = filters.store.current()
+    if model.MODEL_PATH.exists():
+        model.load_model()
+        if warm:
+            model.dataset_scores(dataset)
+    if warm:
+        cube.dataset_cube(dataset)
+        neighbors.dataset_index(dataset)
+
+    # Objects created so far are never collected : keep the collector from writing
+    # to their headers in the workers, which would copy the shared pages
+    gc.collect()
+    gc.freeze()
+    logger.info("Pre-loaded dataset %s (%d rows) in %.3f s", dataset.version, dataset.n_rows, dataset.load_seconds)
+    return app
+
+
+# function run in a forked worker process
+def run_worker(app, sock: socket.socket, log_level: str) -> int:
+    """
+    Serve the app on the shared listening socket until the worker is told to stop.
+
+    Args:
+        app (FastAPI): Pre-loaded application.
+        sock (socket.socket): Listening socket bound by the parent.
+        log_level (str): Uvicorn log level.
+
+    Returns:
+        int: Exit code of the worker.
+    """
+    import uvicorn
+
+    # The parent's handlers forward signals to the workers : the worker handles them itself
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level, timeout_graceful_shutdown=10)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else 1
+
+
+# Parent process : forks the workers and restarts the ones that die
+class Supervisor:
+    """
+    Fork and supervise the worker processes. The parent has imported the app and
+    loaded the dataset and the model before forking : the workers start serving at
+    once and share these pages copy-on-write instead of each paying the load cost.
+
+    Args:
+        app (FastAPI): Pre-loaded application.
+        sock (socket.socket): Listening socket shared by the workers.
+        workers (int): Number of workers.
+        log_level (str, optional): Uvicorn log level.
+    """
+
+    def __init__(self, app, sock: socket.socket, workers: int, log_level: str = "info"):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self):
+        """Fork one worker."""
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(self.app, self.sock, self.log_level)
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+            finally:
+                # Never run the parent's cleanup code in the worker
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        logger.info("Started worker %d", pid)
+
+    def stop(self, signum, frame):
+        """Forward a stop signal to the workers."""
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        """
+        Start the workers and wait for them; a worker that exits while the server
+        is running is replaced.
+
+        Returns:
+            int: Exit code of the launcher.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.warning("Worker %d exited with status %d, restarting it", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                # Crash loop : do not fork again at full speed
+                time.sleep(1)
+            self.spawn()
+        return 0
+
+
+# function that binds the listening socket shared by the workers
+def bind_socket(host: str, port: int) -> socket.socket:
+    """
+    Bind and listen in the parent, so every worker accepts on the same socket.
+
+    Args:
+        host (str): Interface to listen on.
+        port (int): Port.
+
+    Returns:
+        socket.socket: Listening socket, inherited by the forked workers.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main(argv=None):
+    """Command line entry point : python -m stroke_api.serve"""
+    parser = argparse.ArgumentParser(description="Serve the API with pre-loaded, forked workers.")
+    parser.add_argument("--host", default=os.environ.get("STROKE_API_HOST", "127.0.0.1"), help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("STROKE_API_PORT", "8000")), help="Port")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Number of worker processes")
+    parser.add_argument("--no-warm", action="store_true", help="Do not pre-build the data cube, risk scores and similarity index")
+    parser.add_argument("--log-level", default="info", help="Log level")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    if not hasattr(os, "fork"):
+        parser.error("the pre-fork launcher needs os.fork (use uvicorn stroke_api.main:app on this platform)")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    start = time.perf_counter()
+    app = preload(warm=not args.no_warm)
+    sock = bind_socket(args.host, args.port)
+    logger.info(
+        "Ready in %.3f s, forking %d workers on %s:%d", time.perf_counter() - start, args.workers, args.host, args.port
+    )
+    return Supervisor(app, sock, args.workers, args.log_level).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
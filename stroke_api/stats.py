@@ -0,0 +1,190 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# Group keys of the partial aggregates : every filter of /patients/ can be answered from them
+GROUP_KEYS = ['gender', 'stroke', 'age']
+
+# Running sums kept per group (column -> name of the partial)
+SUM_COLUMNS = {
+    'age': 'age_sum',
+    'stroke': 'stroke_sum',
+    'hypertension': 'hypertension_sum',
+    'heart_disease': 'heart_disease_sum',
+    'avg_glucose_level': 'glucose_sum',
+    'bmi': 'bmi_sum',
+}
+
+
+# function that computes the partial aggregates of a set of rows
+def compute_partials(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compute the partial aggregates (count, sums, min/max) of each (gender, stroke, age) group.
+
+    Args:
+        df (pd.DataFrame): Patient rows.
+
+    Returns:
+        pd.DataFrame: One row per group, indexed by (gender, stroke, age).
+    """
+    grouped = df.groupby(GROUP_KEYS, sort=True, observed=True)
+    # Sums are accumulated in float64 even when the columns are stored as float32 / uint8
+    values = df[list(SUM_COLUMNS)].astype(np.float64)
+    keys = [df[key] for key in GROUP_KEYS]
+    partials = values.groupby(keys, sort=True, observed=True).sum().rename(columns=SUM_COLUMNS)
+    partials['count'] = grouped['id'].count()
+    partials['glucose_min'] = grouped['avg_glucose_level'].min()
+    partials['glucose_max'] = grouped['avg_glucose_level'].max()
+    return partials
+
+
+# function that merges two sets of partial aggregates
+def merge_partials(left: pd.DataFrame, right: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merge partial aggregates : sums and counts are added, min/max are combined.
+
+    Args:
+        left (pd.DataFrame): Partial aggregates.
+        right (pd.DataFrame): Partial aggregates of other rows.
+
+    Returns:
+        pd.DataFrame: Merged partial aggregates.
+    """
+    additive = list(SUM_COLUMNS.values()) + ['count']
+    merged = left[additive].add(right[additive], fill_value=0)
+    merged['glucose_min'] = np.fmin(
+        left['glucose_min'].reindex(merged.index), right['glucose_min'].reindex(merged.index)
+    )
+    merged['glucose_max'] = np.fmax(
+        left['glucose_max'].reindex(merged.index), right['glucose_max'].reindex(merged.index)
+    )
+    return merged
+
+
+# function that computes the /stats/ statistics from partial aggregates
+def statistics_from_partials(
+    partials: pd.DataFrame,
+    gender: Optional[str] = None,
+    stroke: Optional[int] = None,
+    max_age: Optional[float] = None
+) -> dict:
+    """
+    Sum the partial aggregates of the groups matching the filters into the /stats/ statistics.
+
+    Args:
+        partials (pd.DataFrame): Partial aggregates (see compute_partials / merge_partials).
+        gender (Optional[str], optional): Gender to keep.
+        stroke (Optional[int], optional): Stroke status to keep (0 or 1).
+        max_age (Optional[float], optional): Maximum age (inclusive).
+
+    Returns:
+        dict: Statistics (count, averages, glucose min/max).
+
+    Raises:
+        ValueError: If no patient matches the filters.
+    """
+    keys = partials.index
+    mask = np.ones(len(partials), dtype=bool)
+    if gender is not None:
+        mask &= keys.get_level_values('gender') == gender
+    if stroke is not None:
+        mask &= keys.get_level_values('stroke') == stroke
+    if max_age is not None:
+        ages = keys.get_level_values('age')
+        mask &= ages <= np.asarray(max_age, dtype=ages.dtype)
+    selected = partials[mask]
+
+    count = selected['count'].sum()
+    if count == 0:
+        raise ValueError("No patient matches these filters")
+    sums = selected[list(SUM_COLUMNS.values())].sum()
+
+    return {
+        "Total_patients": int(count),  # Count of patients
+        "Average_age": float(np.round(sums['age_sum'] / count, 2)),  # Mean age
+        "Average_stroke": float(np.round(sums['stroke_sum'] / count, 2)),  # Mean stroke rate
+        "Average_hypertension": float(np.round(sums['hypertension_sum'] / count, 2)),  # Mean hypertension
+        "Average_heart_disease": float(np.round(sums['heart_disease_sum'] / count, 2)),  # Mean heart disease
+        "Average_glucose_level": int(np.round(sums['glucose_sum'] / count, 3)),  # Mean glucose
+        "Minimum_glucose_level": int(np.round(selected['glucose_min'].min(), 3)),  # Minimum glucose
+        "Maximum_glucose_level": int(np.round(selected['glucose_max'].max(), 3)),  # Maximum glucose
+        "Average_bmi": int(sums['bmi_sum'] / count)  # Mean BMI
+    }
+
+
+# Statistics subsystem : aggregates computed once at load time and served from memory
+class StatsAggregator:
+    """
+    Keep the /stats/ aggregates in memory as per-group partial aggregates.
+
+    The partials are grouped by (gender, stroke, age), so the totals for any
+    combination of the gender, stroke and max_age filters are a sum over a few
+    hundred groups instead of a scan of the dataset.
+
+    Args:
+        df (pd.DataFrame): Patient dataset.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.partials = compute_partials(df)
+
+    def add_rows(self, rows: pd.DataFrame):
+        """
+        Update the aggregates incrementally with new patient rows.
+
+        Args:
+            rows (pd.DataFrame): New patient rows.
+        """
+        if not rows.empty:
+            self.partials = merge_partials(self.partials, compute_partials(rows))
+
+    def replace_groups(self, groups: pd.MultiIndex, rows: pd.DataFrame):
+        """
+        Recompute the partials of some groups from their current rows
+        (used when rows are removed : a minimum or maximum cannot be updated).
+
+        Args:
+            groups (pd.MultiIndex): (gender, stroke, age) groups to recompute.
+            rows (pd.DataFrame): Every current row of these groups.
+        """
+        self.partials = self.partials.drop(groups, errors='ignore')
+        self.add_rows(rows)
+
+    def reload(self, old_df: pd.DataFrame, new_df: pd.DataFrame):
+        """
+        Update the aggregates after the dataset has been reloaded.
+
+        If the new dataset only appends rows to the old one, only the new rows are
+        aggregated. Otherwise (rows changed or removed) the partials are rebuilt.
+
+        Args:
+            old_df (pd.DataFrame): Dataset before the reload.
+            new_df (pd.DataFrame): Dataset after the reload.
+        """
+        n_old = len(old_df)
+        if len(new_df) >= n_old and new_df.iloc[:n_old].equals(old_df):
+            self.add_rows(new_df.iloc[n_old:])
+        else:
+            self.partials = compute_partials(new_df)
+
+    def compute(
+        self,
+        gender: Optional[str] = None,
+        stroke: Optional[int] = None,
+        max_age: Optional[float] = None
+    ) -> dict:
+        """
+        Return the statistics of the patients matching the filters.
+
+        Args:
+            gender (Optional[str], optional): Gender to keep.
+            stroke (Optional[int], optional): Stroke status to keep (0 or 1).
+            max_age (Optional[float], optional): Maximum age (inclusive).
+
+        Returns:
+            dict: Same statistics as /stats/ (count, averages, glucose min/max).
+
+        Raises:
+            ValueError: If no patient matches the filters.
+        """
+        return statistics_from_partials(self.partials, gender=gender, stroke=stroke, max_age=max_age)
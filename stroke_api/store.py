@@ -0,0 +1,639 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from stroke_api.distribution import GROUP_KEYS as SKETCH_KEYS
+from stroke_api.distribution import DistributionAggregator
+from stroke_api.engine import LayeredEngine, QueryEngine
+from stroke_api.schema import apply_schema, memory_report
+from stroke_api.stats import GROUP_KEYS as PARTIAL_KEYS
+from stroke_api.stats import StatsAggregator
+
+try:
+    # Advisory file locks shared by the worker processes (POSIX only)
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Default location of the cleaned dataset (independent of the current directory)
+DATA_DIR = Path(__file__).resolve().parent / "data"
+DEFAULT_DATA_PATH = DATA_DIR / "clean_health.parquet"
+
+# Minimum delay (seconds) between two checks of the data file for changes
+RELOAD_CHECK_INTERVAL = float(os.environ.get("STROKE_API_RELOAD_INTERVAL", "2"))
+
+# Key of the memory report in the Arrow snapshot metadata
+MEMORY_METADATA_KEY = b"stroke_api.memory"
+
+# Number of parquet segments above which compaction merges them into one
+MAX_SEGMENTS = int(os.environ.get("STROKE_API_MAX_SEGMENTS", "16"))
+
+# Lock file of a segment directory
+SEGMENT_LOCK_NAME = ".lock"
+
+
+# Error raised when inserted patients already exist
+class PatientExistsError(ValueError):
+    """
+    Patient ids that are already in the dataset.
+
+    Args:
+        ids (list): Existing patient ids.
+    """
+
+    def __init__(self, ids: list):
+        super().__init__(f"Patient ids already exist: {ids[:20]}")
+        self.ids = ids
+
+
+# One immutable version of the dataset, with everything built from it
+class Dataset:
+    """
+    One loaded version of the patient dataset.
+
+    A request gets a Dataset once and uses it until it ends, so a hot reload
+    never changes the data under an in-flight request.
+
+    Args:
+        df (pd.DataFrame): Patient rows.
+        version (str): Identifier of this version (changes when the file changes).
+        path (Path): File the data was loaded from.
+        load_seconds (float): Time taken to load the data.
+        previous (Optional[Dataset], optional): Previous version, used to update the stats incrementally.
+        memory (Optional[dict], optional): Memory report of the compact representation.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        version: str,
+        path: Path,
+        load_seconds: float,
+        previous: Optional["Dataset"] = None,
+        memory: Optional[dict] = None
+    ):
+        self.df = df
+        self.version = version
+        self.path = path
+        self.load_seconds = load_seconds
+        self.memory = memory or {}
+        # Ingested rows not compacted yet (see DeltaDataset)
+        self.pending_rows = 0
+        self.loaded_at = time.time()
+        self.engine = QueryEngine(df)
+        self.schema = pa.Schema.from_pandas(df.head(1), preserve_index=False)
+
+        if previous is None:
+            self.stats = StatsAggregator(df)
+            self.distributions = DistributionAggregator(df)
+        else:
+            # Reuse the previous aggregates and only apply the difference
+            self.stats = copy.copy(previous.stats)
+            self.stats.reload(previous.df, df)
+            self.distributions = copy.copy(previous.distributions)
+            self.distributions.reload(previous.df, df)
+
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, name: str, builder: Callable[["Dataset"], object]):
+        """
+        Return a structure derived from this version, building it on first use.
+
+        Args:
+            name (str): Name of the derived structure.
+            builder (Callable[[Dataset], object]): Function building it from the dataset.
+
+        Returns:
+            object: The cached derived structure.
+        """
+        if name not in self._derived:
+            with self._derived_lock:
+                if name not in self._derived:
+                    self._derived[name] = builder(self)
+        return self._derived[name]
+
+    def derived_rows(self, name: str, builder: Callable[[pd.DataFrame], np.ndarray]) -> np.ndarray:
+        """
+        Return a per-row array computed from the rows (e.g. the risk scores), building it on first use.
+
+        Args:
+            name (str): Name of the derived array.
+            builder (Callable[[pd.DataFrame], np.ndarray]): Function computing one value per row.
+
+        Returns:
+            np.ndarray: Value of each row position.
+        """
+        return self.derived(name, lambda data: builder(data.df))
+
+    @property
+    def n_rows(self) -> int:
+        """Number of patients."""
+        return len(self.df)
+
+    def rows(self) -> pd.DataFrame:
+        """
+        All the patient rows as one DataFrame (for the structures built from every row).
+
+        Returns:
+            pd.DataFrame: Patient rows.
+        """
+        return self.df
+
+    def take(self, positions: np.ndarray, columns: Optional[list] = None) -> pd.DataFrame:
+        """
+        Take rows by position, only copying the requested columns.
+
+        Args:
+            positions (np.ndarray): Row positions.
+            columns (Optional[list], optional): Columns to take, default all.
+
+        Returns:
+            pd.DataFrame: Selected rows, indexed by their position.
+        """
+        if columns is None:
+            return self.df.take(positions)
+        return pd.DataFrame(
+            {column: self.df[column].take(positions) for column in columns}, index=self.df.index.take(positions)
+        )
+
+    def column(self, name: str) -> pd.Series:
+        """
+        One column over all the row positions.
+
+        Args:
+            name (str): Column name.
+
+        Returns:
+            pd.Series: Column values.
+        """
+        return self.df[name]
+
+
+# A base version plus the ingested rows not compacted yet, combined at read time
+class DeltaDataset(Dataset):
+    """
+    Version made of a base Dataset (the data file and its segments) followed by the
+    delta segment of the ingested rows. Nothing of the base is rebuilt : the delta gets
+    its own small indexes (see engine.LayeredEngine) and the reads combine both.
+    `df`, `stats` and `distributions` are only built when first used, from the base ones.
+
+    Positions below `base.n_rows` are base rows, the next ones delta rows; base rows
+    replaced by a delta row (same id) are hidden by the engine.
+
+    Args:
+        base (Dataset): Version loaded from the data file.
+        delta (pd.DataFrame): Ingested rows (unique ids) in the compact representation.
+        version (str): Identifier of this version.
+        load_seconds (float): Time taken to build it.
+    """
+
+    def __init__(self, base: Dataset, delta: pd.DataFrame, version: str, load_seconds: float):
+        self.base = base
+        self.offset = len(base.df)
+        self.delta = delta.set_axis(pd.RangeIndex(self.offset, self.offset + len(delta)))
+        self.version = version
+        self.path = base.path
+        self.load_seconds = load_seconds
+        self.memory = base.memory
+        self.pending_rows = len(delta)
+        self.loaded_at = time.time()
+        self.engine = LayeredEngine(base.engine, self.delta)
+        self.schema = base.schema
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Base rows followed by the delta rows (hidden rows included, so positions match)."""
+        return self.derived("df", lambda data: pd.concat([data.base.df, data.delta]))
+
+    @property
+    def stats(self) -> StatsAggregator:
+        """/stats/ aggregates : the base ones updated with the delta."""
+        return self.derived("stats", DeltaDataset._build_stats)
+
+    @property
+    def distributions(self) -> DistributionAggregator:
+        """/distribution sketches : the base ones updated with the delta."""
+        return self.derived("distributions", DeltaDataset._build_distributions)
+
+    @property
+    def n_rows(self) -> int:
+        """Number of patients (without the hidden rows)."""
+        return self.engine.n_rows - len(self.engine.hidden)
+
+    def derived_rows(self, name: str, builder: Callable[[pd.DataFrame], np.ndarray]) -> np.ndarray:
+        """The array of the base, followed by the values of the delta rows (see Dataset.derived_rows)."""
+        return self.derived(name, lambda data: np.concatenate([
+            data.base.derived_rows(name, builder), np.asarray(builder(data.delta))
+        ]))
+
+    def rows(self) -> pd.DataFrame:
+        """All the visible patient rows as one DataFrame."""
+        if self.engine.visible is None:
+            return self.df
+        return self.take(self.engine.all_positions())
+
+    def take(self, positions: np.ndarray, columns: Optional[list] = None) -> pd.DataFrame:
+        """Take rows by position from the base and the delta (see Dataset.take)."""
+        positions = np.asarray(positions, dtype=np.intp)
+        in_delta = positions >= self.offset
+        if not in_delta.any():
+            return self.base.take(positions, columns)
+        delta = self.delta if columns is None else self.delta[columns]
+        if in_delta.all():
+            return delta.take(positions - self.offset)
+
+        base_rows = np.flatnonzero(~in_delta)
+        delta_rows = np.flatnonzero(in_delta)
+        rows = pd.concat([
+            self.base.take(positions[base_rows], columns), delta.take(positions[delta_rows] - self.offset)
+        ])
+        order = np.concatenate([base_rows, delta_rows])
+        if (np.diff(order) < 0).any():
+            # Positions not in row order (e.g. a page in id order) : restore the requested order
+            rows = rows.take(np.argsort(order, kind='stable'))
+        return rows
+
+    def column(self, name: str) -> pd.Series:
+        """One column over all the row positions (base values, then delta values)."""
+        return pd.concat([self.base.column(name), self.delta[name]])
+
+    def _base_group_rows(self, keys: list) -> tuple:
+        """
+        Groups (values of `keys`) of the hidden base rows, and every visible base row
+        of these groups : aggregates cannot remove rows, so these groups are recomputed.
+        """
+        hidden = self.base.take(self.engine.hidden, keys).dropna().drop_duplicates()
+        groups = pd.MultiIndex.from_frame(hidden)
+        if 'age' in keys:
+            # Narrow the candidates with the age index first (a group has a single age)
+            candidates = np.unique(np.concatenate([np.empty(0, dtype=np.intp)] + [
+                self.base.engine.range_positions('age', age, age) for age in hidden['age'].unique()
+            ]))
+        else:
+            candidates = self.base.engine.all_positions()
+        candidates = candidates[self.engine.visible[candidates]]
+        rows = self.base.take(candidates)
+        return groups, rows[pd.MultiIndex.from_frame(rows[keys]).isin(groups)]
+
+    def _build_stats(self) -> StatsAggregator:
+        """Copy the base aggregates, recompute the groups of the hidden rows and add the delta."""
+        stats = copy.copy(self.base.stats)
+        if len(self.engine.hidden):
+            stats.replace_groups(*self._base_group_rows(PARTIAL_KEYS))
+        stats.add_rows(self.delta)
+        return stats
+
+    def _build_distributions(self) -> DistributionAggregator:
+        """Copy the base sketches, recompute the groups of the hidden rows and add the delta."""
+        distributions = copy.copy(self.base.distributions)
+        if len(self.engine.hidden):
+            distributions.replace_groups(*self._base_group_rows(SKETCH_KEYS))
+        distributions.add_rows(self.delta)
+        return distributions
+
+
+# function that writes an uncompressed Arrow IPC (Feather v2) snapshot of a parquet file
+def write_snapshot(source: Path, snapshot: Path):
+    """
+    Convert a parquet file into an uncompressed Arrow IPC file that can be memory-mapped.
+
+    The table is stored in its compact typed representation (see schema.apply_schema),
+    with the memory report saved in the file metadata. The snapshot is written to a
+    temporary file and renamed, so readers never see a partial file.
+
+    Args:
+        source (Path): Parquet file.
+        snapshot (Path): Arrow file to write.
+    """
+    original = pd.read_parquet(source)
+    typed = apply_schema(original)
+    report = memory_report(original, typed)
+    logger.info("Compact representation of %s: %s", source, report)
+
+    table = pa.Table.from_pandas(typed, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}), MEMORY_METADATA_KEY: json.dumps(report).encode()
+    })
+    tmp_path = snapshot.with_name(f".{snapshot.name}.{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp_path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, snapshot)
+
+
+# function that merges newer patient rows into a table
+def merge_rows(df: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply newer patient rows to a table: a row replaces the row with the same id,
+    other rows are appended (so pure inserts keep the table as a prefix).
+
+    Args:
+        df (pd.DataFrame): Patient rows.
+        rows (pd.DataFrame): Newer rows, in the same representation (the last one wins for an id).
+
+    Returns:
+        pd.DataFrame: Merged rows.
+    """
+    rows = rows.drop_duplicates('id', keep='last')
+    replaced = df['id'].isin(rows['id'])
+    if replaced.any():
+        df = df[~replaced]
+    return pd.concat([df, rows], ignore_index=True)
+
+
+# function that writes patient rows as a parquet segment
+def write_segment(rows: pd.DataFrame, segment: Path):
+    """
+    Write patient rows to a parquet segment, through a temporary file renamed
+    at the end so readers never see a partial segment.
+
+    Args:
+        rows (pd.DataFrame): Patient rows.
+        segment (Path): Parquet file to write.
+    """
+    tmp_path = segment.with_name(f".{segment.name}.{os.getpid()}.tmp")
+    rows.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, segment)
+
+
+# function that locks the segment directory against the other processes
+@contextmanager
+def segment_lock(segment_dir: Path, exclusive: bool) -> Iterator[None]:
+    """
+    Hold an advisory lock on the segment directory, shared by every process serving
+    the same data file : exclusive while segments are written or merged, shared while
+    they are listed and read, so a merge never removes a segment being read and two
+    processes never compact at the same time. Without fcntl (Windows) nothing is locked.
+
+    Args:
+        segment_dir (Path): Segment directory.
+        exclusive (bool): Exclusive (writer) or shared (reader) lock.
+    """
+    if fcntl is None or (not exclusive and not segment_dir.is_dir()):
+        yield
+        return
+    segment_dir.mkdir(parents=True, exist_ok=True)
+    with open(segment_dir / SEGMENT_LOCK_NAME, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# function that reads an Arrow IPC file through a memory map
+def read_snapshot(snapshot: Path) -> tuple:
+    """
+    Memory-map an Arrow IPC file and expose it as a DataFrame.
+
+    Numeric columns and dictionary codes point into the memory-mapped pages where
+    possible, so several worker processes share them through the OS page cache.
+
+    Args:
+        snapshot (Path): Arrow file.
+
+    Returns:
+        tuple: (patient rows, memory report stored in the snapshot or {}).
+    """
+    source = pa.memory_map(str(snapshot), 'r')
+    table = pa.ipc.open_file(source).read_all()
+    metadata = table.schema.metadata or {}
+    report = json.loads(metadata[MEMORY_METADATA_KEY]) if MEMORY_METADATA_KEY in metadata else {}
+    return table.to_pandas(split_blocks=True), report
+
+
+# Store that owns the current Dataset and swaps in a new one when the file changes
+class DatasetStore:
+    """
+    Hot-reloadable, memory-mapped dataset store.
+
+    The parquet file is converted once into an Arrow snapshot next to it
+    (`<name>.arrow`), which is memory-mapped. When the parquet file changes,
+    a new Dataset is built and swapped in atomically; requests that already
+    hold the old one keep using it.
+
+    Ingested patients are appended to an in-memory delta segment, served with the
+    base data as a new DeltaDataset version. `compact` writes the delta to a parquet
+    segment in `<name>.segments/`; the segments are applied on top of the data file
+    when it is loaded (a row replaces the row with the same id). Reads never wait
+    for writes : they keep the current version until the new one is swapped in.
+
+    The delta belongs to the process that received the rows : the other processes
+    serving the same file (stroke_api.serve workers) only see them once they are
+    compacted and the file check reloads the segments, and the duplicate id check of
+    `append` only knows the compacted rows and the rows of this process. Segments
+    have unique names and are written under `segment_lock`, so the processes can
+    compact concurrently.
+
+    Args:
+        path (Optional[Path], optional): Parquet (or Arrow) data file.
+            Defaults to $STROKE_API_DATA or stroke_api/data/clean_health.parquet.
+        check_interval (float, optional): Minimum delay between two checks for changes.
+    """
+
+    def __init__(self, path: Optional[Path] = None, check_interval: float = RELOAD_CHECK_INTERVAL):
+        self.path = Path(path or os.environ.get("STROKE_API_DATA", DEFAULT_DATA_PATH))
+        self.check_interval = check_interval
+        self.segment_dir = self.path.with_suffix('.segments')
+        self._base: Optional[Dataset] = None
+        self._dataset: Optional[Dataset] = None
+        self._delta: list = []
+        self._delta_seq = 0
+        # Identifies this process's delta versions (the delta is lost on restart)
+        self._delta_token = os.urandom(3).hex()
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> Optional[Dataset]:
+        """Current Dataset if it has been loaded, without loading or checking the file."""
+        return self._dataset
+
+    @property
+    def pending_rows(self) -> int:
+        """Number of ingested rows not compacted yet."""
+        return sum(len(rows) for rows in self._delta)
+
+    def _segment_paths(self) -> list:
+        """Parquet segments applied on top of the data file, oldest first."""
+        if not self.segment_dir.is_dir():
+            return []
+        return sorted(self.segment_dir.glob("*.parquet"))
+
+    def _next_segment(self, segments: list) -> Path:
+        """
+        Path of a new segment, named `<time_ns>-<pid>` so the processes never write the same
+        file and sorting after the existing segments (called with the exclusive lock held).
+        """
+        stamp = time.time_ns()
+        if segments:
+            stamp = max(stamp, int(segments[-1].stem.split('-')[0]) + 1)
+        return self.segment_dir / f"{stamp:020d}-{os.getpid()}.parquet"
+
+    def _file_version(self, segments: Optional[list] = None) -> str:
+        """Version of the data file, from its modification time and size, and of its segments."""
+        stat = self.path.stat()
+        version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        segments = self._segment_paths() if segments is None else segments
+        if segments:
+            version += f"-s{len(segments)}.{segments[-1].stem}"
+        return version
+
+    def _snapshot_path(self) -> Path:
+        """Arrow snapshot used for the data file."""
+        if self.path.suffix in ('.arrow', '.feather'):
+            return self.path
+        return self.path.with_suffix('.arrow')
+
+    def _load(self) -> Dataset:
+        """Load the data file (through its snapshot) and its segments as a new Dataset."""
+        start = time.perf_counter()
+        snapshot = self._snapshot_path()
+        if snapshot != self.path and (
+            not snapshot.exists() or snapshot.stat().st_mtime_ns < self.path.stat().st_mtime_ns
+        ):
+            write_snapshot(self.path, snapshot)
+        df, memory = read_snapshot(snapshot)
+        if snapshot == self.path:
+            # Arrow file given directly : make sure it uses the compact representation
+            df = apply_schema(df)
+        with segment_lock(self.segment_dir, exclusive=False):
+            segments = self._segment_paths()
+            version = self._file_version(segments)
+            rows = [pd.read_parquet(segment) for segment in segments]
+        if rows:
+            df = merge_rows(df, apply_schema(pd.concat(rows, ignore_index=True)))
+        return Dataset(
+            df, version, self.path, time.perf_counter() - start, previous=self._base, memory=memory
+        )
+
+    def _publish(self):
+        """
+        Swap in the base data combined with the delta segment (called with the lock held).
+        Only the delta is indexed : the cost depends on the pending rows, not on the base.
+        """
+        base = self._base
+        if not self._delta:
+            self._dataset = base
+            return
+        start = time.perf_counter()
+        delta = pd.concat(self._delta, ignore_index=True).drop_duplicates('id', keep='last')
+        self._dataset = DeltaDataset(
+            base, delta, f"{base.version}+{self._delta_token}.{self._delta_seq}", time.perf_counter() - start
+        )
+
+    def current(self) -> Dataset:
+        """
+        Return the current Dataset, loading or reloading it if the file changed.
+
+        Returns:
+            Dataset: Current version of the dataset.
+        """
+        dataset = self._dataset
+        if dataset is None:
+            return self.reload()
+        if time.monotonic() - self._last_check < self.check_interval:
+            return dataset
+        # Another thread is already checking / reloading : keep serving the current version
+        if not self._lock.acquire(blocking=False):
+            return dataset
+        self._lock.release()
+        return self.reload()
+
+    def reload(self, force: bool = False) -> Dataset:
+        """
+        Check the data file and swap in a new Dataset if it changed.
+
+        Args:
+            force (bool, optional): Reload even if the file did not change.
+
+        Returns:
+            Dataset: Current version of the dataset.
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            if force or self._base is None or self._base.version != self._file_version():
+                # Build the new version first, then swap the reference atomically
+                self._base = self._load()
+                self._publish()
+            return self._dataset
+
+    def append(self, rows: pd.DataFrame, replace: bool = False) -> Dataset:
+        """
+        Add patient rows to the delta segment and swap in the merged version.
+        The existing ids are the ones of this process's version : rows ingested by
+        another process are only known once compacted and reloaded.
+
+        Args:
+            rows (pd.DataFrame): Validated rows in the compact representation (see schema.apply_schema).
+            replace (bool, optional): Replace the patients that already exist instead of rejecting them.
+
+        Returns:
+            Dataset: New current version.
+
+        Raises:
+            PatientExistsError: If replace is False and some ids already exist.
+        """
+        if self._dataset is None:
+            self.reload()
+        with self._lock:
+            if not replace:
+                _, found = self._dataset.engine.lookup_ids(rows['id'].to_numpy())
+                if found.any():
+                    raise PatientExistsError(rows['id'][found].tolist())
+            self._delta.append(rows)
+            self._delta_seq += 1
+            self._publish()
+            return self._dataset
+
+    def compact(self) -> int:
+        """
+        Write the delta segment to a new parquet segment and make it part of the base data.
+        Rows ingested while the segment is written stay in the delta.
+        When there are more than MAX_SEGMENTS segments, they are merged into one.
+
+        Returns:
+            int: Number of rows compacted.
+        """
+        with self._compact_lock:
+            with self._lock:
+                parts = list(self._delta)
+            if not parts:
+                return 0
+            rows = pd.concat(parts, ignore_index=True)
+            # Written outside the store lock : ingestion goes on meanwhile
+            with segment_lock(self.segment_dir, exclusive=True):
+                write_segment(rows, self._next_segment(self._segment_paths()))
+                segments = self._segment_paths()
+                if len(segments) > MAX_SEGMENTS:
+                    self._merge_segments(segments)
+
+            with self._lock:
+                del self._delta[:len(parts)]
+                self._last_check = time.monotonic()
+                if self._base is None or self._base.version != self._file_version():
+                    self._base = self._load()
+                self._publish()
+            logger.info("Compacted %d ingested rows into %s", sum(map(len, parts)), self.segment_dir)
+            return sum(len(rows) for rows in parts)
+
+    def _merge_segments(self, segments: list):
+        """Rewrite the segments as one (called with the exclusive segment lock held)."""
+        rows = pd.concat([pd.read_parquet(segment) for segment in segments], ignore_index=True)
+        write_segment(rows.drop_duplicates('id', keep='last'), self._next_segment(segments))
+        for segment in segments:
+            segment.unlink(missing_ok=True)
@@ -0,0 +1,292 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional
+import asyncio
+import contextvars
+import os
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from stroke_api import filters
+from stroke_api import metrics
+from stroke_api.store import Dataset
+
+# Kind of pool used for CPU-heavy work : "thread" or "process"
+POOL_KIND = os.environ.get("STROKE_API_POOL", "thread")
+
+# Number of workers in the pool
+POOL_SIZE = int(os.environ.get("STROKE_API_POOL_SIZE", str(os.cpu_count() or 4)))
+
+# Default (concurrent requests, waiting requests) allowed per endpoint class
+DEFAULT_LIMITS = {
+    "lookup": (64, 256),    # single / batch id lookups
+    "bulk": (4, 16),        # full patient lists and streams
+    "aggregate": (8, 32),   # stats and aggregations
+    "ingest": (2, 32),      # bulk patient writes
+}
+
+
+# Admission control for one class of endpoints
+class EndpointLimiter:
+    """
+    Limit the number of concurrent requests of one endpoint class.
+
+    Requests over the limit wait in a queue; when the queue is full they are
+    rejected with 503 so bulk queries cannot pile up and delay cheap lookups.
+
+    Args:
+        name (str): Endpoint class name.
+        max_concurrent (int): Requests allowed to run at the same time.
+        max_waiting (int): Requests allowed to wait for a slot.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_waiting: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    async def __aenter__(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        if self.running >= self.max_concurrent and self.waiting >= self.max_waiting:
+            raise HTTPException(
+                status_code=503, detail=f"Too many {self.name} requests, retry later",
+                headers={"Retry-After": "1"}
+            )
+        async with self._condition:
+            self.waiting += 1
+            try:
+                with metrics.stage(f"queue_{self.name}"):
+                    await self._condition.wait_for(lambda: self.running < self.max_concurrent)
+            finally:
+                self.waiting -= 1
+            self.running += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.running -= 1
+            self._condition.notify()
+
+    async def acquire(self) -> Callable[[], Awaitable[None]]:
+        """
+        Take a slot for work that outlives the handler (a streamed response),
+        with the same admission rules as `async with`.
+
+        Returns:
+            Callable: Coroutine function giving the slot back; only its first call releases it.
+        """
+        await self.__aenter__()
+        released = False
+
+        async def release():
+            nonlocal released
+            if not released:
+                released = True
+                # Also released when the stream is cancelled (client gone)
+                await asyncio.shield(self.__aexit__(None, None, None))
+        return release
+
+
+# function that builds the limiters from the defaults and the environment
+def build_limiters() -> dict:
+    """
+    Build one limiter per endpoint class.
+    `STROKE_API_LIMIT_<CLASS>` and `STROKE_API_QUEUE_<CLASS>` override the defaults.
+
+    Returns:
+        dict: endpoint class -> EndpointLimiter.
+    """
+    limiters = {}
+    for name, (max_concurrent, max_waiting) in DEFAULT_LIMITS.items():
+        max_concurrent = int(os.environ.get(f"STROKE_API_LIMIT_{name.upper()}", max_concurrent))
+        max_waiting = int(os.environ.get(f"STROKE_API_QUEUE_{name.upper()}", max_waiting))
+        limiters[name] = EndpointLimiter(name, max_concurrent, max_waiting)
+    return limiters
+
+
+limiters = build_limiters()
+
+
+# function that returns the limiter of an endpoint class
+def limit(name: str) -> EndpointLimiter:
+    """
+    Get the admission limiter of an endpoint class (lookup, bulk, aggregate, ingest).
+
+    Args:
+        name (str): Endpoint class name.
+
+    Returns:
+        EndpointLimiter: Async context manager holding a slot while the request runs.
+    """
+    return limiters[name]
+
+
+# function that streams a response while holding an admission slot
+def streaming_response(chunks: AsyncIterator, release: Callable[[], Awaitable[None]], **kwargs) -> StreamingResponse:
+    """
+    Build a streamed response that keeps the slot taken with `EndpointLimiter.acquire`
+    until the last chunk is sent, so the encoding of the batches is limited as well.
+    The slot is given back when the stream ends or fails, and by a background task
+    after the response when the client went away before the end.
+
+    Args:
+        chunks (AsyncIterator): Body chunks.
+        release (Callable): Release function returned by `EndpointLimiter.acquire`.
+        **kwargs: Other arguments of StreamingResponse (media_type, headers).
+
+    Returns:
+        StreamingResponse: Response releasing the slot.
+    """
+    async def stream():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await release()
+    return StreamingResponse(stream(), background=BackgroundTask(release), **kwargs)
+
+
+# function executed in a worker process : runs fn on the dataset version of the request
+def _run_on_version(fn: Callable, version: str, kwargs: dict):
+    """Run fn on the worker's dataset, reloading it first if it is not the requested version."""
+    dataset = filters.current_dataset()
+    if dataset.version != version:
+        dataset = filters.store.reload()
+    return fn(dataset=dataset, **kwargs)
+
+
+# Pool running the CPU-heavy pandas work outside the event loop
+class WorkerPool:
+    """
+    Thread or process pool for filtering, aggregation and serialization.
+
+    Work that is not picklable (iterators, streams) always runs on the threads;
+    `run_on_dataset` uses the processes when the pool kind is "process".
+
+    Args:
+        kind (str, optional): "thread" or "process".
+        size (int, optional): Number of workers.
+    """
+
+    def __init__(self, kind: str = POOL_KIND, size: int = POOL_SIZE):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown pool kind: {kind}")
+        self.kind = kind
+        self.size = size
+        self._threads: Optional[Executor] = None
+        self._processes: Optional[Executor] = None
+
+    @property
+    def threads(self) -> Executor:
+        """Thread executor (created on first use)."""
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="stroke-api")
+        return self._threads
+
+    @property
+    def processes(self) -> Optional[Executor]:
+        """Process executor (created on first use), or None in thread mode."""
+        if self.kind == "process" and self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.size)
+        return self._processes
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Run a function on the thread pool, in a copy of the caller's context
+        (so the stage timers of stroke_api.metrics are attributed to the request).
+
+        Args:
+            fn (Callable): Function to run.
+
+        Returns:
+            object: Result of the function.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.threads, context.run, partial(fn, *args, **kwargs))
+
+    async def run_on_dataset(self, dataset: Dataset, fn: Callable, **kwargs):
+        """
+        Run `fn(dataset=..., **kwargs)` on the pool. In process mode the worker uses
+        its own copy of the same dataset version; fn and kwargs must be picklable.
+        Versions with ingested rows not compacted yet only exist in this process,
+        so they run on the threads.
+
+        Args:
+            dataset (Dataset): Dataset version of the request.
+            fn (Callable): Top-level function accepting a `dataset` keyword.
+
+        Returns:
+            object: Result of the function.
+        """
+        if self.processes is None or dataset.pending_rows:
+            return await self.run(fn, dataset=dataset, **kwargs)
+        loop = asyncio.get_running_loop()
+        # The stages run in the worker process are not visible here : the whole call is timed
+        with metrics.stage("process"):
+            return await loop.run_in_executor(
+                self.processes, partial(_run_on_version, fn, dataset.version, kwargs)
+            )
+
+    async def run_compute(self, fn: Callable, *args, **kwargs):
+        """
+        Run a CPU-bound function that does not need the dataset (numeric work on
+        small inputs) on the processes in process mode, else on the threads.
+        fn and its arguments must be picklable.
+
+        Args:
+            fn (Callable): Top-level function to run.
+
+        Returns:
+            object: Result of the function.
+        """
+        if self.processes is None:
+            return await self.run(fn, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        with metrics.stage("process"):
+            return await loop.run_in_executor(self.processes, partial(fn, *args, **kwargs))
+
+    async def iterate(self, iterator: Iterator) -> AsyncIterator:
+        """
+        Consume a blocking iterator on the thread pool (used for streamed responses).
+
+        Args:
+            iterator (Iterator): Iterator producing response chunks.
+
+        Yields:
+            object: Items of the iterator.
+        """
+        done = object()
+        while True:
+            item = await self.run(next, iterator, done)
+            if item is done:
+                break
+            yield item
+
+    def shutdown(self):
+        """Stop the executors."""
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+            self._processes = None
+
+
+# Shared pool of the API
+pool = WorkerPool()
+
+
+# function that gets the current dataset without blocking the event loop
+async def current_dataset() -> Dataset:
+    """
+    Get the current dataset; a reload (if the file changed) runs on the thread pool.
+
+    Returns:
+        Dataset: Current dataset.
+    """
+    return await pool.run(filters.current_dataset)
@@ -0,0 +1,79 @@
+from pathlib import Path
+import shutil
+import pytest
+from fastapi.testclient import TestClient
+from stroke_api import api
+from stroke_api import cache
+from stroke_api import exports
+from stroke_api import filters
+from stroke_api import model
+from stroke_api import pipeline
+from stroke_api.main import app
+from stroke_api.partitions import PartitionCatalog
+from stroke_api.store import Dataset, DatasetStore
+
+# Rows per row group of the test partitions (small, so the row-group pruning is exercised)
+TEST_ROW_GROUP_SIZE = 50
+
+
+# fixture that cleans the CSV of the repository once for the whole session
+@pytest.fixture(scope="session")
+def pipeline_output(tmp_path_factory) -> tuple:
+    """
+    Run the cleaning pipeline on the raw CSV.
+
+    Returns:
+        tuple: (directory of the partitions, parquet file with all the cleaned rows).
+    """
+    directory = tmp_path_factory.mktemp("pipeline")
+    export = directory / "clean_health.parquet"
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(pipeline, "ROW_GROUP_SIZE", TEST_ROW_GROUP_SIZE)
+        pipeline.run(output_dir=directory / "partitions", export=export)
+    return directory / "partitions", export
+
+
+# fixture with the in-memory dataset of the cleaned rows (read-only, shared)
+@pytest.fixture(scope="session")
+def dataset(pipeline_output) -> Dataset:
+    """Dataset loaded from the pipeline export, as served in in-memory mode."""
+    return DatasetStore(pipeline_output[1]).current()
+
+
+# fixture with the catalog of the same rows in partitioned mode
+@pytest.fixture(scope="session")
+def catalog(pipeline_output) -> PartitionCatalog:
+    """Catalog of the pipeline partitions, as served in partitioned mode."""
+    return PartitionCatalog(pipeline_output[0])
+
+
+# fixture with a store over a private copy of the data (for the tests that write)
+@pytest.fixture
+def store(pipeline_output, tmp_path: Path) -> DatasetStore:
+    """Store whose snapshot and segments are written in the test directory."""
+    path = tmp_path / "clean_health.parquet"
+    shutil.copy(pipeline_output[1], path)
+    return DatasetStore(path, check_interval=0)
+
+
+# fixture with a risk model trained on the cleaned rows once for the whole session
+@pytest.fixture(scope="session")
+def model_artifact(pipeline_output, tmp_path_factory) -> Path:
+    """Model artifact written by stroke_api.model.train."""
+    path = tmp_path_factory.mktemp("model") / "stroke_model.json"
+    model.train(data_path=pipeline_output[1], model_path=path)
+    return path
+
+
+# fixture with an API client serving the private store of the test
+@pytest.fixture
+def client(store, model_artifact, tmp_path: Path, monkeypatch) -> TestClient:
+    """Client of the app (lifespan included) with an empty response cache and its own export directory."""
+    monkeypatch.setattr(filters, "store", store)
+    monkeypatch.setattr(api.compactor, "store", store)
+    monkeypatch.setattr(model, "MODEL_PATH", model_artifact)
+    monkeypatch.setattr(model, "_model", None)
+    monkeypatch.setattr(exports, "manager", exports.ExportManager(tmp_path / "exports"))
+    cache.response_cache.clear()
+    with TestClient(app) as test_client:
+        yield test_client
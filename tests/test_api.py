@@ -0,0 +1,80 @@
+import json
+import numpy as np
+import pytest
+from stroke_api import api
+from stroke_api import neighbors
+
+
+def test_patient_by_id(client, dataset):
+    patient_id = int(dataset.df['id'].iat[0])
+    response = client.get(f"/patients/{patient_id}", params={"fields": "id,age"})
+    assert response.status_code == 200
+    assert response.json() == [{"id": patient_id, "age": float(dataset.df['age'].iat[0])}]
+
+
+def test_unknown_patient_id_is_404(client):
+    response = client.get("/patients/999999999")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Patient ID not found"}
+
+
+def test_similar_patients_are_the_closest(client, dataset):
+    patient_id = int(dataset.df['id'].iat[3])
+    response = client.get(f"/patients/{patient_id}/similar", params={"k": 15, "stroke": 0, "fields": "id,stroke"})
+    assert response.status_code == 200
+    similar = response.json()
+    assert len(similar) == 15 and all(patient['stroke'] == 0 for patient in similar)
+    distances = [patient['distance'] for patient in similar]
+    assert distances == sorted(distances) and patient_id not in [patient['id'] for patient in similar]
+
+    # Brute force over the feature vectors of the candidates
+    features = neighbors.SimilarityIndex(dataset.df).features.astype(np.float64)
+    candidates = np.flatnonzero((dataset.df['stroke'] == 0).to_numpy() & (dataset.df['id'] != patient_id).to_numpy())
+    expected = np.sort(np.linalg.norm(features[candidates] - features[3], axis=1))[:15]
+    np.testing.assert_allclose(distances, expected, rtol=1e-4, atol=1e-5)
+    assert client.get("/patients/999999999/similar").status_code == 404
+
+
+def test_crosstab_slices(client, dataset):
+    response = client.get("/crosstab", params={"group_by": "stroke", "gender": "Female", "metric": ["count"]})
+    assert response.status_code == 200
+    counts = dataset.df.loc[dataset.df['gender'] == 'Female', 'stroke'].value_counts()
+    assert {row['stroke']: row['count'] for row in response.json()} == counts.to_dict()
+    assert client.get("/crosstab", params={"group_by": "bmi"}).status_code == 400
+
+
+@pytest.mark.parametrize("method", ["get", "post"])
+def test_batch_keeps_the_request_order_and_reports_missing_ids(method, client, dataset):
+    ids = dataset.df['id'].sample(20, random_state=2).tolist()
+    requested = [ids[5], 999999999, *ids, ids[0], 888888888]
+    if method == "get":
+        response = client.get("/patients/batch", params={"ids": ",".join(map(str, requested)), "fields": "id,bmi"})
+    else:
+        response = client.post("/patients/batch", params={"fields": "id,bmi"}, json={"ids": requested})
+    assert response.status_code == 200
+    body = response.json()
+    # Duplicates are returned once, at their first position
+    assert [patient['id'] for patient in body['patients']] == [ids[5], *ids[:5], *ids[6:]]
+    assert body['missing'] == [999999999, 888888888]
+    bmi = dataset.df.set_index('id')['bmi'].astype(str).astype(float)
+    assert [patient['bmi'] for patient in body['patients']] == bmi[[ids[5], *ids[:5], *ids[6:]]].tolist()
+
+
+def test_batch_shapes_and_ndjson(client, dataset):
+    ids = dataset.df['id'].head(3).tolist()
+    columns = client.post("/patients/batch?shape=columns&fields=id", json={"ids": [ids[2], 7, ids[0]]}).json()
+    assert columns == {"patients": {"id": [ids[2], ids[0]]}, "missing": [7]}
+    lines = client.post("/patients/batch?format=ndjson&fields=id", json={"ids": [ids[1], 7]}).text.splitlines()
+    assert [json.loads(line) for line in lines] == [{"id": ids[1]}, {"missing": [7]}]
+    empty = client.post("/patients/batch", json={"ids": []}).json()
+    assert empty == {"patients": [], "missing": []}
+
+
+def test_batch_limits_and_errors(client, monkeypatch):
+    monkeypatch.setattr(api, "MAX_BATCH_IDS", 3)
+    assert client.post("/patients/batch", json={"ids": [1, 2, 3, 4]}).status_code == 413
+    assert client.get("/patients/batch", params={"ids": "1,2,3,4"}).status_code == 413
+    assert client.post("/patients/batch", json={"ids": [1, 2, 3]}).status_code == 200
+    assert client.get("/patients/batch", params={"ids": "1,two"}).status_code == 400
+    assert client.post("/patients/batch", json={"ids": ["x"]}).status_code == 422
+    assert client.get("/patients/batch", params={"ids": "1", "fields": "height"}).status_code == 400
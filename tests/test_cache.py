@@ -0,0 +1,58 @@
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from stroke_api import cache
+from stroke_api import filters
+
+# Request without compression, so the ETag is the strong tag of the body
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def test_etag_and_not_modified(client):
+    response = client.get("/patients/?gender=Male&stroke=1", headers=IDENTITY)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert etag.startswith('"') and "max-age" in response.headers["Cache-Control"]
+
+    # Same parameters in another order : same cached entry
+    again = client.get("/patients/?stroke=1&gender=Male", headers=IDENTITY)
+    assert again.headers["ETag"] == etag and again.content == response.content
+    assert len(cache.response_cache._entries) == 1
+
+    not_modified = client.get("/patients/?gender=Male&stroke=1", headers={**IDENTITY, "If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    listed = client.get("/patients/?gender=Male&stroke=1", headers={**IDENTITY, "If-None-Match": f'"other", W/{etag}'})
+    assert listed.status_code == 304
+    changed = client.get("/patients/?gender=Male&stroke=1", headers={**IDENTITY, "If-None-Match": '"other"'})
+    assert changed.status_code == 200 and changed.content == response.content
+
+
+def test_compressed_responses_have_a_weak_etag(client):
+    plain = client.get("/patients/?gender=Female", headers=IDENTITY)
+    compressed = client.get("/patients/?gender=Female", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"] == "W/" + plain.headers["ETag"]
+    assert compressed.content == plain.content
+    revalidated = client.get(
+        "/patients/?gender=Female", headers={"Accept-Encoding": "gzip", "If-None-Match": compressed.headers["ETag"]}
+    )
+    assert revalidated.status_code == 304
+
+
+def test_cache_key_changes_after_a_reload(client, store):
+    url = "/patients/?gender=Male&fields=id"
+    before = client.get(url, headers=IDENTITY)
+    version = store.current().version
+
+    # The data file is replaced (one patient less) : the next request sees a new version
+    table = pq.read_table(store.path)
+    removed = before.json()[0]["id"]
+    pq.write_table(table.filter(pc.not_equal(table["id"], removed)), store.path)
+    assert filters.store.current().version != version
+
+    after = client.get(url, headers={**IDENTITY, "If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert removed not in [row["id"] for row in after.json()]
+    assert len(after.json()) == len(before.json()) - 1
+    versions = {key[2] for key in cache.response_cache._entries}
+    assert versions == {version, filters.store.current().version}
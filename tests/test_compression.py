@@ -0,0 +1,80 @@
+import io
+import pandas as pd
+import pyarrow as pa
+import pytest
+from stroke_api import compression
+from stroke_api.schema import COLUMNS
+
+# Preferred coding when a client accepts every coding
+PREFERRED = compression.ENCODINGS[0]
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("GZIP;q=0.8", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=oops", None),
+    ("*", PREFERRED),
+    ("*;q=0, gzip", "gzip"),
+    ("deflate, gzip;q=0.1", "gzip"),
+    ("gzip;q=0.5, br", "br" if compression.brotli is not None else "gzip"),
+    ("zstd;q=0.2, gzip", "gzip"),
+    ("gzip, br, zstd", PREFERRED),
+])
+def test_encoding_negotiation(accept_encoding, expected):
+    assert compression.negotiate_encoding(accept_encoding) == expected
+
+
+def test_compression_thresholds():
+    assert not compression.is_compressible("application/json", compression.COMPRESS_MIN_BYTES - 1)
+    assert compression.is_compressible("application/json", compression.COMPRESS_MIN_BYTES)
+    assert compression.is_compressible("application/x-ndjson", None)
+    assert not compression.is_compressible("application/vnd.apache.parquet", 10**6)
+
+
+@pytest.mark.parametrize("count", [5, 40, 60, 400])
+def test_small_bodies_are_sent_as_is(count, client, dataset):
+    ids = ",".join(map(str, dataset.df['id'].head(count)))
+    plain = client.get("/patients/batch", params={"ids": ids, "fields": "id"}, headers={"Accept-Encoding": "identity"})
+    response = client.get("/patients/batch", params={"ids": ids, "fields": "id"}, headers={"Accept-Encoding": "gzip"})
+    compressed = len(plain.content) >= compression.COMPRESS_MIN_BYTES
+    assert ("Content-Encoding" in response.headers) == compressed
+    assert response.content == plain.content
+    if compressed:
+        assert int(response.headers["Content-Length"]) < len(plain.content)
+
+
+def test_streams_are_compressed_and_parquet_is_not(client):
+    plain = client.get("/patients/?format=ndjson&gender=Male", headers={"Accept-Encoding": "identity"})
+    stream = client.get("/patients/?format=ndjson&gender=Male", headers={"Accept-Encoding": "gzip"})
+    assert stream.headers["Content-Encoding"] == "gzip" and "Content-Length" not in stream.headers
+    assert stream.content == plain.content
+
+    parquet = client.get("/patients/?format=parquet", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in parquet.headers
+    assert len(pd.read_parquet(io.BytesIO(parquet.content))) > 0
+
+
+@pytest.mark.parametrize("fields, expected", [
+    ("id,age", ['id', 'age']),
+    (["stroke", "id,bmi", "stroke"], ['stroke', 'id', 'bmi']),
+    ("", COLUMNS),
+    ("gender, risk_score", ['gender', 'risk_score']),
+])
+def test_fields_projection(fields, expected, client):
+    records = client.get("/patients/", params={"fields": fields, "stroke": 1}).json()
+    assert records and all(list(record) == expected for record in records)
+    columns = client.get("/patients/", params={"fields": fields, "stroke": 1, "shape": "columns"}).json()
+    assert list(columns) == expected
+    arrow = client.get("/patients/", params={"fields": fields, "stroke": 1, "format": "arrow"})
+    assert pa.ipc.open_stream(arrow.content).read_all().column_names == expected
+
+
+def test_unknown_fields_are_rejected(client):
+    for url in ["/patients/", "/patients/9046", "/patients/batch?ids=9046", "/patients/9046/similar"]:
+        response = client.get(url, params={"fields": "id,height"})
+        assert response.status_code == 400
+        assert "Unknown fields: ['height']" in response.json()["detail"]
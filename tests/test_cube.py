@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from stroke_api.cube import AGE_GROUPS, crosstab
+from stroke_api.schema import AGE_GROUP_WIDTH
+
+# Metrics asked in every comparison
+METRICS = ['count', 'share', 'mean:bmi', 'sum:age', 'rate:stroke']
+
+
+# function that answers a cross-tab with a pandas groupby on the rows
+def groupby_crosstab(df: pd.DataFrame, group_by: list, filters: dict) -> pd.DataFrame:
+    """Reference answer of the cube, computed from the rows."""
+    df = df.astype({'age': np.float64, 'bmi': np.float64})
+    groups = np.minimum(df['age'] // AGE_GROUP_WIDTH, len(AGE_GROUPS) - 1).astype(int)
+    df = df.assign(age_group=groups * AGE_GROUP_WIDTH)
+    for dimension, values in filters.items():
+        df = df[df[dimension].astype(str).isin([str(value) for value in values])]
+    grouped = df.groupby(group_by, observed=True) if group_by else df.groupby(lambda _: 0)
+    result = grouped.agg(
+        count=('id', 'size'), mean_bmi=('bmi', 'mean'), sum_age=('age', 'sum'), rate_stroke=('stroke', 'mean')
+    )
+    result.insert(1, 'share', result['count'] / len(df))
+    return result.reset_index(drop=not group_by)
+
+
+@pytest.mark.parametrize("group_by, filters", [
+    ([], {}),
+    (['gender'], {}),
+    (['smoking_status', 'stroke'], {}),
+    (['age_group', 'hypertension'], {'gender': ['Female']}),
+    (['work_type'], {'Residence_type': ['Urban'], 'age_group': [40, 50, 60]}),
+    (['stroke', 'ever_married', 'heart_disease'], {'smoking_status': ['smokes', 'never smoked']}),
+])
+def test_cube_matches_pandas_groupby(group_by, filters, dataset):
+    actual = pd.DataFrame(crosstab(group_by, METRICS, filters, dataset=dataset))
+    expected = groupby_crosstab(dataset.df, group_by, filters)
+    assert len(actual) == len(expected) > 0
+    for dimension in group_by:
+        assert [str(value) for value in actual[dimension]] == [str(value) for value in expected[dimension]]
+    assert actual['count'].tolist() == expected['count'].tolist()
+    for metric in ['share', 'mean_bmi', 'sum_age', 'rate_stroke']:
+        np.testing.assert_allclose(actual[metric].astype(float), expected[metric], rtol=1e-9)
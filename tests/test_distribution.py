@@ -0,0 +1,57 @@
+import math
+import numpy as np
+import pytest
+from stroke_api.distribution import COMPRESSION, HISTOGRAM_BINS
+
+# Percentiles asked in every comparison
+PERCENTILES = [1, 10, 25, 50, 75, 90, 99]
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"gender": "Female"},
+    {"stroke": 1},
+    {"gender": ["Male", "Other"], "stroke": 0},
+])
+@pytest.mark.parametrize("column", ["age", "bmi", "avg_glucose_level"])
+def test_distribution_matches_numpy(column, filters, client, dataset):
+    response = client.get("/distribution", params={"column": column, "percentile": PERCENTILES, **filters})
+    assert response.status_code == 200
+    report = response.json()
+    df = dataset.df
+    for name, values in filters.items():
+        df = df[df[name].astype(str).isin([str(value) for value in np.atleast_1d(values)])]
+    values = df[column].to_numpy(dtype=np.float64)
+    known = values[~np.isnan(values)]
+    assert report["count"] == len(df) > 0
+
+    actual = report["columns"][column]
+    assert (actual["count"], actual["missing"]) == (len(known), len(values) - len(known))
+    assert actual["min"] == pytest.approx(known.min(), abs=1e-4)
+    assert actual["max"] == pytest.approx(known.max(), abs=1e-4)
+    assert actual["mean"] == pytest.approx(known.mean(), abs=1e-4)
+    # The rank error is below the width of the central t-digest centroids (plus one value)
+    known = np.sort(known)
+    for percentile in PERCENTILES:
+        estimate = actual["percentiles"][f"p{percentile}"]
+        ranks = np.searchsorted(known, [estimate - 1e-4, estimate + 1e-4], side='right') / len(known)
+        tolerance = math.pi / COMPRESSION + 1 / len(known)
+        assert ranks[0] - tolerance <= percentile / 100 <= ranks[1] + tolerance
+
+    histogram = actual["histogram"]
+    edges = np.asarray(histogram["edges"])
+    assert len(edges) == HISTOGRAM_BINS + 1
+    assert histogram["counts"] == np.histogram(known, bins=edges)[0].tolist()
+    assert histogram["below"] == np.count_nonzero(known < edges[0])
+    assert histogram["above"] == np.count_nonzero(known > edges[-1])
+
+
+@pytest.mark.parametrize("params, message", [
+    ({"column": "stroke"}, "Unknown distribution column"),
+    ({"gender": "Unknown"}, "Unknown value for gender"),
+    ({"stroke": 2}, "stroke must be 0 or 1"),
+    ({"percentile": 101}, "percentiles must be between 0 and 100"),
+])
+def test_invalid_distribution_parameters_are_rejected(params, message, client):
+    response = client.get("/distribution", params=params)
+    assert response.status_code == 400 and message in response.json()["detail"]
@@ -0,0 +1,132 @@
+import io
+import subprocess
+import sys
+import threading
+import time
+import pandas as pd
+from stroke_api import exports
+from stroke_api import query as patient_query
+from stroke_api import serialization
+
+
+# function that waits for the end of an export
+def wait_finished(manager: exports.ExportManager, job_id: str) -> exports.ExportJob:
+    """Poll the job until it is done, failed or cancelled."""
+    for _ in range(500):
+        job = manager.get(job_id)
+        if job is None or job.finished:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_other_workers_see_the_job(dataset, tmp_path):
+    writer = exports.ExportManager(tmp_path)
+    query = patient_query.compile_where("stroke == 1")
+    job = writer.submit(dataset, "csv", query=query, fields=['id', 'age'])
+    assert wait_finished(writer, job.id).status == exports.DONE
+
+    # Another server process reads the state written next to the file
+    other = exports.ExportManager(tmp_path)
+    seen = other.get(job.id)
+    assert {**seen.to_dict(), "seconds": None} == {**job.to_dict(), "seconds": None}
+    assert other.submit(dataset, "csv", query=query, fields=['id', 'age']).status == exports.DONE
+    assert other._executor is None
+    expected = dataset.df.loc[dataset.df['stroke'] == 1, ['id', 'age']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(pd.read_csv(seen.path), expected, check_dtype=False)
+
+    assert other.cancel(job.id).status == exports.DONE
+    assert writer.get(job.id) is None
+    assert list(tmp_path.iterdir()) == []
+    writer.shutdown()
+
+
+def test_other_workers_cancel_the_job(dataset, tmp_path):
+    writer = exports.ExportManager(tmp_path, workers=1)
+    blocked = threading.Event()
+    writer.executor.submit(blocked.wait)
+    job = writer.submit(dataset, "parquet")
+
+    other = exports.ExportManager(tmp_path)
+    assert other.get(job.id).status == exports.QUEUED
+    other.cancel(job.id)
+    assert other.get(job.id) is None
+    blocked.set()
+    assert wait_finished(writer, job.id) is None
+    assert job.status == exports.CANCELLED
+    assert list(tmp_path.iterdir()) == []
+    writer.shutdown()
+
+
+def test_jobs_of_stopped_workers_are_failed(dataset, tmp_path):
+    stopped = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    job = exports.ExportJob("0" * 24, dataset.version, "csv", None, None, False, tmp_path / f"{'0' * 24}.csv")
+    job.pid = int(stopped.stdout)
+    job.status = exports.RUNNING
+    job.save()
+    seen = exports.ExportManager(tmp_path).get(job.id)
+    assert seen.status == exports.FAILED
+    assert exports.ExportManager(tmp_path).get("../" + job.id) is None
+
+
+# function that waits for an export through the API
+def poll_export(client, location: str) -> dict:
+    """Poll the status URL until the job is finished."""
+    for _ in range(500):
+        status = client.get(location).json()
+        if status["status"] not in (exports.QUEUED, exports.RUNNING):
+            return status
+        time.sleep(0.01)
+    raise TimeoutError(location)
+
+
+def test_export_endpoints(client, dataset):
+    response = client.post("/exports", params={"format": "csv", "stroke": 1, "fields": "id,age,bmi"})
+    assert response.status_code == 202
+    location = response.headers["Location"]
+    status = poll_export(client, location)
+    assert status["status"] == exports.DONE and status["progress"] == 1.0
+    expected = dataset.df.loc[dataset.df['stroke'] == 1, ['id', 'age', 'bmi']].reset_index(drop=True)
+    assert status["rows_total"] == status["rows_written"] == len(expected)
+
+    # The same export of the same version is the same job
+    again = client.post("/exports", params={"fields": "id,age,bmi", "stroke": 1})
+    assert again.status_code == 200 and again.json()["id"] == status["id"]
+
+    full = client.get(status["download"], headers={"Accept-Encoding": "identity"})
+    assert full.status_code == 200 and full.headers["Accept-Ranges"] == "bytes"
+    assert int(full.headers["Content-Length"]) == status["size_bytes"]
+    actual = pd.read_csv(io.BytesIO(full.content))
+    pd.testing.assert_frame_equal(actual, serialization.widen_floats(expected), check_exact=True)
+
+    # An interrupted download resumes with a byte range (never compressed)
+    head = client.get(status["download"], headers={"Range": "bytes=0-99", "Accept-Encoding": "gzip"})
+    assert head.status_code == 206 and "Content-Encoding" not in head.headers
+    assert head.headers["Content-Range"] == f"bytes 0-99/{status['size_bytes']}"
+    tail = client.get(status["download"], headers={"Range": "bytes=100-"})
+    assert head.content + tail.content == full.content
+
+    deleted = client.delete(location)
+    assert deleted.status_code == 200
+    assert client.get(location).status_code == 404
+    assert client.get(status["download"]).status_code == 404
+    assert client.delete(location).status_code == 404
+
+
+def test_parquet_export_and_download_before_the_end(client, dataset):
+    blocked = threading.Event()
+    exports.manager.executor.submit(blocked.wait)
+    exports.manager.executor.submit(blocked.wait)
+    try:
+        response = client.post("/exports", params={"format": "parquet", "risk_score": "true", "gender": "Male"})
+        status = response.json()
+        assert status["status"] == exports.QUEUED
+        assert client.get(f"/exports/{status['id']}/download").status_code == 409
+    finally:
+        blocked.set()
+    status = poll_export(client, response.headers["Location"])
+    actual = pd.read_parquet(io.BytesIO(client.get(status["download"]).content))
+    expected = dataset.df[dataset.df['gender'] == 'Male'].reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual.drop(columns='risk_score'), expected, check_categorical=False)
+    assert actual['risk_score'].between(0, 1).all()
+    assert client.post("/exports", params={"format": "xml"}).status_code == 422
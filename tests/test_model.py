@@ -0,0 +1,108 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import pytest
+from stroke_api import model
+
+# Penalty used to fit the test models
+L2 = 1.0
+
+
+# function that computes the penalized negative log-likelihood minimized by the fit
+def objective(df: pd.DataFrame, fitted: model.RiskModel, intercept: float, coefficients: np.ndarray) -> float:
+    """Penalized negative log-likelihood of the labels for other weights (same standardization)."""
+    X = model.feature_matrix(df, fitted.means, fitted.scales)
+    p = np.clip(1 / (1 + np.exp(-(X @ coefficients + intercept))), 1e-15, 1 - 1e-15)
+    y = df['stroke'].to_numpy(dtype=np.float64)
+    return float(-np.sum(y * np.log(p) + (1 - y) * np.log(1 - p)) + L2 / 2 * coefficients @ coefficients)
+
+
+def test_fit_minimizes_the_penalized_log_likelihood(dataset):
+    fitted = model.RiskModel.fit(dataset.df, l2=L2)
+    weights = np.concatenate([[fitted.intercept], fitted.coefficients])
+    best = objective(dataset.df, fitted, weights[0], weights[1:])
+
+    # Central finite differences : the gradient vanishes at the optimum
+    step = 1e-5
+    gradient = []
+    for index in range(len(weights)):
+        shift = np.zeros_like(weights)
+        shift[index] = step
+        up, down = weights + shift, weights - shift
+        difference = objective(dataset.df, fitted, up[0], up[1:]) - objective(dataset.df, fitted, down[0], down[1:])
+        gradient.append(difference / (2 * step))
+    assert np.abs(gradient).max() < 1e-3
+    moved = weights + np.random.default_rng(0).normal(0, 0.05, len(weights))
+    assert objective(dataset.df, fitted, moved[0], moved[1:]) > best
+
+
+def test_fit_recovers_the_probabilities_of_synthetic_labels(dataset):
+    rows = dataset.df.sample(60_000, replace=True, random_state=0).reset_index(drop=True)
+    numeric = rows[model.NUMERIC_FEATURES].to_numpy(dtype=np.float64)
+    means, scales = np.nanmean(numeric, axis=0), np.nanstd(numeric, axis=0)
+    rng = np.random.default_rng(1)
+    truth = model.RiskModel(rng.normal(0, 0.6, len(model.feature_names())), -2.0, means, scales)
+    probabilities = truth.score(rows)
+    rows['stroke'] = (rng.random(len(rows)) < probabilities).astype(np.uint8)
+
+    fitted = model.RiskModel.fit(rows, l2=L2)
+    assert np.abs(fitted.score(rows) - probabilities).mean() < 0.01
+
+
+def test_batched_scores_equal_single_scores(dataset, model_artifact, monkeypatch):
+    monkeypatch.setattr(model, "MODEL_PATH", model_artifact)
+    monkeypatch.setattr(model, "_model", None)
+    calls = []
+
+    async def run(fn):
+        calls.append(fn)
+        return fn()
+
+    batcher = model.MicroBatcher(run, max_rows=1000, max_wait=0.05)
+    frames = [dataset.df.iloc[start:start + size] for start, size in [(0, 1), (1, 7), (8, 1), (9, 30)]]
+
+    async def score_all():
+        return await asyncio.gather(*[batcher.score(frame) for frame in frames])
+
+    first_loop = asyncio.new_event_loop()
+    try:
+        batched = first_loop.run_until_complete(score_all())
+        assert len(calls) == 1
+        for frame, scores in zip(frames, batched):
+            np.testing.assert_allclose(scores, model.load_model().score(frame), rtol=1e-12)
+
+        # Another event loop, while the first one is still open, gets its own queue and task
+        batched = asyncio.run(asyncio.wait_for(score_all(), 5))
+        assert len(calls) == 2
+        assert [len(scores) for scores in batched] == [1, 7, 1, 30]
+        assert first_loop.run_until_complete(asyncio.wait_for(batcher.score(frames[0]), 5)).shape == (1,)
+        first_loop.run_until_complete(batcher.stop())
+    finally:
+        first_loop.close()
+
+
+def test_batch_errors_reach_every_request(dataset):
+    async def run(fn):
+        raise RuntimeError("model failed")
+
+    batcher = model.MicroBatcher(run, max_wait=0.01)
+
+    async def score_all():
+        return await asyncio.gather(
+            batcher.score(dataset.df.head(2)), batcher.score(dataset.df.head(3)), return_exceptions=True
+        )
+
+    assert [str(error) for error in asyncio.run(score_all())] == ["model failed", "model failed"]
+
+
+def test_predict_endpoint(client, dataset):
+    features = dataset.df.head(5)[model.INPUT_COLUMNS].astype(object).to_dict(orient='records')
+    features = [{**patient, 'bmi': None if index == 2 else patient['bmi']} for index, patient in enumerate(features)]
+    expected = model.load_model().score(pd.DataFrame(features, columns=model.INPUT_COLUMNS).astype({'bmi': 'float64'}))
+
+    response = client.post("/predict", json=features)
+    assert response.status_code == 200
+    np.testing.assert_allclose(response.json()["risk_scores"], expected, rtol=1e-9)
+    single = client.post("/predict", json=features[0]).json()
+    assert single == {"risk_score": pytest.approx(expected[0], rel=1e-9), "model_version": model.load_model().version}
+    assert client.post("/predict", json={**features[0], "gender": "Unknown"}).status_code == 422
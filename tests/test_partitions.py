@@ -0,0 +1,185 @@
+import gc
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+from stroke_api import filters
+from stroke_api import model
+from stroke_api import partitions
+from stroke_api import query as patient_query
+from stroke_api.main import app
+from stroke_api.partitions import PartitionCatalog
+
+# Filters run in both modes : float32 equality, negations, in-lists, ranges and categories
+WHERE_EXPRESSIONS = [
+    "bmi == 25.1",
+    "bmi != 25.1",
+    "bmi in [25.1, 30.2, 28.0]",
+    "bmi not in [25.1, 28.0]",
+    "avg_glucose_level == 228.69",
+    "avg_glucose_level <= 80.5 and bmi >= 35.5",
+    "age >= 60 and bmi > 30",
+    "age == 1.32 or age == 0.08",
+    "smoking_status in [smokes, 'never smoked'] and stroke == 1",
+    "not gender == Female",
+    "work_type != children or hypertension == 1",
+    "Residence_type == Urban and heart_disease == 1 and age < 50",
+    "id in [9046, 51676, 12345678]",
+    "gender == Nobody",
+]
+
+
+@pytest.fixture(autouse=True)
+def inline_scan(monkeypatch):
+    """Scan the partitions in the test process."""
+    monkeypatch.setattr(partitions, "PARTITION_WORKERS", 0)
+
+
+@pytest.mark.parametrize("where", WHERE_EXPRESSIONS)
+def test_rows_match_in_memory(where, dataset, catalog):
+    query = patient_query.compile_where(where)
+    expected = filters.select_patients(query=query, dataset=dataset)
+    expected = expected.sort_values('id', ignore_index=True)
+    actual = partitions.select_patients(query=query, catalog=catalog)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_float_equality_matches_stored_values(dataset, catalog):
+    query = patient_query.compile_where("bmi == 25.1")
+    matched = partitions.select_patients(query=query, catalog=catalog)
+    assert len(matched) > 0
+    others = partitions.select_patients(query=patient_query.compile_where("bmi != 25.1"), catalog=catalog)
+    assert len(matched) + len(others) == dataset.engine.n_rows
+
+
+@pytest.mark.parametrize("fields", [None, ['age', 'stroke']])
+def test_pages_match_in_memory(fields, dataset, catalog):
+    query = patient_query.compile_where("bmi != 25.1 and age > 40")
+    after_id, pages = None, 0
+    while True:
+        expected, expected_next = filters.get_patient_page(
+            query=query, after_id=after_id, limit=400, fields=fields, dataset=dataset
+        )
+        actual, actual_next = partitions.get_patient_page(
+            query=query, after_id=after_id, limit=400, fields=fields, catalog=catalog
+        )
+        pd.testing.assert_frame_equal(actual, expected.reset_index(drop=True))
+        assert actual_next == expected_next
+        pages += 1
+        if actual_next is None:
+            break
+        after_id = actual_next
+    assert pages > 1
+
+
+@pytest.mark.parametrize("gender, stroke, max_age", [
+    (None, None, None),
+    ("Male", None, None),
+    ("Female", 1, 70),
+    (None, 0, 25.5),
+])
+def test_statistics_match_in_memory(gender, stroke, max_age, dataset, catalog):
+    expected = filters.patient_statistics(gender=gender, stroke=stroke, max_age=max_age, dataset=dataset)
+    actual = partitions.patient_statistics(gender=gender, stroke=stroke, max_age=max_age, catalog=catalog)
+    assert actual == expected
+
+
+def test_pruning_skips_row_groups(catalog):
+    query = patient_query.from_params(stroke=1, ranges={'age': (80, None)})
+    planned = sum(len(partition.plan(query)) for partition in catalog.partitions)
+    assert 0 < planned < sum(len(partition.row_groups) for partition in catalog.partitions)
+
+
+def test_worker_processes_match_inline_scan(monkeypatch, catalog):
+    query = patient_query.compile_where("bmi != 25.1 and smoking_status == smokes")
+    expected = partitions.select_patients(query=query, catalog=catalog)
+    monkeypatch.setattr(partitions, "PARTITION_WORKERS", 2)
+    try:
+        actual = partitions.select_patients(query=query, catalog=catalog)
+        statistics = partitions.patient_statistics(gender="Male", catalog=PartitionCatalog(catalog.directory))
+    finally:
+        partitions.shutdown()
+    pd.testing.assert_frame_equal(actual, expected)
+    assert statistics["Total_patients"] > 0
+
+
+@pytest.mark.parametrize("fields", [None, ['age', 'stroke'], ['id', 'risk_score']])
+def test_batch_lookup_matches_in_memory(fields, dataset, catalog, model_artifact, monkeypatch):
+    monkeypatch.setattr(model, "MODEL_PATH", model_artifact)
+    monkeypatch.setattr(model, "_model", None)
+    ids = dataset.df['id'].sample(50, random_state=0).tolist()
+    ids = [12345678] + ids[:25] + [ids[3], 87654321] + ids[25:]
+    expected, expected_missing = filters.get_patients_batch(ids, fields=fields, dataset=dataset)
+    actual, actual_missing = partitions.get_patients_batch(ids, fields=fields, catalog=catalog)
+    pd.testing.assert_frame_equal(actual, expected.reset_index(drop=True), check_exact=False, rtol=1e-6)
+    assert actual_missing == expected_missing == [12345678, 87654321]
+
+
+# fixture with the API served from the partitions
+@pytest.fixture
+def partitioned_client(store, model_artifact, pipeline_output, monkeypatch):
+    """Client of the API in partitioned mode, over a store that must stay unloaded."""
+    monkeypatch.setattr(filters, "store", store)
+    monkeypatch.setattr(partitions, "PARTITION_DIR", str(pipeline_output[0]))
+    monkeypatch.setattr(partitions, "_catalog", None)
+    monkeypatch.setattr(model, "MODEL_PATH", model_artifact)
+    monkeypatch.setattr(model, "_model", None)
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def test_lookups_read_the_partitions(partitioned_client, dataset):
+    patient_id = int(dataset.df['id'].iloc[10])
+    response = partitioned_client.get(f"/patients/{patient_id}?fields=id,age")
+    assert response.status_code == 200
+    assert response.json() == [{"id": patient_id, "age": float(dataset.df['age'].iloc[10])}]
+    assert partitioned_client.get("/patients/999999999").status_code == 404
+
+    response = partitioned_client.post("/patients/batch?fields=id", json={"ids": [patient_id, 999999999, 9046]})
+    assert response.json() == {"patients": [{"id": patient_id}, {"id": 9046}], "missing": [999999999]}
+    lines = partitioned_client.get(f"/patients/batch?ids={patient_id},999999999&format=ndjson&fields=id").text
+    assert lines.splitlines() == [f'{{"id":{patient_id}}}', '{"missing": [999999999]}']
+    assert filters.store.loaded is None
+
+
+@pytest.mark.parametrize("method, url", [
+    ("get", "/patients/9046/similar"),
+    ("get", "/aggregate?group_by=gender"),
+    ("get", "/crosstab?group_by=gender"),
+    ("get", "/risk-factors?factor=hypertension"),
+    ("get", "/distribution?column=age"),
+    ("post", "/exports"),
+])
+def test_whole_table_endpoints_are_rejected(method, url, partitioned_client):
+    response = getattr(partitioned_client, method)(url)
+    assert response.status_code == 501
+    assert "partitioned mode" in response.json()["detail"]
+    assert filters.store.loaded is None
+
+
+def test_preload_only_loads_the_catalog(pipeline_output, store, monkeypatch):
+    from stroke_api import serve
+    monkeypatch.setattr(filters, "store", store)
+    monkeypatch.setattr(partitions, "PARTITION_DIR", str(pipeline_output[0]))
+    monkeypatch.setattr(partitions, "_catalog", None)
+    try:
+        serve.preload(warm=True)
+    finally:
+        gc.unfreeze()
+    assert partitions.loaded() is not None
+    assert store.loaded is None
+
+
+def test_catalog_is_checked_once_per_interval(pipeline_output, monkeypatch):
+    calls = []
+    signatures = partitions._signatures
+    monkeypatch.setattr(partitions, "_signatures", lambda directory: calls.append(directory) or signatures(directory))
+    monkeypatch.setattr(partitions, "_catalog", None)
+    monkeypatch.setattr(partitions, "CATALOG_CHECK_INTERVAL", 60)
+    first = partitions.current_catalog(pipeline_output[0])
+    checks = len(calls)
+    assert all(partitions.current_catalog(pipeline_output[0]) is first for _ in range(20))
+    assert len(calls) == checks
+
+    monkeypatch.setattr(partitions, "CATALOG_CHECK_INTERVAL", 0)
+    assert partitions.current_catalog(pipeline_output[0]) is first
+    assert len(calls) == checks + 1
@@ -0,0 +1,71 @@
+import re
+import numpy as np
+import pytest
+from stroke_api import query as patient_query
+from stroke_api.query import And, Condition, Not, Or
+
+
+@pytest.mark.parametrize("where, expected", [
+    ("age >= 40", Condition('age', '>=', (40.0,))),
+    ("gender = Male", Condition('gender', '==', ('Male',))),
+    ("smoking_status == 'never smoked'", Condition('smoking_status', '==', ('never smoked',))),
+    ('work_type in [Private, "Self-employed"]', Condition('work_type', 'in', ('Private', 'Self-employed'))),
+    ("stroke NOT IN [0]", Condition('stroke', 'not in', (0,))),
+    ("bmi < -1.5", Condition('bmi', '<', (-1.5,))),
+    ("id in [9046, 51676]", Condition('id', 'in', (9046, 51676))),
+])
+def test_conditions_are_parsed(where, expected):
+    assert patient_query.compile_where(where) == expected
+
+
+def test_and_binds_tighter_than_or():
+    assert patient_query.compile_where("stroke == 1 or age > 60 and bmi > 30") == Or((
+        Condition('stroke', '==', (1,)),
+        And((Condition('age', '>', (60.0,)), Condition('bmi', '>', (30.0,)))),
+    ))
+
+
+def test_parentheses_and_not_override_precedence():
+    assert patient_query.compile_where("(stroke == 1 or age > 60) and not not bmi > 30") == And((
+        Or((Condition('stroke', '==', (1,)), Condition('age', '>', (60.0,)))),
+        Not(Not(Condition('bmi', '>', (30.0,)))),
+    ))
+    assert patient_query.compile_where("not stroke == 1 and age > 60") == And((
+        Not(Condition('stroke', '==', (1,))), Condition('age', '>', (60.0,)),
+    ))
+
+
+@pytest.mark.parametrize("where, message", [
+    ("height > 2", "Unknown filter column"),
+    ("age >= ", "Unexpected end of expression"),
+    ("age >= 40 and", "Unexpected end of expression"),
+    ("(age >= 40 stroke == 1)", "Expected ')', got 'stroke'"),
+    ("age >= 40)", "Unexpected token"),
+    ("age 40", "Expected an operator after age"),
+    ("gender > Male", "only supports ==, !=, in and not in"),
+    ("age == old", "values must be numbers"),
+    ("age == [40, 50]", "Expected a value"),
+    ("gender in Male", "Expected '['"),
+    ("age >= 40 ; drop", "Invalid syntax near"),
+    ("== 40", "Expected a column name"),
+])
+def test_invalid_expressions_are_rejected(where, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        patient_query.compile_where(where)
+
+
+@pytest.mark.parametrize("where, mask", [
+    ("age >= 60 and bmi > 30", lambda df: (df['age'] >= 60) & (df['bmi'] > 30)),
+    ("stroke == 1 or age > 75 and hypertension == 1",
+     lambda df: (df['stroke'] == 1) | ((df['age'] > 75) & (df['hypertension'] == 1))),
+    ("not (gender == Female or smoking_status in [smokes, Unknown])",
+     lambda df: ~((df['gender'] == 'Female') | df['smoking_status'].isin(['smokes', 'Unknown']))),
+    ("work_type not in [Private] and avg_glucose_level <= 80.5",
+     lambda df: ~df['work_type'].isin(['Private']) & (df['avg_glucose_level'] <= np.float32(80.5))),
+])
+def test_queries_match_pandas_masks(where, mask, dataset):
+    query = patient_query.compile_where(where)
+    expected = np.flatnonzero(mask(dataset.df).to_numpy())
+    assert len(expected) > 0
+    assert np.array_equal(patient_query.execute(query, dataset), expected)
+    assert np.array_equal(np.flatnonzero(patient_query.evaluate_frame(query, dataset.df)), expected)
@@ -0,0 +1,71 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from stroke_api import risk_factors
+
+# z value of the 95 % normal interval
+Z_95 = 1.959964
+
+
+# function that computes the 2x2 ratios of one level from the rows
+def reference_ratios(df: pd.DataFrame, factor: str, level, reference) -> dict:
+    """Relative risk and odds ratio with their Katz / Woolf log-normal 95 % intervals."""
+    table = pd.crosstab(df[factor].astype(object), df['stroke'])
+    a, b = table.loc[level, 1], table.loc[level, 0]
+    c, d = table.loc[reference, 1], table.loc[reference, 0]
+    relative_risk = (a / (a + b)) / (c / (c + d))
+    odds_ratio = (a * d) / (b * c)
+    rr_error = math.sqrt(1 / a - 1 / (a + b) + 1 / c - 1 / (c + d))
+    or_error = math.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+    return {
+        "patients": int(a + b), "strokes": int(a),
+        "relative_risk": relative_risk, "odds_ratio": odds_ratio,
+        "relative_risk_interval": relative_risk * np.exp([-Z_95 * rr_error, Z_95 * rr_error]),
+        "odds_ratio_interval": odds_ratio * np.exp([-Z_95 * or_error, Z_95 * or_error]),
+    }
+
+
+@pytest.mark.parametrize("factor, level", [
+    ("hypertension", 1),
+    ("heart_disease", 1),
+    ("smoking_status", "smokes"),
+    ("smoking_status", "formerly smoked"),
+    ("ever_married", "Yes"),
+])
+def test_ratios_and_intervals_match_the_closed_forms(factor, level, client, dataset):
+    response = client.get("/risk-factors", params={"factor": factor, "min_age": 30, "resamples": 4000})
+    assert response.status_code == 200
+    report = response.json()
+    df = dataset.df[dataset.df['age'] >= 30]
+    assert report["patients"] == len(df) and report["strokes"] == int(df['stroke'].sum())
+    assert report["resamples"] == 4000
+
+    row = next(row for row in report["factors"] if row["level"] == level)
+    expected = reference_ratios(df, factor, level, risk_factors.REFERENCE_LEVELS[factor])
+    assert (row["patients"], row["strokes"]) == (expected["patients"], expected["strokes"])
+    assert row["relative_risk"] == pytest.approx(expected["relative_risk"], rel=1e-12)
+    assert row["odds_ratio"] == pytest.approx(expected["odds_ratio"], rel=1e-12)
+    for name in ("relative_risk", "odds_ratio"):
+        low, high = row[f"{name}_low"], row[f"{name}_high"]
+        assert low < row[name] < high
+        # The percentile bootstrap is close to the log-normal interval
+        np.testing.assert_allclose(np.log([low, high]), np.log(expected[f"{name}_interval"]), atol=0.12)
+
+    reference = next(row for row in report["factors"] if row["level"] == risk_factors.REFERENCE_LEVELS[factor])
+    assert reference["relative_risk"] == reference["odds_ratio"] == 1.0
+    assert reference["relative_risk_low"] is None
+
+
+def test_empty_cells_get_the_haldane_correction():
+    counts = np.array([[20, 5], [10, 0], [0, 0]])
+    relative_risk, odds_ratio = risk_factors.ratios(counts, reference=0)
+    assert relative_risk[1] == pytest.approx((0.5 / 11) / (5.5 / 26))
+    assert odds_ratio[1] == pytest.approx((0.5 * 20.5) / (10.5 * 5.5))
+    assert relative_risk[0] == odds_ratio[0] == 1.0
+    assert np.isnan(relative_risk[2]) and np.isnan(odds_ratio[2])
+
+
+def test_invalid_factors_are_rejected(client):
+    response = client.get("/risk-factors", params={"factor": "bmi"})
+    assert response.status_code == 400 and "Unknown factors" in response.json()["detail"]
@@ -0,0 +1,63 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from stroke_api import serialization
+
+# Measures whose float64 / float32 values must be written as typed
+ROWS = pd.DataFrame({
+    'id': [1, 2, 3],
+    'avg_glucose_level': [228.69, 106.1, 55.22],
+    'bmi': np.array([36.6, 25.1, 30.970085], dtype=np.float32),
+})
+
+# Expected text of the measures in the JSON bodies
+EXPECTED = {'avg_glucose_level': ['228.69', '106.1', '55.22'], 'bmi': ['36.6', '25.1', '30.970085']}
+
+
+@pytest.mark.parametrize("with_orjson", [True, False])
+@pytest.mark.parametrize("shape", ["records", "columns"])
+def test_json_floats_have_no_rounding_noise(shape, with_orjson, monkeypatch):
+    if not with_orjson:
+        monkeypatch.setattr(serialization, "orjson", None)
+    body = serialization.frame_to_json(ROWS, shape=shape).decode()
+    for values in EXPECTED.values():
+        for value in values:
+            assert f"{value}," in body or f"{value}]" in body or f"{value}}}" in body
+    assert "99999" not in body and "00001" not in body
+    decoded = json.loads(body)
+    records = decoded if shape == "records" else pd.DataFrame(decoded).to_dict(orient='records')
+    assert [record['avg_glucose_level'] for record in records] == [228.69, 106.1, 55.22]
+
+
+def test_ndjson_floats_have_no_rounding_noise():
+    lines = b"".join(serialization.ndjson_stream([ROWS.head(2), ROWS.tail(1)])).decode().splitlines()
+    assert [json.loads(line)['bmi'] for line in lines] == [36.6, 25.1, 30.970085]
+    assert '"avg_glucose_level":228.69' in lines[0]
+
+
+def test_shortest_float64_matches_the_shortest_decimal():
+    rng = np.random.default_rng(0)
+    values = (rng.standard_normal(100_000) * 10.0 ** rng.integers(-20, 20, 100_000)).astype(np.float32)
+    values = np.concatenate([values, np.array([0, -0.0, np.nan, np.inf, 1e-45, 18, 0.1], dtype=np.float32)])
+    np.testing.assert_array_equal(serialization.shortest_float64(values), values.astype(str).astype(np.float64))
+
+
+@pytest.mark.parametrize("with_orjson", [True, False])
+@pytest.mark.parametrize("shape", ["records", "columns"])
+def test_json_float64_values_are_lossless(shape, with_orjson, monkeypatch):
+    if not with_orjson:
+        monkeypatch.setattr(serialization, "orjson", None)
+    scores = np.random.default_rng(1).random(1000)
+    scores[[3, 7]] = [np.nan, 18.0]
+    rows = pd.DataFrame({'id': np.arange(1000), 'risk_score': scores, 'gender': pd.Categorical(['Male', None] * 500)})
+    decoded = json.loads(serialization.frame_to_json(rows, shape=shape))
+    columns = decoded if shape == "columns" else {
+        column: [record[column] for record in decoded] for column in rows.columns
+    }
+    assert columns['risk_score'][:3] + columns['risk_score'][4:] == scores[[0, 1, 2, *range(4, 1000)]].tolist()
+    assert columns['risk_score'][3] is None
+    assert columns['gender'][:2] == ['Male', None]
+    lines = b"".join(serialization.ndjson_stream([rows])).decode().splitlines()
+    assert [json.loads(line)['risk_score'] for line in lines[4:]] == scores[4:].tolist()
+    assert '"risk_score":18.0' in lines[7]
@@ -0,0 +1,204 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pytest
+from stroke_api import filters
+from stroke_api import neighbors
+from stroke_api import query as patient_query
+from stroke_api import store as dataset_store
+from stroke_api.aggregate import aggregate_patients
+from stroke_api.cube import crosstab
+from stroke_api.ingest import validate_rows
+from stroke_api.risk_factors import contingency_tables
+from stroke_api.store import Dataset, DatasetStore, DeltaDataset, PatientExistsError, merge_rows
+
+# Filters compared between a version with pending rows and the same rows merged
+DELTA_WHERE_EXPRESSIONS = [
+    "age == 1.5",
+    "age >= 60 and bmi > 30",
+    "gender != Female",
+    "stroke == 1 or hypertension == 1",
+    "smoking_status not in [smokes, Unknown]",
+    "bmi != 36.6",
+    "not (work_type == Private and age < 40)",
+]
+
+# Ids of the ingested test patients (above the ids of the dataset)
+FIRST_NEW_ID = 10_000_000
+
+
+# function that builds valid new patient rows
+def new_rows(first_id: int, count: int, **values) -> pd.DataFrame:
+    """Validated rows of `count` patients with consecutive ids, overriding some columns."""
+    record = {
+        'gender': 'Female', 'age': 67.0, 'hypertension': 0, 'heart_disease': 1, 'ever_married': 'Yes',
+        'work_type': 'Private', 'Residence_type': 'Urban', 'avg_glucose_level': 228.69, 'bmi': 36.6,
+        'smoking_status': 'formerly smoked', 'stroke': 1,
+    }
+    record.update(values)
+    return validate_rows([{**record, 'id': first_id + offset} for offset in range(count)])
+
+
+# function run by the processes of the concurrent compaction test
+def ingest_and_compact(path: str, first_id: int, batches: int) -> int:
+    """Append and compact small batches from a separate process, merging the segments often."""
+    dataset_store.MAX_SEGMENTS = 3
+    store = DatasetStore(Path(path), check_interval=0)
+    for batch in range(batches):
+        store.append(new_rows(first_id + batch * 10, 10))
+        store.compact()
+    return batches * 10
+
+
+def test_append_then_compact_round_trip(store):
+    base = store.current()
+    n_rows = base.n_rows
+
+    appended = store.append(new_rows(FIRST_NEW_ID, 5))
+    assert appended.pending_rows == 5
+    assert appended.n_rows == n_rows + 5
+    assert appended.engine.lookup_id(FIRST_NEW_ID + 4) is not None
+    assert appended.version != base.version
+
+    assert store.compact() == 5
+    compacted = store.current()
+    assert compacted.pending_rows == 0
+    assert len(store._segment_paths()) == 1
+
+    # A new store (e.g. after a restart) loads the segment on top of the data file
+    reloaded = DatasetStore(store.path, check_interval=0).current()
+    pd.testing.assert_frame_equal(
+        reloaded.rows().sort_values('id', ignore_index=True), appended.rows().sort_values('id', ignore_index=True)
+    )
+    assert reloaded.stats.compute() == compacted.stats.compute()
+
+
+def test_duplicate_ids_are_rejected_or_replaced(store):
+    store.append(new_rows(FIRST_NEW_ID, 3))
+    with pytest.raises(PatientExistsError):
+        store.append(new_rows(FIRST_NEW_ID + 2, 2))
+
+    existing = int(store.current().df['id'].iat[0])
+    replaced = store.append(new_rows(existing, 1, age=1.5), replace=True)
+    position = replaced.engine.lookup_id(existing)
+    assert replaced.df['age'].iat[position] == 1.5
+    store.compact()
+    reloaded = DatasetStore(store.path, check_interval=0).current()
+    assert reloaded.n_rows == replaced.n_rows
+    assert reloaded.df.loc[reloaded.df['id'] == existing, 'age'].tolist() == [1.5]
+
+
+def test_segments_are_merged(store, monkeypatch):
+    monkeypatch.setattr(dataset_store, "MAX_SEGMENTS", 2)
+    for batch in range(5):
+        store.append(new_rows(FIRST_NEW_ID + batch * 10, 10))
+        store.compact()
+        assert len(store._segment_paths()) <= 2
+    reloaded = DatasetStore(store.path, check_interval=0).current()
+    assert reloaded.engine.lookup_ids(range(FIRST_NEW_ID, FIRST_NEW_ID + 50))[1].all()
+
+
+def test_processes_compact_concurrently(store):
+    n_rows = store.current().n_rows
+    with ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            executor.submit(ingest_and_compact, str(store.path), FIRST_NEW_ID + worker * 1000, 8)
+            for worker in range(4)
+        ]
+        written = sum(future.result() for future in futures)
+
+    reloaded = DatasetStore(store.path, check_interval=0).current()
+    assert len(reloaded.df) == n_rows + written
+    assert reloaded.df['id'].is_unique
+
+
+def test_pending_rows_are_served_like_merged_rows(store):
+    base = store.current()
+    first_ids = base.df['id'].head(40).tolist()
+    store.append(new_rows(FIRST_NEW_ID, 30))
+    store.append(new_rows(FIRST_NEW_ID + 100, 20, gender='Male', stroke=0, age=1.5))
+    # Replace base patients (some change group) and a pending patient
+    store.append(new_rows(first_ids[0], 1, age=1.5, gender='Male'), replace=True)
+    store.append(validate_rows([
+        {**row, 'bmi': 36.6, 'stroke': 1 - row['stroke']} for row in base.df.head(40).tail(30).to_dict('records')
+    ]), replace=True)
+    layered = store.append(new_rows(FIRST_NEW_ID + 5, 1, age=80.0), replace=True)
+    assert isinstance(layered, DeltaDataset)
+
+    merged = Dataset(
+        merge_rows(base.df, layered.delta), "merged", base.path, 0.0
+    )
+    assert layered.n_rows == merged.n_rows
+
+    def ids(dataset, positions):
+        return np.sort(dataset.take(positions, ['id'])['id'].to_numpy())
+
+    for where in DELTA_WHERE_EXPRESSIONS:
+        query = patient_query.compile_where(where)
+        assert np.array_equal(
+            ids(layered, filters.matching_positions(query=query, dataset=layered)),
+            ids(merged, filters.matching_positions(query=query, dataset=merged))
+        ), where
+    for gender, stroke, max_age in [(None, None, None), ('Male', 0, None), ('Female', 1, 50.0), (None, None, 2.0)]:
+        assert np.array_equal(
+            ids(layered, filters.matching_positions(gender=gender, stroke=stroke, max_age=max_age, dataset=layered)),
+            ids(merged, filters.matching_positions(gender=gender, stroke=stroke, max_age=max_age, dataset=merged))
+        )
+        assert (
+            layered.stats.compute(gender=gender, stroke=stroke, max_age=max_age)
+            == merged.stats.compute(gender=gender, stroke=stroke, max_age=max_age)
+        )
+
+    after_id = None
+    while True:
+        page, next_after_id = filters.get_patient_page(limit=700, after_id=after_id, dataset=layered)
+        expected, expected_next = filters.get_patient_page(limit=700, after_id=after_id, dataset=merged)
+        pd.testing.assert_frame_equal(page.reset_index(drop=True), expected.reset_index(drop=True))
+        assert next_after_id == expected_next
+        if next_after_id is None:
+            break
+        after_id = next_after_id
+
+    lookup = [first_ids[0], FIRST_NEW_ID + 5, FIRST_NEW_ID + 119, 1]
+    rows, missing = filters.get_patients_batch(lookup, dataset=layered)
+    expected, expected_missing = filters.get_patients_batch(lookup, dataset=merged)
+    pd.testing.assert_frame_equal(rows.reset_index(drop=True), expected.reset_index(drop=True))
+    assert missing == expected_missing
+
+    for gender in [['Male'], None]:
+        # The percentiles are t-digest estimates, which depend on the order of the merges
+        actual = layered.distributions.compute(gender=gender)
+        expected = merged.distributions.compute(gender=gender)
+        for column, summary in expected['columns'].items():
+            percentiles = actual['columns'][column].pop('percentiles')
+            tolerance = 0.01 * (summary['max'] - summary['min'])
+            assert percentiles == pytest.approx(summary.pop('percentiles'), abs=tolerance)
+        assert actual == expected
+    assert crosstab(['gender', 'stroke'], dataset=layered) == crosstab(['gender', 'stroke'], dataset=merged)
+    assert aggregate_patients(['smoking_status'], ['count', 'mean:bmi'], dataset=layered) == aggregate_patients(
+        ['smoking_status'], ['count', 'mean:bmi'], dataset=merged
+    )
+    for factor, table in contingency_tables(dataset=layered).items():
+        assert np.array_equal(table, contingency_tables(dataset=merged)[factor])
+
+
+def test_similarity_index_reuses_the_base_index(store):
+    base = store.current()
+    base_index = neighbors.dataset_index(base)
+    store.append(new_rows(FIRST_NEW_ID, 30))
+    store.append(new_rows(base.df['id'].iat[5], 1, age=1.5, gender='Male'), replace=True)
+    layered = store.append(new_rows(FIRST_NEW_ID + 100, 5, bmi=22.0, stroke=0))
+    assert neighbors.dataset_index(layered).base is base_index
+
+    # Same neighbours as an index of the merged rows with the standardization of the base
+    merged = Dataset(merge_rows(base.df, layered.delta), "merged", base.path, 0.0)
+    merged_index = neighbors.SimilarityIndex(merged.df, (base_index.means, base_index.scales))
+    for patient_id in [base.df['id'].iat[0], base.df['id'].iat[5], FIRST_NEW_ID + 3, FIRST_NEW_ID + 102]:
+        for query in [None, patient_query.compile_where("stroke == 0")]:
+            actual = neighbors.similar_patients(patient_id, k=40, query=query, fields=['id'], dataset=layered)
+            candidates = filters.matching_positions(query=query, dataset=merged)
+            positions, distances = merged_index.nearest(merged.engine.lookup_id(patient_id), 40, candidates)
+            assert actual['id'].tolist() == merged.df['id'].to_numpy()[positions].tolist()
+            np.testing.assert_allclose(actual['distance'], distances, rtol=1e-5, atol=1e-6)
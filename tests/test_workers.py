@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from stroke_api import workers
+from stroke_api.workers import EndpointLimiter
+
+
+# function that yields a few chunks, like the encoded batches of a stream
+async def chunks(count: int = 3):
+    for index in range(count):
+        await asyncio.sleep(0)
+        yield f"chunk {index}\n".encode()
+
+
+def test_stream_holds_the_slot_until_the_end():
+    async def scenario():
+        limiter = EndpointLimiter("bulk", 1, 0)
+        release = await limiter.acquire()
+        response = workers.streaming_response(chunks(), release, media_type="application/x-ndjson")
+        body = response.body_iterator
+        assert await body.__anext__() == b"chunk 0\n"
+        assert limiter.running == 1
+        # No slot and no room in the queue : the next stream is rejected
+        with pytest.raises(HTTPException) as error:
+            await limiter.acquire()
+        assert error.value.status_code == 503
+        assert [chunk async for chunk in body] == [b"chunk 1\n", b"chunk 2\n"]
+        assert limiter.running == 0
+        # The background task after the response does not release the slot twice
+        await response.background()
+        assert limiter.running == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_is_released_when_the_client_goes_away():
+    async def scenario():
+        limiter = EndpointLimiter("lookup", 1, 0)
+        release = await limiter.acquire()
+        response = workers.streaming_response(chunks(), release)
+        await response.body_iterator.__anext__()
+        # Disconnected client : the stream is never finished, the background task runs
+        await response.background()
+        assert limiter.running == 0
+        await response.body_iterator.aclose()
+        assert limiter.running == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("path, limiter", [
+    ("/patients/?format=ndjson&limit=700", "bulk"),
+    ("/patients/?format=arrow", "bulk"),
+    ("/patients/batch?ids=1,2,3&format=ndjson", "lookup"),
+])
+def test_streamed_endpoints_give_their_slot_back(client, path, limiter):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert len(response.content) > 0
+    assert workers.limiters[limiter].running == 0